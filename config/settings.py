@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'passages.middleware.CompressionMiddleware',  # gzip/brotli for API payloads
+    'django.middleware.http.ConditionalGetMiddleware',  # ETag + 304 responses, computed on the uncompressed body
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -57,6 +59,65 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Responses smaller than this (in bytes) are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '500'))
+
+# How long browsers/CDNs may cache grade levels and skill categories (seconds)
+REFERENCE_DATA_MAX_AGE = int(os.getenv('REFERENCE_DATA_MAX_AGE', '3600'))
+
+# Max age (seconds) of the process-local GradeLevel/SkillCategory cache. Writes
+# invalidate it immediately in processes sharing the CACHES backend.
+REFERENCE_CACHE_TTL = int(os.getenv('REFERENCE_CACHE_TTL', '300'))
+
+# Single-flight question generation: a generation lock older than this (seconds)
+# is treated as abandoned, and callers wait at most GENERATION_WAIT_TIMEOUT for one
+GENERATION_LOCK_TTL = int(os.getenv('GENERATION_LOCK_TTL', '300'))
+GENERATION_WAIT_TIMEOUT = int(os.getenv('GENERATION_WAIT_TIMEOUT', '120'))
+
+# Document downloads (/api/documents/<id>/download/, see passages/downloads.py)
+# MEDIA_ACCEL: '' = Django streams the file (development), 'nginx' = X-Accel-Redirect
+# to MEDIA_ACCEL_PREFIX (an `internal` location aliased to MEDIA_ROOT), 'sendfile' = X-Sendfile
+MEDIA_ACCEL = os.getenv('MEDIA_ACCEL', '')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+DOCUMENT_URL_EXPIRY = int(os.getenv('DOCUMENT_URL_EXPIRY', '300'))  # lifetime (seconds) of presigned S3 URLs
+DOCUMENT_DOWNLOADS_PUBLIC = os.getenv('DOCUMENT_DOWNLOADS_PUBLIC', 'True') == 'True'  # False: uploader/staff only
+
+# Resumable chunked uploads (/api/uploads/, see passages/uploads.py). Chunks are
+# staged in UPLOAD_STAGING_DIR, which must be shared if there are several app servers.
+UPLOAD_STAGING_DIR = os.getenv('UPLOAD_STAGING_DIR', str(BASE_DIR / 'upload_staging'))
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', str(100 * 1024 * 1024)))  # bytes per file
+UPLOAD_CHUNK_MAX_SIZE = int(os.getenv('UPLOAD_CHUNK_MAX_SIZE', str(8 * 1024 * 1024)))  # bytes per PUT
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', str(24 * 60 * 60)))  # seconds an unfinished upload is kept
+UPLOAD_FINALIZE_TIMEOUT = int(os.getenv('UPLOAD_FINALIZE_TIMEOUT', '600'))  # seconds before a stuck finalize can be retried
+
+# .docx parsing runs in a pool of worker processes (passages/extraction.py); 0 = in the web process
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', '2'))
+EXTRACTION_TIMEOUT = int(os.getenv('EXTRACTION_TIMEOUT', '30'))  # wall-clock seconds per document
+EXTRACTION_CPU_SECONDS = int(os.getenv('EXTRACTION_CPU_SECONDS', '20'))  # CPU seconds per document
+EXTRACTION_MEMORY_MB = int(os.getenv('EXTRACTION_MEMORY_MB', '512'))  # address-space limit per worker
+EXTRACTION_TASKS_PER_CHILD = int(os.getenv('EXTRACTION_TASKS_PER_CHILD', '50'))  # restart workers after this many documents
+
+# Write-behind quiz submissions (passages/submissions.py): scores are returned immediately and
+# submissions are journalled to a local SQLite file, then bulk-inserted by
+# `manage.py flush_quiz_journal --loop` (run one next to each web server)
+QUIZ_WRITE_BEHIND = os.getenv('QUIZ_WRITE_BEHIND', 'False') == 'True'
+QUIZ_JOURNAL_PATH = os.getenv('QUIZ_JOURNAL_PATH', str(BASE_DIR / 'quiz_journal.sqlite3'))
+# Store new submissions' answers packed on QuizResponse instead of one UserAnswer row each
+# (passages/packed_answers.py); `manage.py compact_user_answers` packs older ones
+QUIZ_PACK_ANSWERS = os.getenv('QUIZ_PACK_ANSWERS', 'False') == 'True'
+
+# Near-duplicate questions (passages/near_duplicates.py): 'flag' sets duplicate_of, 'drop' also skips
+# duplicates within the same document, 'off' disables the check
+QUESTION_DUPLICATES = os.getenv('QUESTION_DUPLICATES', 'flag')
+QUESTION_DUPLICATE_THRESHOLD = float(os.getenv('QUESTION_DUPLICATE_THRESHOLD', '0.8'))  # estimated Jaccard similarity of 5-char shingles
+# Largest question bank (bytes) POST /api/questions/import/ takes; bigger ones go through `manage.py import_questions`
+QUESTION_IMPORT_MAX_UPLOAD = int(os.getenv('QUESTION_IMPORT_MAX_UPLOAD', str(5 * 1024 * 1024)))
+
+# How long (seconds) a stored Idempotency-Key response is replayed for retries
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', str(24 * 60 * 60)))
+# How long (seconds) an unfinished first attempt holds its key before a retry may take it over
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', '120'))
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -178,9 +239,19 @@ if USE_S3:
     AWS_QUERYSTRING_AUTH = False  # Don't add complex authentication-related query parameters
     
     # File handling
-    AWS_DEFAULT_ACL = 'public-read'  # Set to None for private files
+    # Private objects unless downloads are public; clients always go through the download endpoint (presigned URLs)
+    AWS_DEFAULT_ACL = os.getenv('AWS_DEFAULT_ACL', 'public-read' if DOCUMENT_DOWNLOADS_PUBLIC else '') or None
     AWS_S3_FILE_OVERWRITE = False  # Don't overwrite files with the same name
-    
+
+    # Stream large uploads to S3 in parallel multipart chunks straight from the local upload
+    from boto3.s3.transfer import TransferConfig
+    AWS_S3_TRANSFER_CONFIG = TransferConfig(
+        multipart_threshold=int(os.getenv('AWS_S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024)),
+        multipart_chunksize=int(os.getenv('AWS_S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024)),
+        max_concurrency=int(os.getenv('AWS_S3_MAX_CONCURRENCY', 4)),
+        use_threads=True,
+    )
+
     # Media files in S3
     MEDIA_URL = f'{AWS_S3_ENDPOINT_URL}/{AWS_STORAGE_BUCKET_NAME}/'
     MEDIA_ROOT = ''
@@ -193,6 +264,9 @@ else:
     MEDIA_URL = '/media/'
     MEDIA_ROOT = BASE_DIR / 'media'
 
+# Fast JSON rendering (orjson + values()-based read serializers) for the read-heavy endpoints
+USE_FAST_JSON = os.getenv('USE_FAST_JSON', 'False') == 'True'
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',  # Change to IsAuthenticated for production
@@ -205,6 +279,12 @@ REST_FRAMEWORK = {
     ],
 }
 
+if USE_FAST_JSON:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
+        'passages.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ]
+
 # Using CsrfExemptSessionAuthentication disables CSRF checks for API endpoints, which is standard for REST APIs consumed by JS frontends.
 
 # CORS Configuration
@@ -1,13 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('', include('passages.urls')),     # Handles web views + /api/
     path('admin/', admin.site.urls),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# No static() route for MEDIA_ROOT: document files are only served by
+# /api/documents/<id>/download/, which checks who may download them
 
 
@@ -6,10 +6,98 @@ quiz data, including documents, questions, answers, and user responses.
 """
 
 from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from django.utils.html import format_html, format_html_join
 from .models import (
     UploadedDocument, GradeLevel, SkillCategory, 
-    QuizQuestion, QuizAnswer, QuizResponse, UserAnswer
+    QuizQuestion, QuizAnswer, QuizResponse, UserAnswer, GenerationLock, StoredBlob
 )
+from .packed_answers import answer_records
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """
+    Foreign-key filter picked with the admin's autocomplete widget (searching
+    the related admin's search_fields) instead of a list of every related row.
+    Costs one query, for the selected object's name, when a value is selected.
+    Use as list_filter = [('document', AutocompleteFilter)]; the admin needs
+    AutocompleteFilterMedia for the widget's scripts.
+    """
+    template = 'admin/passages/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        super().__init__(field, request, params, model, model_admin, field_path)
+        # Where the autocomplete view looks the field up: the last model on the path
+        self.app_label = field.model._meta.app_label
+        self.model_name = field.model._meta.model_name
+        self.field_name = field.name
+        self.selected = None
+        value = self.used_parameters.get(self.lookup_kwarg)
+        if value:
+            try:
+                self.selected = field.remote_field.model._default_manager.filter(pk=value).first()
+            except (ValueError, ValidationError):
+                pass  # the changelist rejects the parameter when it filters
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        query_string = changelist.get_query_string(remove=[self.lookup_kwarg])
+        self.select_url = f"{query_string}{'&' if len(query_string) > 1 else ''}{self.lookup_kwarg}="
+        yield {
+            'selected': self.selected is None,
+            'query_string': query_string,
+            'display': 'All',
+        }
+
+
+class AutocompleteFilterMedia:
+    """Scripts for AutocompleteFilter (select2 loads between jQuery and jquery.init.js)"""
+    js = [
+        'admin/js/vendor/jquery/jquery.js',
+        'admin/js/vendor/select2/select2.full.js',
+        'admin/js/jquery.init.js',
+        'admin/js/autocomplete.js',
+    ]
+    css = {'screen': ['admin/css/vendor/select2/select2.css', 'admin/css/autocomplete.css']}
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that counts an unfiltered PostgreSQL table from the planner's
+    statistics (pg_class.reltuples) once it is past ESTIMATE_ABOVE rows,
+    instead of a COUNT(*) over the whole table on every changelist page.
+    Filtered changelists and other databases are counted exactly.
+    """
+    ESTIMATE_ABOVE = 100_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                               [connection.ops.quote_name(queryset.model._meta.db_table)])
+                row = cursor.fetchone()
+            if row and row[0] > self.ESTIMATE_ABOVE:  # -1 until the table was first analyzed
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables that grow with usage (questions, answers, responses)"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # no second COUNT(*) of the unfiltered table next to filtered results
+    Media = AutocompleteFilterMedia
 
 
 @admin.register(GradeLevel)
@@ -39,52 +127,94 @@ class UploadedDocumentAdmin(admin.ModelAdmin):
     Manages uploaded reading passages and their metadata.
     """
     list_display = ['title', 'uploaded_at', 'grade_level', 'skill_category']  # Key fields in list view
+    list_select_related = ['grade_level', 'skill_category']  # nullable foreign keys are not joined by default
     list_filter = ['uploaded_at', 'grade_level', 'skill_category']  # Filter options in sidebar
-    search_fields = ['title', 'parsed_text']  # Search by title and document content
-    readonly_fields = ['uploaded_at']  # Prevent editing of upload timestamp
+    search_fields = ['title']  # Search by title (parsed_text is stored compressed, see compression.py)
+    readonly_fields = ['uploaded_at', 'parsed_text']  # Prevent editing of upload timestamp; the text comes from the file
 
 
 @admin.register(QuizQuestion)
-class QuizQuestionAdmin(admin.ModelAdmin):
+class QuizQuestionAdmin(LargeTableAdmin):
     """
     Admin interface for QuizQuestion model.
     Manages questions generated from uploaded documents.
     """
-    list_display = ['question_text', 'document', 'created_at']  # Show question, source document, and creation date
-    list_filter = ['created_at', 'document']  # Filter by creation date and source document
+    list_display = ['question_text', 'document', 'duplicate_of', 'created_at']  # Show question, source document, and creation date
+    list_select_related = ['document', 'duplicate_of__document']  # str(question) shows its document's title
+    list_filter = ['created_at', ('duplicate_of', admin.EmptyFieldListFilter), ('document', AutocompleteFilter)]  # Filter by creation date, near-duplicates and source document
     search_fields = ['question_text', 'document__title']  # Search by question text and document title
     readonly_fields = ['created_at']  # Prevent editing of creation timestamp
+    raw_id_fields = ['document', 'duplicate_of']  # too many rows for select boxes
 
 
 @admin.register(QuizAnswer)
-class QuizAnswerAdmin(admin.ModelAdmin):
+class QuizAnswerAdmin(LargeTableAdmin):
     """
     Admin interface for QuizAnswer model.
     Manages answer choices for quiz questions.
     """
     list_display = ['choice_letter', 'choice_text', 'question', 'is_correct']  # Show choice letter, text, question, and correctness
-    list_filter = ['is_correct', 'question__document']  # Filter by correctness and source document
+    list_select_related = ['question__document']  # str(question) shows its document's title
+    list_filter = ['is_correct', ('question__document', AutocompleteFilter)]  # Filter by correctness and source document
+    raw_id_fields = ['question']  # the question bank is too large for a select box
     search_fields = ['choice_text', 'question__question_text']  # Search by answer text and question text
 
 
 @admin.register(QuizResponse)
-class QuizResponseAdmin(admin.ModelAdmin):
+class QuizResponseAdmin(LargeTableAdmin):
     """
     Admin interface for QuizResponse model.
     Manages user quiz submissions and scores.
     """
     list_display = ['document', 'user_name', 'score', 'total_questions', 'submitted_at']  # Show quiz results summary
-    list_filter = ['submitted_at', 'document']  # Filter by submission date and document
+    list_select_related = ['document']  # Avoid a query per row for the document title
+    list_filter = ['submitted_at', ('document', AutocompleteFilter)]  # Filter by submission date and document
+    raw_id_fields = ['document', 'user']  # too many rows for select boxes
     search_fields = ['user_name', 'document__title']  # Search by user name and document title
-    readonly_fields = ['submitted_at']  # Prevent editing of submission timestamp
+    readonly_fields = ['submitted_at', 'answers']  # Prevent editing of submission timestamp; answers are shown, not edited
+
+    @admin.display(description='Answers')
+    def answers(self, obj):
+        """The selected choice per question, from UserAnswer rows or the packed columns"""
+        records = answer_records(obj)
+        texts = dict(QuizQuestion.objects.filter(id__in=[r[0] for r in records]).values_list('id', 'question_text'))
+        return format_html('<ol>{}</ol>', format_html_join('', '<li>{} &ndash; {} {}</li>', (
+            (texts.get(question_id, f'deleted question {question_id}'), choice_letter, '✓' if is_correct else '✗')
+            for question_id, choice_letter, is_correct in records
+        )))
 
 
 @admin.register(UserAnswer)
-class UserAnswerAdmin(admin.ModelAdmin):
+class UserAnswerAdmin(LargeTableAdmin):
     """
     Admin interface for UserAnswer model.
     Manages individual user answers to quiz questions.
     """
     list_display = ['response', 'question', 'selected_answer', 'is_correct']  # Show user's answer and correctness
-    list_filter = ['is_correct', 'response__document']  # Filter by correctness and source document
+    # Each column's str() follows one more foreign key (response/question -> document, answer -> question)
+    list_select_related = ['response__document', 'question__document', 'selected_answer__question']
+    list_filter = ['is_correct', ('response__document', AutocompleteFilter)]  # Filter by correctness and source document
+    raw_id_fields = ['response', 'question', 'selected_answer']  # too many rows for select boxes
     search_fields = ['response__user_name', 'question__question_text']  # Search by user name and question text
+
+
+@admin.register(GenerationLock)
+class GenerationLockAdmin(admin.ModelAdmin):
+    """
+    Admin interface for GenerationLock model.
+    Shows documents whose questions are being generated; delete a row to clear a stuck lock.
+    """
+    list_display = ['document', 'owner', 'acquired_at', 'expires_at']  # Who holds the lock and until when
+    list_select_related = ['document']  # Avoid a query per row for the document title
+    readonly_fields = ['document', 'owner', 'acquired_at', 'expires_at']  # Locks are managed by the app
+
+
+@admin.register(StoredBlob)
+class StoredBlobAdmin(admin.ModelAdmin):
+    """
+    Admin interface for StoredBlob model.
+    Shows content-addressed files and how many documents share each one.
+    """
+    list_display = ['name', 'size', 'ref_count', 'created_at']  # Storage path, bytes and number of documents using it
+    search_fields = ['content_hash', 'name']  # Look up a blob by hash or path
+    readonly_fields = ['content_hash', 'name', 'size', 'ref_count', 'created_at']  # Managed by the app (see blobs.py)
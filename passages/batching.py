@@ -0,0 +1,247 @@
+"""
+Multi-document prompt batching for short passages.
+
+Short passages (a few hundred words) pay the same per-request overhead and
+fixed prompt tokens as long ones. GenerationBatcher collects short documents
+submitted within a small time window and sends them to Gemini as a single
+prompt with one delimited section per document. The response is split back
+per document with parse_batched_questions; any document whose part of the
+response does not parse cleanly is retried on its own with
+single_flight.ensure_questions.
+"""
+
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from django.db import close_old_connections, connections
+from django.db.models import Count
+
+from .gemini_utils import (
+    FAILED_GENERATION, QUESTION_FORMAT, QuestionGenerationError,
+    call_gemini, parse_questions, store_generated_questions,
+)
+from .models import QuizQuestion
+from .sections import split_sections
+from .single_flight import acquire, ensure_questions, release
+
+# Documents whose whole text is at most this long are batched
+SHORT_DOCUMENT_CHARS = 1500
+
+# Keep the combined passages within what one prompt normally carries
+MAX_BATCH_CHARS = 6000
+
+DOCUMENT_HEADER = re.compile(r'^[#*\s]*DOCUMENT\s+(\d+)[#*:\s]*$', re.IGNORECASE)
+
+
+def is_short_document(document):
+    sections = split_sections(document.parsed_text)
+    return len(sections) == 1 and len(sections[0].text) <= SHORT_DOCUMENT_CHARS
+
+
+def build_batch_prompt(documents):
+    """One prompt asking for 7 questions per document, each answer block headed by its document id"""
+    passages = '\n\n'.join(
+        f'=== DOCUMENT {document.pk} ===\n{document.parsed_text.strip()}\n=== END DOCUMENT {document.pk} ==='
+        for document in documents
+    )
+    return f"""Below are {len(documents)} separate passages. For EACH passage, generate exactly 7 reading comprehension questions about that passage only.
+
+Start the questions for each passage with a line containing only "### DOCUMENT <number>" using the passage's number, then list its questions.
+
+{QUESTION_FORMAT}
+
+Passages:
+{passages}"""
+
+
+def questions_look_valid(questions):
+    """A document's parsed questions are usable if each has choices and exactly one correct answer"""
+    return bool(questions) and all(
+        len(q['answers']) >= 2 and sum(a['is_correct'] for a in q['answers']) == 1
+        for q in questions
+    )
+
+
+def parse_batched_questions(raw_text, document_ids):
+    """
+    Document-aware variant of parse_questions for batched responses.
+
+    Returns:
+        dict: {document_id: list of question dicts} for the documents whose
+        part of the response parsed cleanly (others are left out)
+    """
+    wanted = set(document_ids)
+    chunks = {}
+    current_id = None
+    for line in raw_text.splitlines():
+        match = DOCUMENT_HEADER.match(line.strip())
+        if match:
+            current_id = int(match.group(1))
+            chunks.setdefault(current_id, [])
+        elif current_id is not None:
+            chunks[current_id].append(line)
+
+    parsed = {}
+    for document_id, lines in chunks.items():
+        if document_id not in wanted:
+            continue
+        questions = parse_questions('\n'.join(lines))
+        if questions_look_valid(questions):
+            parsed[document_id] = questions
+    return parsed
+
+
+def generate_batch(documents, replace=False):
+    """
+    Generate and save questions for several short documents with one Gemini call.
+    With replace=True each document's existing questions are deleted first.
+
+    Returns:
+        (saved, leftovers): {document_id: questions saved} and the documents
+        that still need a single-document call
+    """
+    # Documents someone else is generating right now go the single-document
+    # route, which joins that generation instead of paying for another
+    owner = uuid.uuid4().hex
+    locked = [d for d in documents if acquire(d, owner)]
+    leftovers = [d for d in documents if d not in locked]
+    saved = {}
+    try:
+        if not replace:
+            # A generator we waited behind may have finished just before we locked
+            saved = dict(
+                QuizQuestion.objects.filter(document__in=locked).values('document_id')
+                .annotate(count=Count('id')).values_list('document_id', 'count')
+            )
+        pending = [d for d in locked if d.pk not in saved]
+        if not pending:
+            return saved, leftovers
+        raw = call_gemini(build_batch_prompt(pending))
+        parsed = {} if raw == FAILED_GENERATION else parse_batched_questions(raw, [d.pk for d in pending])
+
+        for document in pending:
+            questions = parsed.get(document.pk)
+            if questions is None:
+                leftovers.append(document)
+                continue
+            sections = split_sections(document.parsed_text)
+            try:
+                store_generated_questions(document, questions, sections[0], sections, replace=replace)
+                saved[document.pk] = len(questions)
+            except QuestionGenerationError:
+                leftovers.append(document)
+    finally:
+        for document in locked:
+            release(document, owner)
+    return saved, leftovers
+
+
+class GenerationBatcher:
+    """
+    Coalesces short documents submitted within `window` seconds into one prompt.
+
+    submit() returns a Future resolving to the number of questions saved (or
+    raising QuestionGenerationError). Long documents bypass the batcher and are
+    generated on their own. A batch is sent when it reaches `max_batch`
+    documents or MAX_BATCH_CHARS, or when the oldest pending document has
+    waited `window` seconds.
+    """
+
+    def __init__(self, window=2.0, max_batch=5, replace=False):
+        self.window = window
+        self.max_batch = max_batch
+        self.replace = replace
+        self._pending = []  # (document, future)
+        self._first_pending_at = None
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='generation-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, document):
+        future = Future()
+        if not is_short_document(document):
+            self._resolve_single(document, future)
+            return future
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('GenerationBatcher is closed')
+            if not self._pending:
+                self._first_pending_at = time.monotonic()
+            self._pending.append((document, future))
+            self._condition.notify()
+        return future
+
+    def close(self):
+        """Flush whatever is pending and stop the background thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _batch_is_full(self):
+        chars = sum(len(document.parsed_text) for document, _ in self._pending)
+        return len(self._pending) >= self.max_batch or chars >= MAX_BATCH_CHARS
+
+    def _take_batch(self):
+        """Wait until a batch is due and remove it from the pending list"""
+        with self._condition:
+            while True:
+                if self._pending and (self._closed or self._batch_is_full()):
+                    break
+                if self._pending:
+                    remaining = self._first_pending_at + self.window - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                elif self._closed:
+                    return []
+                else:
+                    self._condition.wait()
+
+            batch, chars = [], 0
+            while self._pending and len(batch) < self.max_batch:
+                document = self._pending[0][0]
+                if batch and chars + len(document.parsed_text) > MAX_BATCH_CHARS:
+                    break
+                batch.append(self._pending.pop(0))
+                chars += len(document.parsed_text)
+            self._first_pending_at = time.monotonic() if self._pending else None
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            close_old_connections()
+            try:
+                self._flush(batch)
+            finally:
+                connections.close_all()
+
+    def _flush(self, batch):
+        futures = {document.pk: future for document, future in batch}
+        documents = [document for document, _ in batch]
+        if len(documents) == 1:
+            saved, leftovers = {}, documents
+        else:
+            try:
+                saved, leftovers = generate_batch(documents, replace=self.replace)
+            except Exception as e:
+                print(f"⚠️ Batched generation failed, falling back to single calls: {e}")
+                saved, leftovers = {}, documents
+
+        for document_id, count in saved.items():
+            futures[document_id].set_result(count)
+        for document in leftovers:
+            self._resolve_single(document, futures[document.pk])
+
+    def _resolve_single(self, document, future):
+        try:
+            future.set_result(ensure_questions(document, replace=self.replace))
+        except Exception as e:
+            future.set_exception(e)
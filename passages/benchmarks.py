@@ -0,0 +1,265 @@
+"""
+Micro-benchmarks for the ReadingKnack parsing and serialization hot paths
+
+Covers the steps every upload and quiz load goes through: parsing Gemini
+output (well-formed, one-line choices and malformed), extracting text from a
+.docx file, saving parsed questions, and rendering the quiz serializers at
+10/100/1000 questions. Fixtures are generated deterministically so results
+are comparable between runs; database work runs inside a transaction that is
+rolled back at the end.
+
+Run with `python manage.py benchmark` (see the command for baseline/threshold
+options).
+"""
+
+import contextlib
+import io
+import platform
+import random
+import statistics
+import time
+
+import django
+from django.db import transaction
+from docx import Document
+from rest_framework.renderers import JSONRenderer
+
+from .gemini_utils import parse_questions, save_parsed_questions
+from .models import UploadedDocument, QuizQuestion
+from .read_serializers import document_detail_data, question_list_data
+from .renderers import FastJSONRenderer
+from .serializers import DocumentDetailSerializer, QuizQuestionSerializer
+
+SIZES = [10, 100, 1000]
+SEED = 1234
+
+WORDS = (
+    "the river story reader because author character shows main idea "
+    "Before After Dragon Castle village bright quietly decided explain "
+    "which sentence best describes why how what passage paragraph"
+).split()
+
+
+# Fixtures: deterministic inputs shaped like real Gemini output / uploads
+def _sentence(rng, length):
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def make_gemini_output(n, one_line=False, seed=SEED):
+    """Well-formed Gemini output with `n` questions (optionally one-line choices)."""
+    rng = random.Random(seed)
+    blocks = []
+    for i in range(1, n + 1):
+        question = f"**{i}. {_sentence(rng, 12).capitalize()}?**"
+        choices = [f"{letter}) {_sentence(rng, 6)}" for letter in "ABCD"]
+        if one_line:
+            choice_lines = ["Options: " + " ".join(choices)]
+        else:
+            choice_lines = choices
+        answer = f"Answer: {rng.choice('ABCD')}"
+        blocks.append("\n".join([question, *choice_lines, answer]))
+    return "\n\n".join(blocks)
+
+
+def make_malformed_output(n, seed=SEED):
+    """Gemini output with missing answers, stray prose and very long choice lines."""
+    rng = random.Random(seed)
+    lines = ["Here are your questions:", "A) stray choice before any question"]
+    for i in range(1, n + 1):
+        lines.append(f"**{i}. {_sentence(rng, 10)}?**")
+        kind = i % 4
+        if kind == 0:
+            # One very long line that goes through the backtracking regex
+            long_text = "x" * 2000
+            lines.append(f"Options: A) {long_text} B) {long_text} C) {long_text} D) {long_text}")
+        elif kind == 1:
+            lines.extend(f"{letter}) {_sentence(rng, 8)}" for letter in "ABC")  # only three choices
+        elif kind == 2:
+            lines.append(_sentence(rng, 40))  # prose instead of choices
+        else:
+            lines.extend(f"{letter}) {_sentence(rng, 5)}" for letter in "ABCD")
+        if kind != 2:
+            lines.append(f"Answer: {rng.choice('ABCD')}")
+    return "\n".join(lines)
+
+
+def make_docx_bytes(paragraphs, seed=SEED):
+    """A .docx file (as bytes) with `paragraphs` paragraphs of prose."""
+    rng = random.Random(seed)
+    doc = Document()
+    for _ in range(paragraphs):
+        doc.add_paragraph(_sentence(rng, 60))
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+# Timing helpers
+def _time(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):  # save_parsed_questions prints a lot
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _result(name, size, timings):
+    return {
+        "name": name,
+        "size": size,
+        "repeat": len(timings),
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+    }
+
+
+# Benchmark groups
+def bench_parse_questions(sizes, repeat):
+    results = []
+    for size in sizes:
+        for name, raw in [
+            ("parse_questions", make_gemini_output(size)),
+            ("parse_questions_one_line", make_gemini_output(size, one_line=True)),
+            ("parse_questions_malformed", make_malformed_output(size)),
+        ]:
+            results.append(_result(name, size, _time(lambda: parse_questions(raw), repeat)))
+    return results
+
+
+def bench_docx_extraction(sizes, repeat):
+    results = []
+    for size in sizes:
+        data = make_docx_bytes(size)
+
+        def extract():
+            doc = Document(io.BytesIO(data))
+            "\n".join(p.text for p in doc.paragraphs)
+
+        results.append(_result("docx_extract_text", size, _time(extract, repeat)))
+    return results
+
+
+def _make_document(title="Benchmark passage"):
+    return UploadedDocument.objects.create(title=title, file="documents/benchmark.docx",
+                                           parsed_text=_sentence(random.Random(SEED), 500))
+
+
+def bench_save_parsed_questions(sizes, repeat):
+    results = []
+    for size in sizes:
+        parsed = parse_questions(make_gemini_output(size))
+        timings = []
+        for _ in range(repeat):
+            document = _make_document()
+            timings.extend(_time(lambda: save_parsed_questions(document, parsed), 1))
+        results.append(_result("save_parsed_questions", size, timings))
+    return results
+
+
+def bench_serializers(sizes, repeat):
+    results = []
+    renderer = JSONRenderer()
+    for size in sizes:
+        document = _make_document()
+        with contextlib.redirect_stdout(io.StringIO()):
+            save_parsed_questions(document, parse_questions(make_gemini_output(size)))
+
+        def render_detail():
+            fresh = UploadedDocument.objects.get(pk=document.pk)
+            renderer.render(DocumentDetailSerializer(fresh).data)
+
+        def render_questions():
+            renderer.render(QuizQuestionSerializer(document.questions.all(), many=True).data)
+
+        results.append(_result("document_detail_serializer", size, _time(render_detail, repeat)))
+        results.append(_result("quiz_question_serializer", size, _time(render_questions, repeat)))
+    return results
+
+
+def bench_fast_rendering(sizes, repeat):
+    """Stock serializers + JSONRenderer vs. values() readers + FastJSONRenderer (USE_FAST_JSON)"""
+    from .views import DocumentDetailView
+
+    results = []
+    stock, fast = JSONRenderer(), FastJSONRenderer()
+    for size in sizes:
+        document = _make_document()
+        with contextlib.redirect_stdout(io.StringIO()):
+            save_parsed_questions(document, parse_questions(make_gemini_output(size)))
+        questions = QuizQuestion.objects.filter(document=document)
+
+        def stock_detail():
+            stock.render(DocumentDetailSerializer(DocumentDetailView.queryset.get(pk=document.pk)).data)
+
+        def fast_detail():
+            fast.render(document_detail_data(document.pk))
+
+        def stock_questions():
+            stock.render(QuizQuestionSerializer(questions.prefetch_related('answers'), many=True).data)
+
+        def fast_questions():
+            fast.render(question_list_data(questions))
+
+        results.append(_result("document_detail_stock", size, _time(stock_detail, repeat)))
+        results.append(_result("document_detail_fast", size, _time(fast_detail, repeat)))
+        results.append(_result("question_list_stock", size, _time(stock_questions, repeat)))
+        results.append(_result("question_list_fast", size, _time(fast_questions, repeat)))
+    return results
+
+
+BENCHMARKS = {
+    "parse_questions": bench_parse_questions,
+    "docx_extraction": bench_docx_extraction,
+    "save_parsed_questions": bench_save_parsed_questions,
+    "serializers": bench_serializers,
+    "fast_rendering": bench_fast_rendering,
+}
+
+
+def run_benchmarks(groups=None, sizes=None, repeat=5):
+    """
+    Run the selected benchmark groups and return machine-readable results.
+
+    Database fixtures are created inside a transaction that is always rolled
+    back, so the benchmark can safely be pointed at a development database.
+    """
+    sizes = sizes or SIZES
+    results = []
+    with transaction.atomic():
+        for group in groups or BENCHMARKS:
+            results.extend(BENCHMARKS[group](sizes, repeat))
+        transaction.set_rollback(True)
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def find_regressions(current, baseline, threshold):
+    """
+    Compare two result sets (as returned by run_benchmarks) on their `min` timing.
+
+    Returns a list of dicts for every benchmark that got slower than
+    baseline * (1 + threshold). Benchmarks missing from the baseline are ignored.
+    """
+    previous = {(r["name"], r["size"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get((result["name"], result["size"]))
+        if not old or not old["min"]:
+            continue
+        ratio = result["min"] / old["min"]
+        if ratio > 1 + threshold:
+            regressions.append({
+                "name": result["name"],
+                "size": result["size"],
+                "baseline": old["min"],
+                "current": result["min"],
+                "ratio": round(ratio, 3),
+            })
+    return regressions
@@ -0,0 +1,110 @@
+"""
+Content-addressed, reference-counted storage for uploaded files.
+
+Files are stored under their SHA-256 (documents/ab/<hash>.docx), so uploading
+the same .docx again reuses the stored blob instead of writing another copy
+with a random suffix. StoredBlob.ref_count tracks how many documents use a
+blob; the file is deleted from storage when the last one goes away.
+
+Blob rows are locked (select_for_update) while they are changed, so a blob
+can't be deleted while a concurrent upload is starting to reference it.
+store_blob() should run in the same transaction as the document save that
+uses its name, so a failed save doesn't leave the reference counted. Files
+are only deleted from storage once the release has committed: a rolled back
+delete keeps its file.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import StoredBlob, UploadedDocument, content_addressed_name
+
+
+def document_storage():
+    return UploadedDocument._meta.get_field('file').storage
+
+
+def _locked_blob(content_hash, name):
+    """Get or create the blob row for a hash, locked for the current transaction"""
+    blob = StoredBlob.objects.select_for_update().filter(content_hash=content_hash).first()
+    if blob is not None:
+        return blob
+    try:
+        with transaction.atomic():
+            return StoredBlob.objects.create(content_hash=content_hash, name=name)
+    except IntegrityError:
+        # Created concurrently
+        return StoredBlob.objects.select_for_update().get(content_hash=content_hash)
+
+
+def store_blob(file, content_hash):
+    """
+    Store a file under its content hash and take a reference to it.
+    The file is only written if no blob with this content exists yet.
+
+    Call it inside the transaction that saves the document, so the reference
+    is rolled back with a failed save.
+
+    Args:
+        file: a Django File/UploadedFile (rewound before writing)
+        content_hash: its SHA-256 hex digest
+
+    Returns:
+        str: the storage name to assign to UploadedDocument.file
+    """
+    storage = document_storage()
+    with transaction.atomic():
+        blob = _locked_blob(content_hash, content_addressed_name(content_hash, file.name))
+        if not storage.exists(blob.name):
+            file.seek(0)
+            blob.name = storage.save(blob.name, file)
+            blob.size = file.size
+        StoredBlob.objects.filter(pk=blob.pk).update(name=blob.name, size=blob.size, ref_count=F('ref_count') + 1)
+    return blob.name
+
+
+def add_reference(name):
+    """Take another reference to an existing blob; False if `name` is not a blob"""
+    return StoredBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1) == 1
+
+
+def release_blob(name):
+    """
+    Drop one reference to the blob stored at `name`. When nothing references
+    it any more the file is deleted from storage after the transaction
+    commits. Files that are not blobs (uploaded before content addressing)
+    are left alone.
+
+    Returns:
+        bool: True if the file is to be deleted
+    """
+    if not name:
+        return False
+    with transaction.atomic():
+        blob = StoredBlob.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            return False
+        StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+        if blob.ref_count > 1:
+            return False
+        transaction.on_commit(lambda: delete_unreferenced_blob(blob.pk))
+    return True
+
+
+def delete_unreferenced_blob(pk):
+    """
+    Delete a blob's file and row if it is still unreferenced. The row stays
+    locked until the file is gone, so a concurrent upload of the same content
+    either re-references the blob first (and it is kept) or waits and then
+    writes the file again.
+
+    Returns:
+        bool: True if the file was deleted
+    """
+    with transaction.atomic():
+        blob = StoredBlob.objects.select_for_update().filter(pk=pk, ref_count__lte=0).first()
+        if blob is None:
+            return False
+        document_storage().delete(blob.name)
+        blob.delete()
+    return True
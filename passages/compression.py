@@ -0,0 +1,192 @@
+"""
+Compressed storage for long texts (UploadedDocument.parsed_text).
+
+CompressedTextField is a TextField to forms, serializers and code, but the
+column is binary and holds a zlib stream:
+
+    b''                     empty text
+    <id byte> <zlib data>   id of the CompressionDictionary used, 0 for none
+
+A preset dictionary gives zlib phrases to refer back to before the text
+itself has any, which is where short passages lose most against plain zlib.
+`manage.py compress_texts --train` builds one from the phrases that recur
+across a sample of the stored passages and recompresses every row with it
+in batches, reporting the space saved. Dictionaries are never changed or
+deleted once used: rows keep the id they were compressed with, and new
+texts use the latest one (cached per process like the reference tables).
+
+Values loaded from the database stay compressed (CompressedText, a bytes
+subclass) until the attribute is first read, and saving an instance whose
+text was never read writes the stored bytes back as they are. values() and
+values_list() return CompressedText as well: use text_of() on them.
+Only whole-value lookups work on the column (isnull, exact); LIKE searches
+do not.
+"""
+
+import codecs
+import re
+import zlib
+from collections import Counter
+
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+ZLIB_LEVEL = 9
+DICTIONARY_SIZE = 32 * 1024  # zlib's window: bytes further back are never referred to
+MAX_DICTIONARIES = 255  # highest id that fits the header byte
+SAMPLE_CHARS = 50_000  # characters of each sample text used for training
+
+_token = re.compile(r'\S+\s*')
+
+
+def latest_dictionary():
+    """(id, data) of the dictionary new texts are compressed with, (0, b'') for none"""
+    from .reference_cache import compression_dictionaries
+    dictionaries = compression_dictionaries.all()
+    return (dictionaries[-1].pk, bytes(dictionaries[-1].data)) if dictionaries else (0, b'')
+
+
+def _dictionary_data(dictionary_id, dictionaries=None):
+    if dictionaries is not None:
+        return dictionaries[dictionary_id]
+    from .reference_cache import compression_dictionaries
+    # fetch(): a dictionary trained by another process may not be in this process's copy yet
+    dictionary = compression_dictionaries.fetch(dictionary_id)
+    if dictionary is None:
+        raise ValueError(f'Unknown compression dictionary {dictionary_id}')
+    return bytes(dictionary.data)
+
+
+def compress(text, dictionary=None):
+    """Stored bytes for `text`, with `dictionary` as (id, data) (default: the latest)"""
+    if not text:
+        return b''
+    dictionary_id, data = dictionary or latest_dictionary()
+    compressor = zlib.compressobj(ZLIB_LEVEL, zdict=data) if data else zlib.compressobj(ZLIB_LEVEL)
+    return bytes([dictionary_id]) + compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+
+def decompress(blob, max_chars=None, dictionaries=None):
+    """
+    Text of stored bytes. With `max_chars`, only the start of the stream is
+    inflated and the result has at least the first max_chars characters
+    (fewer only if the text is shorter). `dictionaries` ({id: data})
+    replaces the cached dictionaries, e.g. in migrations.
+    """
+    if not blob or max_chars == 0:
+        return ''
+    blob = memoryview(blob)
+    dictionary_id = blob[0]
+    if dictionary_id:
+        decompressor = zlib.decompressobj(zdict=_dictionary_data(dictionary_id, dictionaries))
+    else:
+        decompressor = zlib.decompressobj()
+    if max_chars is None:
+        return (decompressor.decompress(blob[1:]) + decompressor.flush()).decode('utf-8')
+    # A character is at most 4 bytes of UTF-8; a character cut off at the end is left out
+    return codecs.getincrementaldecoder('utf-8')().decode(decompressor.decompress(blob[1:], 4 * max_chars))
+
+
+def text_of(value):
+    """Text of a parsed_text value from values()/values_list() (or an already decompressed str)"""
+    if value is None or isinstance(value, str):
+        return value
+    return decompress(value)
+
+
+def text_preview(value, max_chars):
+    """First max_chars characters of a parsed_text value, inflating only the start of the stream"""
+    if value is None or isinstance(value, str):
+        return value and value[:max_chars]
+    return decompress(value, max_chars)[:max_chars]
+
+
+def stored_value(instance, field_name):
+    """A loaded instance's value without decompressing it: CompressedText, or str once read or assigned"""
+    if field_name in instance.__dict__:
+        return instance.__dict__[field_name]
+    return getattr(instance, field_name)
+
+
+def train_dictionary(texts, size=DICTIONARY_SIZE):
+    """
+    Preset dictionary for texts like `texts`: the phrases of one to three
+    words found in the most texts, weighted by length, with the most
+    valuable last (zlib refers to the end of the dictionary most cheaply).
+    """
+    texts = [text[:SAMPLE_CHARS] for text in texts if text]
+    counts = Counter()
+    for text in texts:
+        tokens = _token.findall(text)
+        phrases = set(tokens)
+        phrases.update(map(''.join, zip(tokens, tokens[1:])))
+        phrases.update(map(''.join, zip(tokens, tokens[1:], tokens[2:])))
+        counts.update(phrases)
+
+    min_texts = 2 if len(texts) > 1 else 1
+    ranked = sorted(
+        ((count * len(phrase.encode('utf-8')), phrase) for phrase, count in counts.items() if count >= min_texts),
+        reverse=True,
+    )
+    chosen, used = [], 0
+    for _, phrase in ranked:
+        if used >= size:
+            break
+        if any(phrase in other for other in chosen[-64:]):  # already covered by a longer phrase nearby
+            continue
+        chosen.append(phrase)
+        used += len(phrase.encode('utf-8'))
+    return ''.join(reversed(chosen)).encode('utf-8')[-size:]
+
+
+class CompressedText(bytes):
+    """Stored bytes of a CompressedTextField, decompressed on demand"""
+
+    def text(self, max_chars=None):
+        return decompress(self, max_chars)
+
+
+class LazyTextAttribute(DeferredAttribute):
+    """Decompresses the loaded bytes on first access and keeps the text"""
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, CompressedText):
+            value = instance.__dict__[self.field.attname] = value.text()
+        return value
+
+    def __set__(self, instance, value):
+        # A data descriptor, so that reads go through __get__ even once the value is in __dict__
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    """TextField stored zlib-compressed in a binary column (see module docstring)"""
+
+    descriptor_class = LazyTextAttribute
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else CompressedText(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return text_of(value)
+        return super().to_python(value)
+
+    def pre_save(self, model_instance, add):
+        # Unread text goes back as the stored bytes, without a decompress/compress round trip
+        return stored_value(model_instance, self.attname)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, bytes):
+            return value
+        if isinstance(value, memoryview):
+            return bytes(value)
+        return compress(super().get_prep_value(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        return None if value is None else connection.Database.Binary(value)
@@ -0,0 +1,198 @@
+"""
+Document file delivery.
+
+The app only authorizes a download and describes the file; the bytes are
+sent by something else:
+
+- S3 storage: a redirect to a short-lived presigned URL (S3 handles Range)
+- local storage behind nginx: an X-Accel-Redirect to an internal location
+- local storage behind Apache/lighttpd: X-Sendfile with the file's path
+- otherwise (development): a FileResponse that honours single Range requests
+
+ETag is the file's content hash and Last-Modified is when that content was
+first stored, so conditional GETs are answered with 304 before any storage is
+touched.
+"""
+
+import copy
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, http_date, parse_etags
+from django.utils.text import slugify
+
+from .blobs import document_storage
+from .models import StoredBlob
+
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def can_download(user, document):
+    """Authorization for document downloads"""
+    if getattr(settings, 'DOCUMENT_DOWNLOADS_PUBLIC', True):
+        return True
+    return user.is_authenticated and (user.is_staff or document.uploader_id in (None, user.id))
+
+
+def download_url(document_id, request=None):
+    """
+    URL clients get for a document's file: the download endpoint, which checks
+    can_download, rather than the storage URL
+    """
+    url = reverse('document_download', args=[document_id])
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def download_filename(document):
+    extension = os.path.splitext(document.file.name)[1]
+    return f"{slugify(document.title) or 'document'}{extension}"
+
+
+def document_etag(document):
+    return f'"{document.content_hash}"' if document.content_hash else None
+
+
+def document_last_modified(document):
+    """
+    Last-Modified timestamp for document.file: when its blob was stored, so a
+    replaced file gets a new date. Files stored before content addressing
+    fall back to uploaded_at.
+    """
+    stored_at = StoredBlob.objects.filter(name=document.file.name).values_list('created_at', flat=True).first()
+    modified = stored_at or document.uploaded_at
+    return int(modified.timestamp()) if modified else None
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single-range Range header, None to send the
+    whole file (no/multi/unparseable range), or False if unsatisfiable
+    """
+    match = RANGE_HEADER.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+class RangeFile:
+    """File wrapper that reads at most `length` bytes from `start`"""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _signing_storage(storage, expires):
+    # The configured storage hands out plain URLs (AWS_QUERYSTRING_AUTH=False,
+    # maybe a custom domain). A shallow copy shares its S3 connection but signs.
+    signing = copy.copy(storage)
+    signing.querystring_auth = True
+    signing.querystring_expire = expires
+    signing.custom_domain = None
+    return signing
+
+
+def _presigned_response(storage, document):
+    expires = getattr(settings, 'DOCUMENT_URL_EXPIRY', 300)
+    url = _signing_storage(storage, expires).url(document.file.name, parameters={
+        'ResponseContentDisposition': content_disposition_header(True, download_filename(document)),
+    })
+    response = HttpResponseRedirect(url)
+    # Don't let anyone reuse the redirect after the URL expires
+    patch_cache_control(response, private=True, max_age=max(expires - 30, 0))
+    return response
+
+
+def _offloaded_response(storage, document, mode):
+    response = HttpResponse(content_type='application/octet-stream')
+    if mode == 'nginx':
+        prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(document.file.name)
+    else:
+        response['X-Sendfile'] = storage.path(document.file.name)
+    # Let the web server work out the type and length from the file
+    del response['Content-Type']
+    response['Content-Disposition'] = content_disposition_header(True, download_filename(document))
+    return response
+
+
+def _file_response(request, document, etag):
+    file = document.file.open('rb')
+    size = document.file.size
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # A Range request for a file that changed since (If-Range mismatch) gets the whole file
+    if not if_range or (etag and etag in parse_etags(if_range)):
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+
+    if byte_range is False:
+        file.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    filename = download_filename(document)
+    if byte_range is None:
+        response = FileResponse(file, as_attachment=True, filename=filename)
+        response['Content-Length'] = str(size)
+    else:
+        start, end = byte_range
+        response = FileResponse(RangeFile(file, start, end - start + 1), as_attachment=True, filename=filename, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve_document_file(request, document):
+    """Response that delivers document.file, or 304/412 for a matching conditional request"""
+    etag = document_etag(document)
+    last_modified = document_last_modified(document)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        response = not_modified
+    else:
+        storage = document_storage()
+        mode = getattr(settings, 'MEDIA_ACCEL', '')
+        if hasattr(storage, 'bucket_name'):
+            response = _presigned_response(storage, document)
+        elif mode in ('nginx', 'sendfile'):
+            response = _offloaded_response(storage, document, mode)
+        else:
+            response = _file_response(request, document, etag)
+
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if not response.has_header('Cache-Control'):
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,109 @@
+"""
+Streaming exports of quiz results.
+
+Rows come from a single joined query over UserAnswer (one row per answered
+question) or QuizResponse (one row per attempt), read with
+QuerySet.iterator(chunk_size), which uses a server-side cursor on
+PostgreSQL. They are encoded as CSV or NDJSON a chunk at a time, so memory
+use does not depend on the size of the export and the header goes out before
+the first database round trip.
+
+Per-answer exports also include responses whose answers are stored packed
+(packed_answers.py). Their rows follow the UserAnswer rows. They are unpacked
+a few hundred responses at a time, with one query per batch for the question
+texts; questions deleted since then have an empty text.
+"""
+
+import csv
+import json
+from itertools import chain
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import QuizQuestion, QuizResponse, UserAnswer
+from .packed_answers import unpack_answers
+
+CHUNK_SIZE = 2000
+PACKED_CHUNK_SIZE = 200  # responses per question text lookup (keeps the IN list small)
+
+RESPONSE_COLUMNS = [
+    ('response_id', 'id'),
+    ('document_id', 'document_id'),
+    ('document_title', 'document__title'),
+    ('user_name', 'user_name'),
+    ('username', 'user__username'),
+    ('score', 'score'),
+    ('total_questions', 'total_questions'),
+    ('submitted_at', 'submitted_at'),
+]
+
+ANSWER_COLUMNS = [(name, f'response__{field}' if field != 'id' else 'response_id') for name, field in RESPONSE_COLUMNS] + [
+    ('question_id', 'question_id'),
+    ('question_text', 'question__question_text'),
+    ('selected_choice', 'selected_answer__choice_letter'),
+    ('is_correct', 'is_correct'),
+]
+
+
+def export_rows(responses, per_answer=True):
+    """
+    (header, rows iterator) for a QuizResponse queryset, one row per answer
+    (per_answer=True) or per response
+    """
+    if per_answer:
+        columns = ANSWER_COLUMNS
+        queryset = UserAnswer.objects.filter(response__in=responses.values('id')).order_by('response_id', 'id')
+    else:
+        columns = RESPONSE_COLUMNS
+        queryset = QuizResponse.objects.filter(id__in=responses.values('id')).order_by('id')
+    rows = queryset.values_list(*[field for _, field in columns]).iterator(chunk_size=CHUNK_SIZE)
+    if per_answer:
+        rows = chain(rows, _packed_answer_rows(responses))
+    return [name for name, _ in columns], rows
+
+
+def _packed_answer_rows(responses):
+    """ANSWER_COLUMNS rows for the responses whose answers are stored packed"""
+    queryset = QuizResponse.objects.filter(id__in=responses.values('id'), packed_answers__isnull=False).order_by('id')
+    rows = queryset.values_list(
+        *[field for _, field in RESPONSE_COLUMNS], 'packed_answers', 'correct_mask'
+    ).iterator(chunk_size=PACKED_CHUNK_SIZE)
+    for batch in _batched(rows, PACKED_CHUNK_SIZE):
+        unpacked = [(row[:-2], unpack_answers(row[-2], row[-1])) for row in batch]
+        question_ids = {question_id for _, records in unpacked for question_id, _, _ in records}
+        question_texts = dict(QuizQuestion.objects.filter(id__in=question_ids).values_list('id', 'question_text'))
+        for response_row, records in unpacked:
+            for question_id, choice_letter, is_correct in records:
+                yield (*response_row, question_id, question_texts.get(question_id), choice_letter, is_correct)
+
+
+class _Echo:
+    """File-like object whose write() returns what it was given (for csv.writer)"""
+
+    def write(self, value):
+        return value
+
+
+def _batched(rows, size=CHUNK_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def csv_stream(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for batch in _batched(rows):
+        yield ''.join(writer.writerow([value.isoformat() if hasattr(value, 'isoformat') else value for value in row])
+                      for row in batch)
+
+
+def ndjson_stream(header, rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for batch in _batched(rows):
+        yield ''.join(encoder.encode(dict(zip(header, row))) + '\n' for row in batch)
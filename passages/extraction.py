@@ -0,0 +1,223 @@
+"""
+Text extraction for uploaded documents
+
+Parsing untrusted .docx files (zip archives) can take a lot of memory or CPU,
+so uploads are parsed in a small pool of worker processes (ExtractionPool)
+rather than in the web process. Workers get the path of the file on local
+disk (Django's upload temp file, or a spooled copy of a small in-memory
+upload) and read it themselves, so the document is never held in memory or
+pickled by the web process. Each task runs under a CPU-time limit, each
+worker under an address-space limit, and the caller waits at most
+EXTRACTION_TIMEOUT seconds. A worker that hits a limit dies on its own (or is
+killed on timeout); the pool is rebuilt and the upload is rejected. Workers
+are replaced after EXTRACTION_TASKS_PER_CHILD tasks so memory fragmentation
+doesn't build up.
+
+A timeout kills the whole pool, not just the overrunning worker:
+ProcessPoolExecutor can't replace a single worker, and a worker that dies
+abruptly marks the executor broken anyway. Other documents being parsed at
+that moment get BrokenProcessPool and are retried once on the fresh pool, so
+they are delayed rather than rejected.
+
+EXTRACTION_WORKERS = 0 parses in-process (development and tests).
+"""
+
+import hashlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from docx import Document
+
+try:
+    import resource
+except ImportError:  # not available on Windows: no limits, timeout only
+    resource = None
+
+
+class ExtractionError(Exception):
+    """A document could not be parsed (corrupt, too big, too slow)"""
+
+
+def extract_docx_text(file):
+    """Extract the text of a .docx file (path or file-like object), one paragraph per line"""
+    doc = Document(file)
+    return '\n'.join(para.text for para in doc.paragraphs)
+
+
+def _limit_worker(memory_bytes):
+    """Pool initializer: cap the worker's address space"""
+    if resource and memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+
+def _extract_in_worker(path, cpu_seconds):
+    if resource and cpu_seconds:
+        # CPU time is counted per process, so the limit is relative to what this worker already used.
+        # Past it the kernel sends SIGXCPU and the worker dies.
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+        hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    try:
+        return extract_docx_text(path)
+    except MemoryError:
+        raise ExtractionError('The document needs too much memory to parse.')
+    except Exception as e:
+        raise ExtractionError(f'Could not read the .docx file: {e}')
+
+
+class ExtractionPool:
+    """Pre-started worker processes that parse .docx files under CPU, memory and time limits"""
+
+    def __init__(self, workers, timeout, cpu_seconds, memory_bytes, tasks_per_child):
+        self.workers = workers
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.tasks_per_child = tasks_per_child
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            # A forked web worker (gunicorn --preload) must not share its parent's pool
+            if self._executor is None or self._pid != os.getpid():
+                methods = multiprocessing.get_all_start_methods()
+                # Not fork: the web process holds DB connections and threads
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                options = {}
+                if sys.version_info >= (3, 11) and self.tasks_per_child:
+                    options['max_tasks_per_child'] = self.tasks_per_child
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=context,
+                    initializer=_limit_worker, initargs=(self.memory_bytes,), **options,
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _discard(self, executor, kill=False):
+        """Drop a broken or stuck pool; the next task starts a fresh one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        if kill:
+            for process in list((executor._processes or {}).values()):
+                process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def extract(self, path):
+        """Text of the .docx file at `path` (on local disk); raises ExtractionError"""
+        # A pool broken by someone else's bad document (or timeout) is retried once on a fresh pool
+        for attempt in range(2):
+            executor = self._get_executor()
+            future = executor.submit(_extract_in_worker, path, self.cpu_seconds)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                self._discard(executor, kill=True)
+                raise ExtractionError(f'Parsing the document took longer than {self.timeout} seconds.')
+            except BrokenProcessPool:
+                self._discard(executor)
+        raise ExtractionError('The document parser crashed (CPU or memory limit exceeded).')
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def extraction_pool():
+    """The process-wide ExtractionPool configured from settings, or None when EXTRACTION_WORKERS is 0"""
+    from django.conf import settings
+
+    global _pool
+    if not settings.EXTRACTION_WORKERS:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExtractionPool(
+                workers=settings.EXTRACTION_WORKERS,
+                timeout=settings.EXTRACTION_TIMEOUT,
+                cpu_seconds=settings.EXTRACTION_CPU_SECONDS,
+                memory_bytes=settings.EXTRACTION_MEMORY_MB * 1024 * 1024,
+                tasks_per_child=settings.EXTRACTION_TASKS_PER_CHILD,
+            )
+        return _pool
+
+
+@contextmanager
+def local_path(upload):
+    """
+    Path of a local file with the upload's content: Django's temporary file
+    for large uploads, the file itself for a File opened from disk, otherwise
+    a copy written in chunks to a temporary directory.
+    """
+    if hasattr(upload, 'temporary_file_path'):
+        yield upload.temporary_file_path()
+        return
+    name = getattr(getattr(upload, 'file', None), 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        yield name
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'upload.docx')
+        with open(path, 'wb') as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+        yield path
+
+
+def extract_upload_text(upload):
+    """Parse an uploaded .docx in the extraction pool (in-process if the pool is disabled)"""
+    pool = extraction_pool()
+    upload.seek(0)
+    if pool is None:
+        try:
+            return extract_docx_text(upload)
+        except Exception as e:
+            raise ExtractionError(f'Could not read the .docx file: {e}')
+    with local_path(upload) as path:
+        return pool.extract(path)
+
+
+def hash_file(file):
+    """SHA-256 hex digest of a Django File/UploadedFile, read in chunks; rewinds the file"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def read_upload(upload):
+    """
+    Hash and parse an upload while it is still local (in memory or in Django's
+    temp file), before it is sent to storage, so remote storage (S3) is never
+    read back just to parse the file we uploaded.
+
+    Returns:
+        (parsed_text, content_hash): parsed_text is None for non-.docx files
+
+    Raises:
+        ExtractionError: the .docx could not be parsed
+    """
+    content_hash = hash_file(upload)
+    parsed_text = None
+    if upload.name.endswith('.docx'):
+        parsed_text = extract_upload_text(upload)
+        upload.seek(0)
+    return parsed_text, content_hash
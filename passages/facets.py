@@ -0,0 +1,81 @@
+"""
+Cached facet counts for browsing documents by grade level and skill category.
+
+DocumentFacetCount has one row per (grade level, skill category) pair in use
+(0 stands for "not set") with the number of documents that have it. The
+UploadedDocument signals in signals.py keep it current on create, update and
+delete, inside the same transaction as the change. Facet counts are then
+sums over this small table, whose size depends on the number of grade levels
+and skill categories, not on the number of documents.
+
+Counts are disjunctive: the grade level counts are narrowed by the selected
+skill category and vice versa, so every count is the number of results a
+click on that value would give (other filters are not taken into account).
+
+QuerySet.update() bypasses signals; `manage.py rebuild_facet_counts`
+recomputes the table with one GROUP BY after bulk changes.
+"""
+
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import DocumentFacetCount, UploadedDocument
+from .reference_cache import grade_levels, skill_categories
+
+
+def facet_key(grade_level_id, skill_category_id):
+    return grade_level_id or 0, skill_category_id or 0
+
+
+def adjust_facet_count(key, delta):
+    """Add `delta` documents to the (grade level, skill category) pair `key`"""
+    grade_level, skill_category = key
+    if delta > 0:
+        DocumentFacetCount.objects.get_or_create(grade_level=grade_level, skill_category=skill_category)
+    DocumentFacetCount.objects.filter(grade_level=grade_level, skill_category=skill_category).update(
+        count=F('count') + delta,
+    )
+
+
+def rebuild_facet_counts():
+    """Recompute the whole table from the documents; returns the number of pairs"""
+    rows = (
+        UploadedDocument.objects.order_by().values('grade_level_id', 'skill_category_id')
+        .annotate(documents=Count('id'))
+    )
+    counts = [
+        DocumentFacetCount(grade_level=grade_level, skill_category=skill_category, count=row['documents'])
+        for row in rows
+        for grade_level, skill_category in [facet_key(row['grade_level_id'], row['skill_category_id'])]
+    ]
+    with transaction.atomic():
+        DocumentFacetCount.objects.all().delete()
+        DocumentFacetCount.objects.bulk_create(counts)
+    return len(counts)
+
+
+def _facet_values(counts, reference_cache):
+    values = []
+    for pk, count in sorted(counts.items(), key=lambda item: (item[0] == 0, item[0])):  # "not set" last
+        obj = reference_cache.get(pk) if pk else None
+        values.append({'id': pk or None, 'name': obj.name if obj else None, 'count': count})
+    return values
+
+
+def facet_counts(grade_level=None, skill_category=None):
+    """
+    {'grade_level': [{id, name, count}], 'skill_category': [...]} for the
+    current selection (ids, or None for no selection)
+    """
+    grade_counts, skill_counts = Counter(), Counter()
+    for grade, skill, count in DocumentFacetCount.objects.filter(count__gt=0).values_list('grade_level', 'skill_category', 'count'):
+        if skill_category is None or skill == skill_category:
+            grade_counts[grade] += count
+        if grade_level is None or grade == grade_level:
+            skill_counts[skill] += count
+    return {
+        'grade_level': _facet_values(grade_counts, grade_levels),
+        'skill_category': _facet_values(skill_counts, skill_categories),
+    }
@@ -2,8 +2,12 @@ import os
 import google.generativeai as genai
 from dotenv import load_dotenv
 import re
+import threading
+import time
 from django.db import transaction
 from .models import QuizQuestion, QuizAnswer
+from .near_duplicates import check_questions
+from .sections import plan_regeneration, split_sections
 
 # Load environment variables
 load_dotenv()
@@ -15,14 +19,42 @@ genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 PRIMARY_MODEL = "gemini-2.0-flash-001"  # Stable Gemini 2.0 Flash
 FALLBACK_MODEL = "gemini-2.5-flash"     # Stable Gemini 2.5 Flash
 
-def generate_questions(text): #takes in passage text 
+# Requests per minute we allow ourselves against the Gemini API (per process)
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "15"))
+
+# How much passage text is sent to Gemini per generation
+MAX_PROMPT_CHARS = 3000
+
+FAILED_GENERATION = "❌ Failed to generate questions."
+
+
+class QuestionGenerationError(Exception):
+    """Raised when Gemini output could not be turned into saved questions"""
+
+
+class RateLimiter:
     """
-    Given a passage of text, generate 7 reading comprehension questions, using Gemini.
-    Falls back to another model if the first one fails.
+    Thread-safe limiter that spaces calls evenly to stay under `rpm` requests per minute.
+    Shared by every thread in the process (e.g. the generate_questions command workers).
     """
-    prompt = f"""Based on this passage, generate exactly 7 reading comprehension questions. 
 
-IMPORTANT: Use EXACTLY this format for each question:
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+gemini_rate_limiter = RateLimiter(GEMINI_RPM)
+
+QUESTION_FORMAT = """IMPORTANT: Use EXACTLY this format for each question:
 
 **1. Question text here?**
 A) First choice text
@@ -36,17 +68,19 @@ A) Choice A text
 B) Choice B text
 C) Choice C text
 D) Choice D text
-Answer: B
-
-(Continue for all 7 questions)
+Answer: B"""
 
-Passage:
-{text}"""
 
+def call_gemini(prompt):
+    """
+    Send a prompt to Gemini, falling back to the second model if the first one fails.
+    Returns the response text, or FAILED_GENERATION if both models fail.
+    """
     #try each model 
     for model_name in [PRIMARY_MODEL, FALLBACK_MODEL]:
         try:
             print(f"Trying Gemini model: {model_name}...")
+            gemini_rate_limiter.wait()
             model = genai.GenerativeModel(model_name)
             response = model.generate_content(prompt)
             return response.text
@@ -54,7 +88,135 @@ Passage:
         except Exception as e:
             print(f"⚠️ Error with {model_name}: {e}")
     #if both models fail
-    return "❌ Failed to generate questions."
+    return FAILED_GENERATION
+
+
+def question_prompt(text):
+    """Prompt asking Gemini for 7 questions about one passage"""
+    return f"""Based on this passage, generate exactly 7 reading comprehension questions. 
+
+{QUESTION_FORMAT}
+
+(Continue for all 7 questions)
+
+Passage:
+{text}"""
+
+
+def generate_questions(text): #takes in passage text 
+    """
+    Given a passage of text, generate 7 reading comprehension questions, using Gemini.
+    Falls back to another model if the first one fails.
+    """
+    return call_gemini(question_prompt(text))
+
+
+def stream_gemini(prompt):
+    """
+    Yield Gemini's response text chunk by chunk as it is generated.
+    Falls back to the second model only if the first fails before producing any output.
+
+    Raises:
+        QuestionGenerationError: both models failed, or a stream broke off midway
+    """
+    for model_name in [PRIMARY_MODEL, FALLBACK_MODEL]:
+        started = False
+        try:
+            print(f"Streaming from Gemini model: {model_name}...")
+            gemini_rate_limiter.wait()
+            model = genai.GenerativeModel(model_name)
+            for chunk in model.generate_content(prompt, stream=True):
+                if chunk.text:
+                    started = True
+                    yield chunk.text
+            return
+        except Exception as e:
+            if started:
+                raise QuestionGenerationError(f"Gemini stream from {model_name} broke off: {e}")
+            print(f"⚠️ Error with {model_name}: {e}")
+    raise QuestionGenerationError("All Gemini models failed")
+
+#regex patterns to identify question, choices, and answers in the text.
+question_pattern = re.compile(r'^\*\*\d+\.\s*(.+?)\*\*')
+choice_pattern = re.compile(r'^[A-D]\)\s*(.+)')
+answer_pattern = re.compile(r'^Answer:\s*([A-D])')
+one_line_choices_pattern = re.compile(r'([A-D])\s*\)\s*([^A-D]+?)(?=\s*[A-D]\s*\)|$)')
+
+
+class QuestionParser:
+    """
+    Push-based parser for Gemini question output.
+
+    feed() accepts arbitrary chunks of text (e.g. from a streamed response) and
+    returns the questions completed by that chunk; close() flushes the rest.
+
+    By default a question is complete when the next question starts (this is
+    what parse_questions uses). With emit_on_answer=True a question is
+    returned as soon as its "Answer:" line arrives, so streaming callers can
+    persist it without waiting for the next question.
+    """
+
+    def __init__(self, emit_on_answer=False):
+        self.emit_on_answer = emit_on_answer
+        self._buffer = ""
+        self._current = None
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        complete, newline, self._buffer = self._buffer.rpartition("\n")
+        if not newline:
+            self._buffer = complete + self._buffer
+            return []
+        return self._parse_lines(complete + newline)
+
+    def close(self):
+        completed = self._parse_lines(self._buffer)
+        self._buffer = ""
+        #append last parsed question 
+        if self._current:
+            completed.append(self._current)
+            self._current = None
+        return completed
+
+    def _parse_lines(self, text):
+        completed = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+
+            if question_pattern.match(line):
+                if self._current:
+                    completed.append(self._current)
+                self._current = {"question_text": "", "answers": [], "correct_choice": None}
+                self._current["question_text"] = question_pattern.match(line).group(1).strip()
+            elif choice_pattern.match(line) and self._current:
+                choice_text = choice_pattern.match(line).group(1).strip()
+                choice_letter = line[0]  # 'A', 'B', 'C', or 'D'
+                self._current["answers"].append({
+                    "choice_letter": choice_letter,
+                    "choice_text": choice_text,
+                    "is_correct": False
+                })
+            elif 'A)' in line and 'B)' in line and 'C)' in line and 'D)' in line and self._current:
+                # Handle case where all choices are on one line
+                choice_matches = one_line_choices_pattern.findall(line)
+                for choice_letter, choice_text in choice_matches:
+                    self._current["answers"].append({
+                        "choice_letter": choice_letter,
+                        "choice_text": choice_text.strip(),
+                        "is_correct": False
+                    })
+            #mark correct answer
+            elif answer_pattern.match(line) and self._current:
+                correct_letter = answer_pattern.match(line).group(1)
+                for ans in self._current["answers"]:
+                    ans["is_correct"] = (ans["choice_letter"] == correct_letter)
+                if self.emit_on_answer and self._current["answers"]:
+                    completed.append(self._current)
+                    self._current = None
+        return completed
+
 
 def parse_questions(raw_text):
     """
@@ -66,91 +228,69 @@ def parse_questions(raw_text):
     Returns:
         list[dict]: A list of question dicts with empty answers (for now).
     """
-    questions = []
-    current_question = None
-
-    #regex patterns to identify question, choices, and answers in the text.
-    question_pattern = re.compile(r'^\*\*\d+\.\s*(.+?)\*\*')
-    choice_pattern = re.compile(r'^[A-D]\)\s*(.+)')
-    answer_pattern = re.compile(r'^Answer:\s*([A-D])')
-
-    for line in raw_text.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-
-        if question_pattern.match(line):
-            if current_question:
-                questions.append(current_question)
-            current_question = {"question_text": "", "answers": [], "correct_choice": None}
-            current_question["question_text"] = question_pattern.match(line).group(1).strip()
-        elif choice_pattern.match(line) and current_question:
-            choice_text = choice_pattern.match(line).group(1).strip()
-            choice_letter = line[0]  # 'A', 'B', 'C', or 'D'
-            current_question["answers"].append({
-                "choice_letter": choice_letter,
-                "choice_text": choice_text,
-                "is_correct": False
-            })
-        elif 'A)' in line and 'B)' in line and 'C)' in line and 'D)' in line and current_question:
-            # Handle case where all choices are on one line
-            choice_matches = re.findall(r'([A-D])\s*\)\s*([^A-D]+?)(?=\s*[A-D]\s*\)|$)', line)
-            for choice_letter, choice_text in choice_matches:
-                current_question["answers"].append({
-                    "choice_letter": choice_letter,
-                    "choice_text": choice_text.strip(),
-                    "is_correct": False
-                })
-                #mark correct answer
-        elif answer_pattern.match(line) and current_question:
-            correct_letter = answer_pattern.match(line).group(1)
-            for ans in current_question["answers"]:
-                ans["is_correct"] = (ans["choice_letter"] == correct_letter)
-    #append last parsed question 
-    if current_question:
-        questions.append(current_question)
+    parser = QuestionParser()
+    return parser.feed(raw_text) + parser.close()
 
-    return questions
 
+def create_question(document, question, source_section=None, duplicate_of_id=None, minhash=None):
+    """Create one QuizQuestion and its QuizAnswers from a parsed question dict"""
+    with transaction.atomic():
+        new_question = QuizQuestion.objects.create(
+            document=document,
+            question_text=question["question_text"],
+            explanation="",  # or fill if you get explanation
+            source_section=source_section,
+            duplicate_of_id=duplicate_of_id,
+            minhash=minhash,
+        )
+        for ans in question["answers"]:
+            QuizAnswer.objects.create(
+                question=new_question,
+                choice_letter=ans["choice_letter"],
+                choice_text=ans["choice_text"],
+                is_correct=ans["is_correct"]
+            )
+    return new_question
 
-def save_parsed_questions(document, parsed_questions):
+
+def save_parsed_questions(document, parsed_questions, source_section=None):
     """
     Save parsed questions to the database with proper error handling.
     
     Args:
         document: UploadedDocument instance
         parsed_questions: List of parsed question dictionaries
+        source_section: hash of the passage section the questions were generated from
     
+    Near-duplicates of existing questions (or of each other) are flagged or
+    dropped as set by QUESTION_DUPLICATES (see near_duplicates.py).
+
     Returns:
         bool: True if successful, False otherwise
     """
     try:
         print(f"🔄 Attempting to save {len(parsed_questions)} questions to database...")
+        checks = check_questions(document.id, [q['question_text'] for q in parsed_questions])
+        saved = {}  # batch position -> QuizQuestion
         #all DB operations succeed or none are saved
         with transaction.atomic():
-            for q in parsed_questions:
+            for i, q in enumerate(parsed_questions):
+                check = checks[i] if checks else None
+                if check and check.drop:
+                    print(f"♻️ Skipping near-duplicate question: {q['question_text'][:50]}...")
+                    continue
+                duplicate_of_id = None
+                if check:
+                    duplicate_of_id = saved[check.batch_position].id if check.batch_position is not None else check.duplicate_of
                 print(f"📝 Creating question: {q['question_text'][:50]}...")
-                
-                new_question = QuizQuestion.objects.create(
-                    document=document,
-                    question_text=q["question_text"],
-                    explanation=""  # or fill if you get explanation
+                new_question = create_question(
+                    document, q, source_section=source_section,
+                    duplicate_of_id=duplicate_of_id, minhash=check.minhash if check else None,
                 )
-                
-                print(f"✅ Question created with ID: {new_question.id}")
-                
-                for ans in q["answers"]:
-                    QuizAnswer.objects.create(
-                        question=new_question,
-                        choice_letter=ans["choice_letter"],
-                        choice_text=ans["choice_text"],
-                        is_correct=ans["is_correct"]
-                    )
-                    print(f"   📍 Answer {ans['choice_letter']}: {ans['choice_text'][:30]}...")
-                
-                print(f"✅ All answers saved for question {new_question.id}")
+                saved[i] = new_question
+                print(f"✅ Question {new_question.id} created with {len(q['answers'])} answers")
         
-        print(f"🎉 Successfully saved {len(parsed_questions)} questions with all answers!")
+        print(f"🎉 Successfully saved {len(saved)} questions with all answers!")
         return True
         
     except Exception as e:
@@ -159,3 +299,186 @@ def save_parsed_questions(document, parsed_questions):
         import traceback
         traceback.print_exc()
         return False
+
+
+def prompt_text(sections):
+    """
+    Passage text for one prompt: the leading sections that fit in
+    MAX_PROMPT_CHARS together (the first section is always included,
+    truncated if it is longer on its own).
+    """
+    text = sections[0].text
+    for section in sections[1:]:
+        if len(text) + 1 + len(section.text) > MAX_PROMPT_CHARS:
+            break
+        text += '\n' + section.text
+    return text[:MAX_PROMPT_CHARS]
+
+
+def generate_parsed_questions(text):
+    """
+    Ask Gemini for questions about `text` and parse them (nothing is saved).
+
+    Raises:
+        QuestionGenerationError: Gemini failed or its output had no parseable questions
+    """
+    questions_text = generate_questions(text)
+    if questions_text == FAILED_GENERATION:
+        raise QuestionGenerationError("All Gemini models failed")
+
+    parsed_questions = parse_questions(questions_text)
+    if not parsed_questions:
+        raise QuestionGenerationError("Gemini output contained no parseable questions")
+    return parsed_questions
+
+
+def generate_and_save_questions(document, replace=False, section=None):
+    """
+    Generate questions for a document with Gemini and save them.
+
+    Args:
+        document: UploadedDocument instance with parsed_text
+        replace: delete the document's existing questions first (this also
+            deletes the UserAnswer rows pointing at them)
+        section: sections.Section to generate from (default: as many leading
+            sections as fit in one prompt; the questions are recorded against
+            the first of them)
+
+    Returns:
+        int: number of questions saved
+
+    Raises:
+        QuestionGenerationError: no text, Gemini failed, nothing parseable, or the save failed
+    """
+    sections = split_sections(document.parsed_text)
+    if not sections:
+        raise QuestionGenerationError(f"Document {document.pk} has no parsed text")
+    if section is None:
+        section, text = sections[0], prompt_text(sections)
+    else:
+        text = section.text[:MAX_PROMPT_CHARS]
+
+    parsed_questions = generate_parsed_questions(text)
+    store_generated_questions(document, parsed_questions, section, sections, replace=replace)
+    return len(parsed_questions)
+
+
+def store_generated_questions(document, parsed_questions, section, sections, replace=False):
+    """
+    Save questions generated from one section of a document and record the document's section hashes.
+
+    Raises:
+        QuestionGenerationError: if the save failed
+    """
+    with transaction.atomic():
+        if replace:
+            document.questions.all().delete()
+        if not save_parsed_questions(document, parsed_questions, source_section=section.hash):
+            raise QuestionGenerationError("Saving the parsed questions failed")
+        section_hashes = [s.hash for s in sections]
+        if document.section_hashes != section_hashes:
+            document.section_hashes = section_hashes
+            document.save(update_fields=['section_hashes'])
+
+
+def stream_and_save_questions(document):
+    """
+    Generate questions for a document's leading sections (see prompt_text)
+    with a streamed Gemini response, saving each question as soon as its "Answer:" line arrives.
+
+    Yields:
+        QuizQuestion: each question right after it is saved
+
+    Raises:
+        QuestionGenerationError: no text, Gemini failed, or nothing parseable
+    """
+    sections = split_sections(document.parsed_text)
+    if not sections:
+        raise QuestionGenerationError(f"Document {document.pk} has no parsed text")
+    section = sections[0]
+
+    parser = QuestionParser(emit_on_answer=True)
+    parsed = 0
+    for chunk in stream_gemini(question_prompt(prompt_text(sections))):
+        for question in parser.feed(chunk):
+            parsed += 1
+            new_question = _create_unless_duplicate(document, question, section.hash)
+            if new_question:
+                yield new_question
+    for question in parser.close():
+        parsed += 1
+        new_question = _create_unless_duplicate(document, question, section.hash)
+        if new_question:
+            yield new_question
+
+    if not parsed:
+        raise QuestionGenerationError("Gemini output contained no parseable questions")
+    section_hashes = [s.hash for s in sections]
+    if document.section_hashes != section_hashes:
+        document.section_hashes = section_hashes
+        document.save(update_fields=['section_hashes'])
+
+
+def _create_unless_duplicate(document, question, source_section):
+    """create_question with the near-duplicate check (streamed questions come one at a time)"""
+    checks = check_questions(document.id, [question["question_text"]])
+    if not checks:
+        return create_question(document, question, source_section=source_section)
+    if checks[0].drop:
+        print(f"♻️ Skipping near-duplicate question: {question['question_text'][:50]}...")
+        return None
+    return create_question(
+        document, question, source_section=source_section,
+        duplicate_of_id=checks[0].duplicate_of, minhash=checks[0].minhash,
+    )
+
+
+def regenerate_changed_sections(document, previous_text):
+    """
+    Bring a document's questions up to date after its text changed (e.g. file replaced).
+
+    Only questions generated from sections that no longer exist are deleted,
+    and only the sections that replace them are sent to Gemini. Questions from
+    unchanged sections, and the UserAnswer history pointing at them, are kept.
+    Questions saved before section tracking existed count as coming from the
+    first section of the previous text. New questions are generated first and
+    swapped in for the stale ones in one transaction.
+
+    Returns:
+        (deleted, generated): number of questions deleted and newly saved
+
+    Raises:
+        QuestionGenerationError: generation failed (nothing was changed)
+    """
+    old_hashes = [s.hash for s in split_sections(previous_text)]
+    new_sections = split_sections(document.parsed_text)
+
+    questions = document.questions.all()
+    sourced = set(questions.exclude(source_section__isnull=True).values_list('source_section', flat=True))
+    untracked = old_hashes and questions.filter(source_section__isnull=True).exists()
+    if untracked:
+        sourced.add(old_hashes[0])
+
+    stale, to_generate = plan_regeneration(old_hashes, new_sections, sourced)
+
+    # Call Gemini before touching anything, so a failure leaves the old questions in place
+    generated_batches = [
+        (section, generate_parsed_questions(section.text[:MAX_PROMPT_CHARS]))
+        for section in to_generate
+    ]
+
+    deleted = generated = 0
+    with transaction.atomic():
+        if untracked:
+            questions.filter(source_section__isnull=True).update(source_section=old_hashes[0])
+        if stale:
+            stale_questions = QuizQuestion.objects.filter(document=document, source_section__in=stale)
+            deleted = stale_questions.count()
+            stale_questions.delete()
+        for section, parsed_questions in generated_batches:
+            if not save_parsed_questions(document, parsed_questions, source_section=section.hash):
+                raise QuestionGenerationError("Saving the parsed questions failed")
+            generated += len(parsed_questions)
+        document.section_hashes = [s.hash for s in new_sections]
+        document.save(update_fields=['section_hashes'])
+    return deleted, generated
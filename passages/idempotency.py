@@ -0,0 +1,135 @@
+"""
+Idempotency-Key support for non-idempotent POST endpoints.
+
+A client that may retry a request sends the same `Idempotency-Key` header
+with each attempt. The first attempt claims the key (a unique row per key and
+scope) and its response is stored; later attempts within
+IDEMPOTENCY_KEY_TTL get the stored response back (with an
+`Idempotent-Replayed: true` header) instead of creating another quiz response
+or document. An attempt that arrives while the first is still running gets
+409, and reusing a key with a different payload gets 422. The running attempt
+holds the key for IDEMPOTENCY_LOCK_TIMEOUT seconds; if it hasn't finished by
+then (e.g. its worker was killed) the next retry takes the key over and runs
+the request itself.
+
+Server errors (5xx) and conflict/rate-limit responses are not stored, so the
+request can be retried for real.
+"""
+
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .extraction import hash_file
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+NOT_STORED = {status.HTTP_408_REQUEST_TIMEOUT, status.HTTP_409_CONFLICT, status.HTTP_429_TOO_MANY_REQUESTS}
+
+
+def request_fingerprint(request):
+    """Hash of the request payload; uploaded files count by name and content hash"""
+    data = request.data
+    if hasattr(data, 'lists'):
+        items = {
+            key: [f'{v.name}:{hash_file(v)}' if hasattr(v, 'chunks') else v for v in values]
+            for key, values in data.lists()
+        }
+    else:
+        items = data
+    payload = json.dumps([request.method, request.path, items], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def claim(key, scope, fingerprint):
+    """
+    (record, created): a new in-progress record, the in-progress record of an
+    attempt whose lease ran out (taken over, created=True), or the existing
+    record for this key
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    locked_until = now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    key=key, scope=scope, fingerprint=fingerprint, expires_at=expires_at, locked_until=locked_until,
+                ), True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(key=key, scope=scope).first()
+            if record is None:
+                continue  # deleted in between: try again
+            if record.expires_at < now:
+                record.delete()  # expired but not swept yet
+                continue
+            if record.status_code is None and record.fingerprint == fingerprint:
+                # The first attempt's lease ran out: take the key over (only one retry wins)
+                taken = IdempotencyKey.objects.filter(
+                    Q(locked_until__isnull=True) | Q(locked_until__lt=now), pk=record.pk, status_code__isnull=True,
+                ).update(locked_until=locked_until)
+                if taken:
+                    record.locked_until = locked_until
+                    return record, True
+            return record, False
+    raise IntegrityError(f'Could not claim idempotency key {key!r}')
+
+
+def idempotent(scope_name):
+    """Decorator for DRF view methods (self, request, ...) that honours the Idempotency-Key header"""
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view_method(self, request, *args, **kwargs)
+            if len(key) > 255:
+                return Response({'error': f'{HEADER} is limited to 255 characters'}, status=status.HTTP_400_BAD_REQUEST)
+
+            user = request.user.pk if request.user.is_authenticated else 'anonymous'
+            record, created = claim(key, f'{scope_name}:{user}', request_fingerprint(request))
+            if not created:
+                return replay(record, request)
+
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+            if response.status_code >= 500 or response.status_code in NOT_STORED:
+                record.delete()
+            else:
+                IdempotencyKey.objects.filter(pk=record.pk).update(
+                    status_code=response.status_code, response_body=response.data, locked_until=None,
+                )
+            return response
+        return wrapper
+    return decorator
+
+
+def replay(record, request):
+    if record.fingerprint != request_fingerprint(request):
+        return Response({'error': f'{HEADER} was already used for a different request'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if record.status_code is None:
+        response = Response({'error': 'A request with this Idempotency-Key is still being processed'},
+                            status=status.HTTP_409_CONFLICT)
+        response['Retry-After'] = '1'
+        return response
+    response = Response(record.response_body, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def clear_expired_keys():
+    """Delete expired keys; returns how many"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lt=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from passages.benchmarks import BENCHMARKS, SIZES, find_regressions, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Run the parsing/serialization micro-benchmarks and compare them against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='Benchmark groups to run (default: all)')
+        parser.add_argument('--sizes', nargs='+', type=int, default=SIZES, help='Question/paragraph counts to run at')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--baseline', help='JSON results from a previous run to compare against')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed slowdown vs. baseline before failing (0.25 = 25%%)')
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(groups=options['only'], sizes=options['sizes'], repeat=options['repeat'])
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            results['regressions'] = find_regressions(results, baseline, options['threshold'])
+            results['threshold'] = options['threshold']
+
+        payload = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(payload)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(results['results'])} results to {options['output']}"))
+        else:
+            self.stdout.write(payload)
+
+        regressions = results.get('regressions')
+        if regressions:
+            for r in regressions:
+                self.stderr.write(f"{r['name']}[{r['size']}]: {r['baseline']:.6f}s -> {r['current']:.6f}s (x{r['ratio']})")
+            raise CommandError(f"{len(regressions)} benchmark(s) regressed more than {options['threshold']:.0%}")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from passages.idempotency import clear_expired_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete expired Idempotency-Key records (run periodically, e.g. hourly)'
+
+    def handle(self, *args, **options):
+        count = clear_expired_keys()
+        self.stdout.write(self.style.SUCCESS(f'Removed {count} expired idempotency key(s)'))
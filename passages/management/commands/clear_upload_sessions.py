@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from passages.uploads import clear_expired_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete expired chunked-upload sessions and their staging files (run periodically, e.g. hourly)'
+
+    def handle(self, *args, **options):
+        count = clear_expired_sessions()
+        self.stdout.write(self.style.SUCCESS(f'Removed {count} expired upload session(s)'))
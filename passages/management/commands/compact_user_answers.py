@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from passages.models import QuizResponse
+from passages.packed_answers import compact_responses
+
+
+class Command(BaseCommand):
+    help = 'Fold the UserAnswer rows of older quiz responses into packed columns on QuizResponse'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=30, help='Only responses submitted more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=500, help='Responses per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many responses would be packed')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        responses = QuizResponse.objects.filter(submitted_at__lt=cutoff, packed_answers__isnull=True)
+        if options['dry_run']:
+            self.stdout.write(f'{responses.count()} response(s) would be packed')
+            return
+        packed, removed = compact_responses(responses, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Packed {packed} response(s), removed {removed} UserAnswer row(s)'))
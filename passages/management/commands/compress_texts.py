@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from passages.compression import MAX_DICTIONARIES, compress, latest_dictionary, text_of, train_dictionary
+from passages.models import CompressionDictionary, UploadedDocument
+
+
+class Command(BaseCommand):
+    help = 'Recompress stored passage texts with the latest compression dictionary (optionally training a new one) and report the space saved'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--train', action='store_true', help='Train a new dictionary on a sample of the stored texts first')
+        parser.add_argument('--sample', type=int, default=500, help='Newest documents to train on')
+        parser.add_argument('--batch-size', type=int, default=200, help='Documents per bulk update')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the current sizes')
+
+    def handle(self, *args, **options):
+        documents = UploadedDocument.objects.exclude(parsed_text__isnull=True).exclude(parsed_text='')
+        if options['train'] and not options['dry_run']:
+            sample = [text_of(text) for text in documents.order_by('-id').values_list('parsed_text', flat=True)[:options['sample']]]
+            if not sample:
+                raise CommandError('No stored texts to train on')
+            with transaction.atomic():
+                dictionary = CompressionDictionary.objects.create(data=train_dictionary(sample), sample_size=len(sample))
+                # The id goes in each text's header byte; ids skipped by the sequence count too
+                if dictionary.pk > MAX_DICTIONARIES:
+                    raise CommandError(f'Dictionary ids must be at most {MAX_DICTIONARIES}; got {dictionary.pk}')
+            self.stdout.write(f'Trained dictionary {dictionary.pk} ({len(dictionary.data)} bytes) on {len(sample)} document(s)')
+
+        dictionary = latest_dictionary()
+        ids = list(documents.order_by('id').values_list('id', flat=True))
+        batch_size = options['batch_size']
+        raw = stored = recompressed = old_size = new_size = 0
+        for start in range(0, len(ids), batch_size):
+            updates = []
+            for pk, blob in UploadedDocument.objects.filter(id__in=ids[start:start + batch_size]).values_list('id', 'parsed_text'):
+                text = text_of(blob)
+                raw += len(text.encode('utf-8'))
+                if blob[0] != dictionary[0] and not options['dry_run']:
+                    old_size += len(blob)
+                    blob = compress(text, dictionary)
+                    new_size += len(blob)
+                    updates.append(UploadedDocument(id=pk, parsed_text=blob))
+                stored += len(blob)
+            UploadedDocument.objects.bulk_update(updates, ['parsed_text'])
+            recompressed += len(updates)
+
+        if recompressed:
+            self.stdout.write(f'Recompressed {recompressed} document(s) with dictionary {dictionary[0]}: '
+                              f'{old_size / 1e6:.2f} MB -> {new_size / 1e6:.2f} MB')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(ids)} document(s): {raw / 1e6:.2f} MB of text stored in {stored / 1e6:.2f} MB '
+            f'({100 - 100 * stored / max(raw, 1):.0f}% saved)'
+        ))
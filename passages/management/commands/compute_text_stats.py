@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from passages.compression import text_of
+from passages.models import UploadedDocument
+from passages.text_stats import STAT_FIELDS, text_stats_many
+
+
+class Command(BaseCommand):
+    help = 'Compute word count, sentence count, reading time and readability for documents parsed before they were stored'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute every document, not only those without statistics')
+        parser.add_argument('--batch-size', type=int, default=500, help='Documents per bulk update')
+
+    def handle(self, *args, **options):
+        documents = UploadedDocument.objects.exclude(parsed_text__isnull=True)
+        if not options['all']:
+            documents = documents.filter(word_count__isnull=True)
+        ids = list(documents.order_by('id').values_list('id', flat=True))
+        batch_size = options['batch_size']
+
+        for start in range(0, len(ids), batch_size):
+            rows = list(UploadedDocument.objects.filter(id__in=ids[start:start + batch_size]).values_list('id', 'parsed_text'))
+            updates = [
+                UploadedDocument(id=pk, **stats)
+                for (pk, _), stats in zip(rows, text_stats_many([text_of(text) for _, text in rows]))
+            ]
+            UploadedDocument.objects.bulk_update(updates, STAT_FIELDS)
+        self.stdout.write(self.style.SUCCESS(f'Computed text statistics for {len(ids)} document(s)'))
@@ -0,0 +1,88 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from passages.blobs import document_storage
+from passages.extraction import hash_file
+from passages.models import StoredBlob, UploadedDocument, content_addressed_name
+
+
+class Command(BaseCommand):
+    help = 'Move uploaded files to content-addressed storage, sharing one stored copy per distinct content'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deduplicated')
+        parser.add_argument('--keep-originals', action='store_true',
+                            help="Don't delete the old files once no document uses them")
+
+    def handle(self, *args, **options):
+        storage = document_storage()
+        dry_run = options['dry_run']
+
+        # Group documents by the hash of their current file
+        by_hash = defaultdict(list)
+        sizes = {}
+        missing = 0
+        documents = UploadedDocument.objects.exclude(file='').only('id', 'file', 'content_hash').order_by('id')
+        for document in documents.iterator(chunk_size=200):
+            name = document.file.name
+            if not storage.exists(name):
+                missing += 1
+                self.stderr.write(f'Document {document.pk}: file {name} is missing, skipped')
+                continue
+            content_hash = document.content_hash
+            if not content_hash:
+                with document.file.open('rb') as f:
+                    content_hash = hash_file(f)
+            by_hash[content_hash].append(document)
+            sizes[name] = storage.size(name)
+
+        old_names = {document.file.name for group in by_hash.values() for document in group}
+        copies_before = len(old_names)
+        bytes_before = sum(sizes[name] for name in old_names)
+        bytes_after = sum(sizes[group[0].file.name] for group in by_hash.values())
+        self.stdout.write(
+            f'{sum(len(g) for g in by_hash.values())} document(s), {copies_before} stored file(s), '
+            f'{len(by_hash)} distinct content(s); {bytes_before - bytes_after} bytes reclaimable'
+        )
+        if dry_run:
+            return
+
+        for content_hash, group in by_hash.items():
+            self.move_group(storage, content_hash, group)
+
+        # Old files that no document points at any more
+        still_used = set(UploadedDocument.objects.filter(file__in=old_names).values_list('file', flat=True))
+        removed = 0
+        if not options['keep_originals']:
+            for name in old_names - still_used:
+                storage.delete(name)
+                removed += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {len(by_hash)} blob(s), {removed} duplicate/old file(s) removed, {missing} missing'
+        ))
+
+    def move_group(self, storage, content_hash, documents):
+        """Point every document with this content at one content-addressed blob"""
+        first = documents[0]
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update().filter(content_hash=content_hash).first()
+            if blob is None:
+                name = content_addressed_name(content_hash, first.file.name)
+                if not storage.exists(name):
+                    with first.file.open('rb') as f:
+                        name = storage.save(name, f)
+                blob = StoredBlob.objects.create(content_hash=content_hash, name=name, size=storage.size(name))
+
+            moved = [d for d in documents if d.file.name != blob.name]
+            for document in moved:
+                document.file.name = blob.name
+                document.content_hash = content_hash
+            UploadedDocument.objects.bulk_update(moved, ['file', 'content_hash'])
+            UploadedDocument.objects.filter(pk__in=[d.pk for d in documents], content_hash='').update(
+                content_hash=content_hash
+            )
+            blob.ref_count = UploadedDocument.objects.filter(file=blob.name).count()
+            blob.save(update_fields=['ref_count'])
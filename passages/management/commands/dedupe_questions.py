@@ -0,0 +1,80 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from passages.models import QuizQuestion, QuizResponse, UserAnswer
+from passages.near_duplicates import NUM_PERM, duplicate_targets, signatures
+from passages.packed_answers import packed_question_ids
+
+BATCH_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = 'Find near-duplicate questions across the whole bank and set duplicate_of (MinHash, one vectorized pass)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=None,
+                            help='Estimated similarity to count as a duplicate (default QUESTION_DUPLICATE_THRESHOLD)')
+        parser.add_argument('--delete', action='store_true',
+                            help='Delete duplicates of a question in the same document that nobody has answered (packed answers included)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+
+    def handle(self, *args, **options):
+        threshold = options['threshold'] or settings.QUESTION_DUPLICATE_THRESHOLD
+        dry_run = options['dry_run']
+
+        missing = QuizQuestion.objects.filter(minhash__isnull=True)
+        if not dry_run:
+            # Questions saved before signatures existed
+            computed = 0
+            ids = list(missing.order_by('id').values_list('id', flat=True))
+            for start in range(0, len(ids), BATCH_SIZE):
+                rows = list(QuizQuestion.objects.filter(id__in=ids[start:start + BATCH_SIZE]).values_list('id', 'question_text'))
+                sigs = signatures([text for _, text in rows])
+                QuizQuestion.objects.bulk_update(
+                    [QuizQuestion(id=pk, minhash=sig.tobytes()) for (pk, _), sig in zip(rows, sigs)], ['minhash'],
+                )
+                computed += len(rows)
+            self.stdout.write(f'Computed {computed} signature(s)')
+
+        rows = list(QuizQuestion.objects.filter(minhash__isnull=False).order_by('id')
+                    .values_list('id', 'document_id', 'duplicate_of_id', 'minhash'))
+        if not rows:
+            self.stdout.write('No questions to check')
+            return
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        documents = np.array([row[1] for row in rows], dtype=np.int64)
+        sigs = np.frombuffer(b''.join(bytes(row[3]) for row in rows), dtype=np.uint32).reshape(-1, NUM_PERM)
+        targets = duplicate_targets(sigs, threshold)
+
+        duplicates = np.flatnonzero(targets >= 0)
+        updates = [
+            QuizQuestion(id=int(ids[i]), duplicate_of_id=int(ids[targets[i]]))
+            for i in duplicates if rows[i][2] != ids[targets[i]]
+        ]
+        same_document = [int(ids[i]) for i in duplicates if documents[i] == documents[targets[i]]]
+        self.stdout.write(
+            f'{len(duplicates)} near-duplicate(s) of {len(np.unique(targets[duplicates]))} question(s) '
+            f'among {len(rows)}; {len(same_document)} within the same document, {len(updates)} newly flagged'
+        )
+        if dry_run:
+            return
+
+        with transaction.atomic():
+            QuizQuestion.objects.bulk_update(updates, ['duplicate_of'], batch_size=BATCH_SIZE)
+            if options['delete']:
+                answered = set()
+                for start in range(0, len(same_document), BATCH_SIZE):
+                    chunk = same_document[start:start + BATCH_SIZE]
+                    answered.update(UserAnswer.objects.filter(question_id__in=chunk).values_list('question_id', flat=True))
+                # Answers stored packed on QuizResponse (see packed_answers.py) have no rows to look up
+                affected = sorted(set(documents[np.isin(ids, same_document)].tolist()))
+                for start in range(0, len(affected), BATCH_SIZE):
+                    responses = QuizResponse.objects.filter(document_id__in=affected[start:start + BATCH_SIZE])
+                    answered.update(packed_question_ids(responses).intersection(same_document))
+                deletable = [pk for pk in same_document if pk not in answered]
+                for start in range(0, len(deletable), BATCH_SIZE):
+                    QuizQuestion.objects.filter(id__in=deletable[start:start + BATCH_SIZE]).delete()
+                self.stdout.write(f'Deleted {len(deletable)} unanswered duplicate(s) ({len(answered)} answered ones kept)')
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from passages.submissions import quiz_journal
+
+
+class Command(BaseCommand):
+    help = 'Bulk-insert quiz submissions buffered in the write-behind journal (QUIZ_WRITE_BEHIND)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Submissions per bulk insert')
+        parser.add_argument('--loop', action='store_true', help='Keep running, flushing every --interval seconds')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between flushes with --loop')
+
+    def handle(self, *args, **options):
+        journal = quiz_journal()
+        while True:
+            close_old_connections()
+            flushed, inserted = journal.flush(options['batch_size'])
+            if flushed or not options['loop']:
+                self.stdout.write(f'Flushed {flushed} submission(s), {inserted} inserted ({flushed - inserted} already saved)')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from passages.batching import GenerationBatcher, is_short_document
+from passages.gemini_utils import GEMINI_RPM, QuestionGenerationError
+from passages.single_flight import ensure_questions
+from passages.models import UploadedDocument
+
+
+class Checkpoint:
+    """
+    Progress file for a generation run, so an interrupted run resumes where it stopped.
+
+    Stores the selection options it was created for plus the ids of documents
+    that are done or failed. Written atomically after every document.
+    """
+
+    def __init__(self, path, selection):
+        self.path = path
+        self.selection = selection
+        self.done = set()
+        self.failed = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            data = json.load(f)
+        if data.get('selection') != self.selection:
+            raise CommandError(
+                f"Checkpoint {self.path} was created with different options {data.get('selection')}; "
+                "use --restart to discard it"
+            )
+        self.done = set(data.get('done', []))
+        self.failed = {int(k): v for k, v in data.get('failed', {}).items()}
+        return True
+
+    def record(self, document_id, error=None):
+        with self._lock:
+            if error is None:
+                self.done.add(document_id)
+                self.failed.pop(document_id, None)
+            else:
+                self.failed[document_id] = error
+            self._write()
+
+    def _write(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'selection': self.selection,
+                'done': sorted(self.done),
+                'failed': {str(k): v for k, v in sorted(self.failed.items())},
+            }, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Command(BaseCommand):
+    help = 'Generate (or regenerate) quiz questions for a selection of documents, resumably'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true', help='Only documents that have no questions')
+        parser.add_argument('--uploaded-before', help='Only documents uploaded before this date (YYYY-MM-DD)')
+        parser.add_argument('--grade-level', help='Only documents for this grade level (id or name)')
+        parser.add_argument('--ids', nargs='+', type=int, help='Only these document ids')
+        parser.add_argument('--limit', type=int, help='Process at most this many documents')
+        parser.add_argument('--replace', action='store_true',
+                            help='Delete existing questions (and the answers users gave to them) before saving new ones')
+        parser.add_argument('--workers', type=int, default=2,
+                            help=f'Concurrent generation threads (Gemini calls stay under GEMINI_RPM={GEMINI_RPM})')
+        parser.add_argument('--checkpoint', default='generate_questions.checkpoint.json',
+                            help='Progress file used to resume an interrupted run')
+        parser.add_argument('--restart', action='store_true', help='Ignore and overwrite an existing checkpoint')
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry documents that failed in the checkpoint')
+        parser.add_argument('--batch-window', type=float, default=0,
+                            help='Coalesce short documents arriving within this many seconds into one prompt (0 = off)')
+        parser.add_argument('--max-batch', type=int, default=5, help='Most short documents per batched prompt')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the documents that would be processed')
+
+    def get_queryset(self, options):
+        queryset = UploadedDocument.objects.exclude(parsed_text__isnull=True).exclude(parsed_text='')
+        if options['missing']:
+            queryset = queryset.filter(questions__isnull=True)
+        if options['uploaded_before']:
+            try:
+                before = datetime.strptime(options['uploaded_before'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('--uploaded-before must be YYYY-MM-DD')
+            queryset = queryset.filter(uploaded_at__lt=timezone.make_aware(before))
+        if options['grade_level']:
+            grade_level = options['grade_level']
+            if grade_level.isdigit():
+                queryset = queryset.filter(grade_level_id=int(grade_level))
+            else:
+                queryset = queryset.filter(grade_level__name__iexact=grade_level)
+        if options['ids']:
+            queryset = queryset.filter(id__in=options['ids'])
+        return queryset.distinct().order_by('id')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        selection = {key: options[key] for key in ('missing', 'uploaded_before', 'grade_level', 'ids', 'replace')}
+        checkpoint = Checkpoint(options['checkpoint'], selection)
+        if options['restart']:
+            checkpoint.remove()
+        elif checkpoint.load():
+            self.stdout.write(
+                f'Resuming from {checkpoint.path}: {len(checkpoint.done)} done, {len(checkpoint.failed)} failed'
+            )
+
+        skip = set(checkpoint.done)
+        if not options['retry_failed']:
+            skip |= set(checkpoint.failed)
+        document_ids = [pk for pk in self.get_queryset(options).values_list('id', flat=True) if pk not in skip]
+        if options['limit']:
+            document_ids = document_ids[:options['limit']]
+
+        self.stdout.write(f'{len(document_ids)} document(s) to process with {options["workers"]} worker(s)')
+        if options['dry_run']:
+            self.stdout.write(', '.join(str(pk) for pk in document_ids))
+            return
+
+        batcher = None
+        if options['batch_window'] > 0:
+            batcher = GenerationBatcher(options['batch_window'], options['max_batch'], replace=options['replace'])
+
+        succeeded = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {}
+            for pk in document_ids:
+                document = UploadedDocument.objects.filter(pk=pk).first() if batcher else None
+                if document is not None and is_short_document(document):
+                    futures[batcher.submit(document)] = pk
+                else:
+                    futures[executor.submit(self.process_document, pk, options['replace'])] = pk
+            try:
+                for future in as_completed(futures):
+                    pk = futures[future]
+                    error = self.error_from(future)
+                    checkpoint.record(pk, error)
+                    if error is None:
+                        succeeded += 1
+                        self.stdout.write(self.style.SUCCESS(f'Document {pk}: done'))
+                    else:
+                        failed += 1
+                        self.stderr.write(f'Document {pk}: {error}')
+            except KeyboardInterrupt:
+                for future in futures:
+                    future.cancel()
+                self.stderr.write(f'Interrupted - progress saved to {checkpoint.path}, rerun to resume')
+                raise
+            finally:
+                if batcher:
+                    batcher.close()
+
+        self.stdout.write(self.style.SUCCESS(f'Finished: {succeeded} succeeded, {failed} failed'))
+        if failed:
+            self.stdout.write(f'Failed ids are kept in {checkpoint.path}; rerun with --retry-failed to retry them')
+        else:
+            checkpoint.remove()
+
+    def error_from(self, future):
+        """Error message for a finished future, None on success"""
+        try:
+            result = future.result()
+        except QuestionGenerationError as e:
+            return str(e)
+        except Exception as e:
+            return f'{type(e).__name__}: {e}'
+        # process_document returns its error message; batcher futures return a question count
+        return result if isinstance(result, str) else None
+
+    def process_document(self, pk, replace):
+        """Runs in a worker thread; returns None on success or an error message"""
+        close_old_connections()
+        try:
+            document = UploadedDocument.objects.get(pk=pk)
+            ensure_questions(document, replace=replace)
+            return None
+        except UploadedDocument.DoesNotExist:
+            return 'document no longer exists'
+        except QuestionGenerationError as e:
+            return str(e)
+        except Exception as e:
+            return f'{type(e).__name__}: {e}'
+        finally:
+            connections.close_all()
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from passages.question_import import FORMATS, format_for, import_file
+
+
+class Command(BaseCommand):
+    help = ('Import a question bank from CSV or NDJSON '
+            '(columns: document_id, question_text, explanation, A, B, C, D, answer)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or NDJSON file')
+        parser.add_argument('--format', dest='file_format', choices=FORMATS, help='Default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Questions per bulk insert')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, import nothing')
+        parser.add_argument('--show-errors', type=int, default=50, help='How many row errors to print')
+
+    def handle(self, *args, **options):
+        file_format = options['file_format'] or format_for(options['path'])
+        if file_format is None:
+            raise CommandError('Cannot tell the format from the file name; pass --format csv or --format ndjson')
+
+        started = time.monotonic()
+        try:
+            with open(options['path'], 'rb') as f:
+                result = import_file(f, file_format, batch_size=options['batch_size'], dry_run=options['dry_run'])
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for line_number, message in result.errors[:options['show_errors']]:
+            self.stderr.write(f'Line {line_number}: {message}')
+        if len(result.errors) > options['show_errors']:
+            self.stderr.write(f'... and {len(result.errors) - options["show_errors"]} more error(s)')
+
+        verb = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {result.imported} question(s) in {time.monotonic() - started:.1f}s, {len(result.errors)} row error(s)'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from passages.facets import rebuild_facet_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the cached grade level / skill category document counts (after bulk updates that skip signals)'
+
+    def handle(self, *args, **options):
+        pairs = rebuild_facet_counts()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt facet counts ({pairs} grade level / skill category pair(s))'))
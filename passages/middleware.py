@@ -0,0 +1,137 @@
+"""
+Response compression for ReadingKnack API payloads.
+
+CompressionMiddleware extends Django's GZipMiddleware with:
+  - Accept-Encoding negotiation (q-values) between brotli and gzip; brotli is
+    used only when the optional `brotli` package is installed
+  - a configurable size threshold (COMPRESSION_MIN_SIZE)
+  - a skip list for content that is already compressed (.docx, images, ...)
+    or must not be buffered (server-sent events)
+  - brotli support for streaming responses
+"""
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Used when settings.COMPRESSION_MIN_SIZE is not set; keep in sync with config/settings.py
+DEFAULT_MIN_SIZE = 500
+
+# Content types that don't benefit from (or break with) compression
+SKIP_CONTENT_TYPES = (
+    'image/',
+    'video/',
+    'audio/',
+    'application/zip',
+    'application/gzip',
+    'application/vnd.openxmlformats',  # .docx and friends are zip archives
+    'text/event-stream',  # must be flushed event by event
+)
+
+
+def parse_accept_encoding(header):
+    """Return {coding: q} for an Accept-Encoding header value."""
+    codings = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def choose_encoding(header):
+    """Pick 'br', 'gzip' or None for an Accept-Encoding header value."""
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get('*', 0.0)
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_q = None, 0.0
+    for coding in candidates:  # preference order breaks ties
+        q = codings.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def brotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=5)
+    for item in sequence:
+        data = compressor.process(item) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compress responses with brotli or gzip, whichever the client prefers.
+    Sets Vary: Accept-Encoding so shared caches keep the variants apart.
+    """
+
+    def process_response(self, request, response):
+        min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE)
+        if not response.streaming and len(response.content) < min_size:
+            return response
+
+        # Already encoded, or a byte range of the unencoded file
+        if response.has_header('Content-Encoding') or response.has_header('Content-Range'):
+            return response
+
+        content_type = response.get('Content-Type', '')
+        if content_type.startswith(SKIP_CONTENT_TYPES):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                # Leave async streams to the stock gzip behaviour
+                return super().process_response(request, response) if encoding == 'gzip' else response
+            if encoding == 'br':
+                response.streaming_content = brotli_sequence(response.streaming_content)
+            else:
+                response.streaming_content = compress_sequence(
+                    response.streaming_content,
+                    max_random_bytes=self.max_random_bytes,
+                )
+            # The compressed size isn't known until the stream ends
+            del response.headers['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed_content = brotli.compress(response.content, quality=5)
+            else:
+                compressed_content = compress_string(
+                    response.content,
+                    max_random_bytes=self.max_random_bytes,
+                )
+            # Only use the compressed content if it's actually shorter
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # Strong ETags become weak once the body is transformed (RFC 9110 8.8.1)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+
+        return response
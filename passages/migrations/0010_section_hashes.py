@@ -0,0 +1,23 @@
+# Generated by Django 4.2.22 on 2026-10-18 22:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passages', '0009_remove_passage_grade_level_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizquestion',
+            name='source_section',
+            field=models.CharField(blank=True, db_index=True, max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadeddocument',
+            name='section_hashes',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.22 on 2026-10-18 23:01
+
+from django.db import migrations, models
+import passages.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passages', '0012_uploadeddocument_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='uploadeddocument',
+            name='file',
+            field=models.FileField(max_length=255, upload_to=passages.models.document_upload_to),
+        ),
+    ]
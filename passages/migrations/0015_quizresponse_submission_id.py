@@ -0,0 +1,24 @@
+# Generated by Django 4.2.22 on 2026-10-18 23:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passages', '0014_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizresponse',
+            name='submission_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='quizresponse',
+            name='submitted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
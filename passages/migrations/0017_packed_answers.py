@@ -0,0 +1,23 @@
+# Generated by Django 4.2.22 on 2026-10-18 23:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passages', '0016_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizresponse',
+            name='correct_mask',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='quizresponse',
+            name='packed_answers',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.22 on 2026-10-18 23:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passages', '0017_packed_answers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizquestion',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='near_duplicates', to='passages.quizquestion'),
+        ),
+        migrations.AddField(
+            model_name='quizquestion',
+            name='minhash',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
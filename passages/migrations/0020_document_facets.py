@@ -0,0 +1,55 @@
+# Generated by Django 4.2.22 on 2026-10-18 23:35
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_documents(apps, schema_editor):
+    UploadedDocument = apps.get_model('passages', 'UploadedDocument')
+    DocumentFacetCount = apps.get_model('passages', 'DocumentFacetCount')
+    rows = UploadedDocument.objects.order_by().values('grade_level_id', 'skill_category_id').annotate(documents=Count('id'))
+    DocumentFacetCount.objects.bulk_create([
+        DocumentFacetCount(grade_level=row['grade_level_id'] or 0, skill_category=row['skill_category_id'] or 0,
+                           count=row['documents'])
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passages', '0019_document_text_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grade_level', models.PositiveIntegerField()),
+                ('skill_category', models.PositiveIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='uploadeddocument',
+            index=models.Index(fields=['grade_level', 'skill_category', '-uploaded_at'], name='document_facets_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadeddocument',
+            index=models.Index(fields=['skill_category', '-uploaded_at'], name='document_skill_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadeddocument',
+            index=models.Index(fields=['uploader', '-uploaded_at'], name='document_uploader_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadeddocument',
+            index=models.Index(fields=['-uploaded_at'], name='document_uploaded_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='documentfacetcount',
+            constraint=models.UniqueConstraint(fields=('grade_level', 'skill_category'), name='unique_facet_pair'),
+        ),
+        migrations.RunPython(count_existing_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.22 on 2026-10-18 23:39
+
+from django.db import migrations, models
+
+from passages.paging import paragraph_offsets
+
+BATCH_SIZE = 500
+
+
+def store_paragraph_offsets(apps, schema_editor):
+    UploadedDocument = apps.get_model('passages', 'UploadedDocument')
+    ids = list(UploadedDocument.objects.filter(parsed_text__isnull=False).order_by('id').values_list('id', flat=True))
+    for start in range(0, len(ids), BATCH_SIZE):
+        rows = UploadedDocument.objects.filter(id__in=ids[start:start + BATCH_SIZE]).values_list('id', 'parsed_text')
+        UploadedDocument.objects.bulk_update(
+            [UploadedDocument(id=pk, paragraph_offsets=paragraph_offsets(text)) for pk, text in rows],
+            ['paragraph_offsets'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passages', '0020_document_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadeddocument',
+            name='paragraph_offsets',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(store_paragraph_offsets, migrations.RunPython.noop),
+    ]
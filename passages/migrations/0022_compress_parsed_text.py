@@ -0,0 +1,82 @@
+# Generated by Django 4.2.22 on 2026-10-18 23:44
+
+from django.db import migrations, models
+import passages.compression
+from passages.compression import compress, decompress, train_dictionary
+
+BATCH_SIZE = 200
+SAMPLE_DOCUMENTS = 500
+
+
+def compress_existing_texts(apps, schema_editor):
+    """Train a dictionary on the newest passages, then compress every row in batches"""
+    UploadedDocument = apps.get_model('passages', 'UploadedDocument')
+    CompressionDictionary = apps.get_model('passages', 'CompressionDictionary')
+    documents = UploadedDocument.objects.exclude(parsed_text__isnull=True)
+    sample = list(documents.exclude(parsed_text='').order_by('-id').values_list('parsed_text', flat=True)[:SAMPLE_DOCUMENTS])
+    dictionary = (0, b'')
+    if sample:
+        data = train_dictionary(sample)
+        dictionary = (CompressionDictionary.objects.create(data=data, sample_size=len(sample)).pk, data)
+
+    ids = list(documents.order_by('id').values_list('id', flat=True))
+    before = after = 0
+    for start in range(0, len(ids), BATCH_SIZE):
+        updates = []
+        for pk, text in UploadedDocument.objects.filter(id__in=ids[start:start + BATCH_SIZE]).values_list('id', 'parsed_text'):
+            blob = compress(text, dictionary)
+            before += len(text.encode('utf-8'))
+            after += len(blob)
+            updates.append(UploadedDocument(id=pk, parsed_text_compressed=blob))
+        UploadedDocument.objects.bulk_update(updates, ['parsed_text_compressed'])
+    if ids:
+        print(f"\n  Compressed parsed_text of {len(ids)} document(s): {before / 1e6:.2f} MB -> {after / 1e6:.2f} MB "
+              f"({100 - 100 * after / max(before, 1):.0f}% saved)")
+
+
+def decompress_texts(apps, schema_editor):
+    UploadedDocument = apps.get_model('passages', 'UploadedDocument')
+    CompressionDictionary = apps.get_model('passages', 'CompressionDictionary')
+    dictionaries = {pk: bytes(data) for pk, data in CompressionDictionary.objects.values_list('id', 'data')}
+    ids = list(UploadedDocument.objects.exclude(parsed_text_compressed__isnull=True).order_by('id').values_list('id', flat=True))
+    for start in range(0, len(ids), BATCH_SIZE):
+        rows = UploadedDocument.objects.filter(id__in=ids[start:start + BATCH_SIZE]).values_list('id', 'parsed_text_compressed')
+        UploadedDocument.objects.bulk_update(
+            [UploadedDocument(id=pk, parsed_text=decompress(blob, dictionaries=dictionaries)) for pk, blob in rows],
+            ['parsed_text'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passages', '0021_document_paragraph_offsets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('sample_size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        # A new binary column, filled in batches, then swapped in for the text column
+        migrations.AddField(
+            model_name='uploadeddocument',
+            name='parsed_text_compressed',
+            field=passages.compression.CompressedTextField(blank=True, null=True),
+        ),
+        migrations.RunPython(compress_existing_texts, decompress_texts),
+        migrations.RemoveField(
+            model_name='uploadeddocument',
+            name='parsed_text',
+        ),
+        migrations.RenameField(
+            model_name='uploadeddocument',
+            old_name='parsed_text_compressed',
+            new_name='parsed_text',
+        ),
+    ]
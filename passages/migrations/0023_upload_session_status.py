@@ -0,0 +1,39 @@
+# Generated by Django 4.2.22 on 2026-10-19 00:07
+
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def convert_sessions(apps, schema_editor):
+    """Mark finalized sessions and move single-file staging uploads into per-session part directories"""
+    UploadSession = apps.get_model('passages', 'UploadSession')
+    UploadSession.objects.filter(document__isnull=False).update(status='finalized')
+    for session in UploadSession.objects.filter(document__isnull=True).iterator():
+        legacy = os.path.join(settings.UPLOAD_STAGING_DIR, f'{session.pk.hex}.part')
+        if os.path.exists(legacy):
+            directory = os.path.join(settings.UPLOAD_STAGING_DIR, session.pk.hex)
+            os.makedirs(directory, exist_ok=True)
+            os.replace(legacy, os.path.join(directory, f'{0:015d}.part'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passages', '0022_compress_parsed_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='status',
+            field=models.CharField(choices=[('receiving', 'Receiving'), ('finalizing', 'Finalizing'), ('finalized', 'Finalized')], default='receiving', max_length=10),
+        ),
+        migrations.RunPython(convert_sessions, migrations.RunPython.noop),
+    ]
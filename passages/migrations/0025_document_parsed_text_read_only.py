@@ -0,0 +1,19 @@
+# Generated by Django 4.2.22 on 2026-10-19 00:58
+
+from django.db import migrations
+import passages.compression
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passages', '0024_idempotency_key_lease'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadeddocument',
+            name='parsed_text',
+            field=passages.compression.CompressedTextField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,6 +1,27 @@
+import os
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .compression import CompressedTextField
+
+
+def content_addressed_name(content_hash, filename):
+    """Storage path for a blob with this SHA-256: documents/ab/<hash>.docx"""
+    extension = os.path.splitext(filename)[1].lower()
+    return f'documents/{content_hash[:2]}/{content_hash}{extension}'
+
+
+def document_upload_to(instance, filename):
+    # Content-addressed once the hash is known (see blobs.py), plain documents/ otherwise
+    if instance.content_hash:
+        return content_addressed_name(instance.content_hash, filename)
+    return f'documents/{filename}'
+
 
 # GradeLevel model: different educational level -> use to categorize
 class GradeLevel(models.Model):
@@ -47,26 +68,69 @@ class SkillCategory(models.Model):
 #     def __str__(self):
 #         return self.choice_letter
     
+# CompressionDictionary model: zlib preset dictionary trained on stored passages (see compression.py)
+# Stored texts name the dictionary they were compressed with, so rows are only ever added
+class CompressionDictionary(models.Model):
+    data = models.BinaryField()  # up to 32 KB of phrases common in the sample
+    sample_size = models.PositiveIntegerField(default=0)  # documents it was trained on
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"dictionary {self.pk} ({len(self.data)} bytes, {self.sample_size} documents)"
+
 # UploadedDocument model: documents uploaded by users 
 # Processed to extract text and generate quiz questions
 class UploadedDocument(models.Model):
     title = models.CharField(max_length=255)  #user defined
-    file = models.FileField(upload_to='documents/')  # actual uploaded file -> (stored in media/documents/)
+    file = models.FileField(upload_to=document_upload_to, max_length=255)  # actual uploaded file -> (stored in media/documents/ab/<sha256>.docx, shared by identical uploads)
     uploaded_at = models.DateTimeField(auto_now_add=True)  
-    parsed_text = models.TextField(blank=True, null=True)  # Extracted text
+    parsed_text = CompressedTextField(blank=True, null=True, editable=False)  # Extracted text, stored zlib-compressed (see compression.py); only set from the file, with the fields derived from it
     grade_level = models.ForeignKey(GradeLevel, on_delete=models.CASCADE, null=True, blank=True)  
     skill_category = models.ForeignKey(SkillCategory, on_delete=models.CASCADE, null=True, blank=True)  
     uploader = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)  # User who uploaded the document
+    section_hashes = models.JSONField(default=list, blank=True)  # Content hashes of the parsed text's sections (see sections.py)
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)  # SHA-256 of the uploaded file
+    # Text statistics computed when the file is parsed (see text_stats.py); null until then
+    word_count = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    sentence_count = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    reading_minutes = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)  # at 200 words per minute
+    readability_grade = models.FloatField(null=True, blank=True, editable=False, db_index=True)  # Flesch-Kincaid grade level
+    paragraph_offsets = models.JSONField(null=True, blank=True, editable=False)  # Start of each paragraph in parsed_text, then its length (see paging.py)
+
+    class Meta:
+        # Browsing filters by facet/uploader and sorts newest first
+        indexes = [
+            models.Index(fields=['grade_level', 'skill_category', '-uploaded_at'], name='document_facets_idx'),
+            models.Index(fields=['skill_category', '-uploaded_at'], name='document_skill_idx'),
+            models.Index(fields=['uploader', '-uploaded_at'], name='document_uploader_idx'),
+            models.Index(fields=['-uploaded_at'], name='document_uploaded_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+# DocumentFacetCount model: number of documents per (grade level, skill category) pair, kept current by signals
+# Facet counts are sums over this small table instead of a GROUP BY over all documents (see facets.py)
+class DocumentFacetCount(models.Model):
+    grade_level = models.PositiveIntegerField()  # GradeLevel id, 0 = not set
+    skill_category = models.PositiveIntegerField()  # SkillCategory id, 0 = not set
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['grade_level', 'skill_category'], name='unique_facet_pair')]
+
+    def __str__(self):
+        return f"grade {self.grade_level} / skill {self.skill_category}: {self.count}"
+
 # QuizQuestion model: quiz questions generated from uploaded documents
 class QuizQuestion(models.Model):
     document = models.ForeignKey(UploadedDocument, on_delete=models.CASCADE, related_name='questions')  # The document this question is based on
     question_text = models.TextField()  # The actual question 
     explanation = models.TextField(blank=True, null=True)  
     created_at = models.DateTimeField(auto_now_add=True)  
+    source_section = models.CharField(max_length=16, blank=True, null=True, db_index=True)  # Hash of the passage section it was generated from
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='near_duplicates')  # earlier question with (nearly) the same text, see near_duplicates.py
+    minhash = models.BinaryField(null=True, blank=True, editable=False)  # MinHash signature of question_text (64 x uint32)
 
     def __str__(self):
         return f"{self.document.title} - {self.question_text[:50]}..."
@@ -88,7 +152,10 @@ class QuizResponse(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True) 
     score = models.IntegerField()  
     total_questions = models.IntegerField() 
-    submitted_at = models.DateTimeField(auto_now_add=True) 
+    submitted_at = models.DateTimeField(default=timezone.now, editable=False)  # set at submit time (also for write-behind rows, see submissions.py)
+    submission_id = models.UUIDField(unique=True, null=True, blank=True, editable=False)  # client-side id; makes journal replay idempotent
+    packed_answers = models.BinaryField(null=True, blank=True, editable=False)  # question id deltas and choice letters instead of UserAnswer rows, see packed_answers.py
+    correct_mask = models.BinaryField(null=True, blank=True, editable=False)  # bit i set when packed answer i was correct
 
     def __str__(self):
         return f"{self.document.title} - {self.score}/{self.total_questions}"
@@ -104,7 +171,65 @@ class UserAnswer(models.Model):
     def __str__(self):
         return f"{self.response.user_name or 'Anonymous'} - {self.question.question_text[:30]}"
 
+# GenerationLock model: marks a document whose questions are being generated right now
+# One row per document (unique), so concurrent callers can't both pay for a generation
+class GenerationLock(models.Model):
+    document = models.OneToOneField(UploadedDocument, on_delete=models.CASCADE, related_name='generation_lock')
+    owner = models.CharField(max_length=32)  # random token of the caller holding the lock
+    acquired_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)  # after this the lock is considered stale and can be taken over
 
+    def __str__(self):
+        return f"{self.document_id} locked by {self.owner}"
 
+# StoredBlob model: one stored file per distinct content (SHA-256), shared by every document with that content
+# ref_count is the number of documents using it; the file is deleted when it drops to zero
+class StoredBlob(models.Model):
+    content_hash = models.CharField(max_length=64, unique=True)  # SHA-256 of the file
+    name = models.CharField(max_length=255, unique=True)  # storage path (documents/ab/<hash>.docx)
+    size = models.BigIntegerField(default=0)  # bytes
+    ref_count = models.PositiveIntegerField(default=0)  # documents pointing at this blob
+    created_at = models.DateTimeField(auto_now_add=True)
 
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+# UploadSession model: a resumable chunked upload in progress (see uploads.py)
+# Chunks are staged as part files; finalizing claims the session and creates the UploadedDocument
+class UploadSession(models.Model):
+    RECEIVING, FINALIZING, FINALIZED = 'receiving', 'finalizing', 'finalized'
+    STATUS_CHOICES = [(RECEIVING, 'Receiving'), (FINALIZING, 'Finalizing'), (FINALIZED, 'Finalized')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    uploader = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    filename = models.CharField(max_length=255)  # original file name (.docx)
+    size = models.BigIntegerField()  # declared total size in bytes
+    received = models.BigIntegerField(default=0)  # bytes stored so far = offset of the next chunk
+    sha256 = models.CharField(max_length=64, blank=True, default='')  # declared content hash, checked on finalize
+    metadata = models.JSONField(default=dict, blank=True)  # title, grade_level, skill_category for the document
+    document = models.ForeignKey(UploadedDocument, on_delete=models.SET_NULL, null=True, blank=True)  # set once finalized
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=RECEIVING)  # finalize claims the session by flipping this
+    claimed_until = models.DateTimeField(null=True, blank=True)  # lease on a finalizing claim, so a dead worker's claim can be taken over
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)  # unfinished sessions are removed after this
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+
+# IdempotencyKey model: the stored result of a request sent with an Idempotency-Key header (see idempotency.py)
+# A retry with the same key and scope gets this response instead of doing the work again
+class IdempotencyKey(models.Model):
+    key = models.CharField(max_length=255)  # client-chosen key (e.g. a UUID per logical request)
+    scope = models.CharField(max_length=100)  # endpoint + user, so keys can't collide across them
+    fingerprint = models.CharField(max_length=64)  # hash of the request payload; reusing a key for another payload is an error
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # null while the first request is still running
+    locked_until = models.DateTimeField(null=True, blank=True)  # lease of the running attempt; a retry takes the key over after it
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)  # swept by clear_idempotency_keys
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['key', 'scope'], name='unique_idempotency_key_scope')]
 
+    def __str__(self):
+        return f"{self.scope} {self.key}"
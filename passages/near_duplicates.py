@@ -0,0 +1,335 @@
+"""
+Near-duplicate detection for question texts (MinHash + LSH, with NumPy).
+
+Each question text is normalized (lowercase, words only), cut into
+overlapping 5-character shingles, and summarized by a MinHash signature of
+NUM_PERM 32-bit values: the fraction of equal positions in two signatures
+estimates the Jaccard similarity of their shingle sets. Signatures are
+stored on QuizQuestion.minhash.
+
+For lookups the signature is split into BANDS bands of ROWS values. Two
+questions become candidates when any band matches exactly (likely from about
+50% similarity up), and candidates are confirmed by comparing full signatures
+against QUESTION_DUPLICATE_THRESHOLD.
+
+QuestionIndex keeps the signatures of the whole bank in memory, one sorted
+array of band keys per band, and picks up rows saved since the last lookup
+(by other processes too) with one indexed query. Ids skipped because their
+transaction had not committed yet are looked for again for GAP_TTL seconds.
+A lookup is a binary search per band plus one vectorized comparison, for a
+whole batch of new questions at once.
+
+What happens to a near-duplicate is set by QUESTION_DUPLICATES:
+    flag  (default) save it with duplicate_of pointing at the earlier question
+    drop  skip it when the earlier question is in the same document, flag it otherwise
+    off   no checks
+"""
+
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+from .models import QuizQuestion
+
+SHINGLE = 5
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+CHUNK_SIZE = 2000  # texts per vectorized signature pass
+
+# Hash family for the permutations: multiply-shift, h(x) = (a * x + b) mod 2**64 >> 32
+_rng = np.random.default_rng(0x5EED)
+_A = _rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64)[:, None] | np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)[:, None]
+_POWERS = np.uint64(257) ** np.arange(SHINGLE, dtype=np.uint64)[::-1]
+_BAND_MIX = _rng.integers(1, 2 ** 63, ROWS, dtype=np.uint64) | np.uint64(1)
+
+_word = re.compile(r'\w+')
+
+
+def normalize(text):
+    return ' '.join(_word.findall((text or '').lower())).ljust(SHINGLE)
+
+
+def signatures(texts):
+    """MinHash signatures of `texts`: uint32 array of shape (len(texts), NUM_PERM)"""
+    result = np.empty((len(texts), NUM_PERM), dtype=np.uint32)
+    for start in range(0, len(texts), CHUNK_SIZE):
+        chunk = [normalize(text).encode('utf-8') for text in texts[start:start + CHUNK_SIZE]]
+        lengths = np.fromiter((len(text) for text in chunk), dtype=np.int64, count=len(chunk))
+        data = np.frombuffer(b''.join(chunk), dtype=np.uint8).astype(np.uint64)
+
+        # Rolling hash of every window, then keep the windows inside one text
+        windows = np.lib.stride_tricks.sliding_window_view(data, SHINGLE)
+        hashes = (windows * _POWERS).sum(axis=1, dtype=np.uint64)
+        ends = np.cumsum(lengths)
+        owner = np.repeat(np.arange(len(chunk)), lengths)[:len(hashes)]
+        hashes = hashes[np.arange(len(hashes)) + SHINGLE <= ends[owner]]
+        hashes ^= hashes >> np.uint64(29)
+        hashes *= np.uint64(0xBF58476D1CE4E5B9)
+        hashes ^= hashes >> np.uint64(32)
+        hashes &= np.uint64(0xFFFFFFFF)
+
+        # Every text has lengths - SHINGLE + 1 >= 1 windows, in order
+        starts = np.concatenate(([0], np.cumsum(lengths - SHINGLE + 1)[:-1]))
+        permuted = (_A * hashes[None, :] + _B) >> np.uint64(32)
+        result[start:start + len(chunk)] = np.minimum.reduceat(permuted, starts, axis=1).T
+    return result
+
+
+def band_keys(sigs):
+    """One uint64 key per band: shape (len(sigs), BANDS)"""
+    bands = sigs.reshape(len(sigs), BANDS, ROWS).astype(np.uint64)
+    return (bands * _BAND_MIX).sum(axis=2, dtype=np.uint64)
+
+
+def similarity(sig, others):
+    """Estimated Jaccard similarity of one signature to each row of `others`"""
+    return (others == sig).mean(axis=1)
+
+
+def _holes(found, first, last):
+    """Ranges of ids in [first, last] missing from the sorted array `found`"""
+    bounds = np.concatenate(([first - 1], found[(found >= first) & (found <= last)], [last + 1]))
+    starts, ends = bounds[:-1] + 1, bounds[1:] - 1
+    keep = starts <= ends
+    return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+
+class QuestionIndex:
+    """In-memory LSH index over the stored signatures of the question bank"""
+
+    MERGE_AFTER = 1024  # re-sort the band arrays once this many rows were added
+    GAP_TTL = 600  # seconds to keep re-checking ids skipped by a refresh
+    MAX_GAPS = 64  # skipped id ranges kept (the highest ones)
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.documents = np.empty(0, dtype=np.int64)
+        self.sigs = np.empty((0, NUM_PERM), dtype=np.uint32)
+        self.keys = np.empty((0, BANDS), dtype=np.uint64)
+        self.last_id = 0
+        # (first id, last id, when seen): ids below last_id not found yet. Ids are
+        # taken when a row is inserted, not when it commits, so a transaction still
+        # open during a refresh leaves a gap that fills in later.
+        self.gaps = []
+        self._sorted_keys = self._order = None
+        self._sorted_count = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Add the questions saved since the last refresh, including ones committed out of id order"""
+        now = time.monotonic()
+        gaps = [gap for gap in self.gaps if now - gap[2] < self.GAP_TTL]
+        query = Q(id__gt=self.last_id)
+        for first, last, _ in gaps:
+            query |= Q(id__range=(first, last))
+        rows = list(
+            QuizQuestion.objects.filter(query, minhash__isnull=False)
+            .order_by('id').values_list('id', 'document_id', 'minhash')
+        )
+        found = np.array([row[0] for row in rows], dtype=np.int64)
+        self.gaps = [(first, last, seen) for start, end, seen in gaps for first, last in _holes(found, start, end)]
+        if rows:
+            self.gaps += [(first, last, now) for first, last in _holes(found, self.last_id + 1, int(found[-1]))]
+            ids, documents, blobs = zip(*rows)
+            self.add(ids, documents, np.frombuffer(b''.join(bytes(b) for b in blobs), dtype=np.uint32).reshape(-1, NUM_PERM))
+        self.gaps = self.gaps[-self.MAX_GAPS:]
+
+    def add(self, ids, documents, sigs):
+        self.ids = np.concatenate((self.ids, np.asarray(ids, dtype=np.int64)))
+        self.documents = np.concatenate((self.documents, np.asarray(documents, dtype=np.int64)))
+        self.sigs = np.concatenate((self.sigs, sigs))
+        self.keys = np.concatenate((self.keys, band_keys(sigs)))
+        self.last_id = int(self.ids.max())
+        if len(self.ids) - self._sorted_count > self.MERGE_AFTER:
+            self._sort()
+
+    def _sort(self):
+        self._order = np.argsort(self.keys, axis=0, kind='stable')
+        self._sorted_keys = np.take_along_axis(self.keys, self._order, axis=0)
+        self._sorted_count = len(self.ids)
+
+    def candidates(self, keys):
+        """
+        (query, position) pairs of indexed rows sharing at least one band key
+        with a query row of `keys` (shape (n, BANDS))
+        """
+        queries, positions = [], []
+        if self._sorted_count:
+            for band in range(BANDS):
+                column = self._sorted_keys[:, band]
+                lo = np.searchsorted(column, keys[:, band], 'left')
+                counts = np.searchsorted(column, keys[:, band], 'right') - lo
+                if counts.any():
+                    # Expand each [lo, hi) range into its positions
+                    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                    queries.append(np.repeat(np.arange(len(keys)), counts))
+                    positions.append(self._order[np.repeat(lo, counts) + offsets, band])
+        tail = self.keys[self._sorted_count:]
+        if len(tail):
+            query, row = np.nonzero((tail[None, :, :] == keys[:, None, :]).any(axis=2))
+            queries.append(query)
+            positions.append(self._sorted_count + row)
+        if not queries:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        pairs = np.unique(np.concatenate(queries) * len(self.ids) + np.concatenate(positions))
+        return pairs // len(self.ids), pairs % len(self.ids)
+
+    def lookup(self, sigs, threshold):
+        """
+        For each signature, the matching indexed questions as (id, document_id,
+        signature bytes), most similar first.
+        """
+        with self._lock:
+            self.refresh()
+            queries, positions = self.candidates(band_keys(sigs))
+            scores = (self.sigs[positions] == sigs[queries]).mean(axis=1)
+            keep = scores >= threshold
+            queries, positions, scores = queries[keep], positions[keep], scores[keep]
+            matches = [[] for _ in range(len(sigs))]
+            for i in np.lexsort((self.ids[positions], -scores, queries)):
+                p = positions[i]
+                matches[queries[i]].append((int(self.ids[p]), int(self.documents[p]), self.sigs[p].tobytes()))
+            return matches
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def question_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = QuestionIndex()
+        return _index
+
+
+@dataclass
+class DuplicateCheck:
+    minhash: bytes  # signature to store on the question
+    duplicate_of: int = None  # id of an earlier saved question
+    batch_position: int = None  # or: position of an earlier question in the same batch
+    same_document: bool = False
+
+    @property
+    def is_duplicate(self):
+        return self.duplicate_of is not None or self.batch_position is not None
+
+    @property
+    def drop(self):
+        return self.is_duplicate and self.same_document and settings.QUESTION_DUPLICATES == 'drop'
+
+
+def _bank_matches(sigs, document_ids, threshold):
+    """
+    For each signature, (id of the best matching saved question or None,
+    whether that question is in document_ids[i])
+    """
+    matches = question_index().lookup(sigs, threshold)
+
+    # Matches can point at questions deleted (or whose id was reused) since they were indexed
+    matched_ids = {question_id for found in matches for question_id, _, _ in found}
+    stored = dict(QuizQuestion.objects.filter(id__in=matched_ids).values_list('id', 'minhash')) if matched_ids else {}
+
+    results = []
+    for document_id, found in zip(document_ids, matches):
+        found = [
+            (question_id, document) for question_id, document, minhash in found
+            if stored.get(question_id) is not None and bytes(stored[question_id]) == minhash
+        ]
+        # Prefer a match in the same document (that is the one worth dropping)
+        same = [question_id for question_id, document in found if document == document_id]
+        if same or found:
+            results.append((same[0] if same else found[0][0], bool(same)))
+        else:
+            results.append((None, False))
+    return results
+
+
+def check_questions(document_id, texts):
+    """
+    Check a batch of new question texts for one document against the bank and
+    against each other (a later question can duplicate an earlier one in the
+    batch).
+
+    Returns:
+        list[DuplicateCheck], or None with QUESTION_DUPLICATES=off
+    """
+    if settings.QUESTION_DUPLICATES == 'off' or not texts:
+        return None
+    threshold = settings.QUESTION_DUPLICATE_THRESHOLD
+    sigs = signatures(texts)
+
+    checks = []
+    for i, (sig, (duplicate_of, same_document)) in enumerate(zip(sigs, _bank_matches(sigs, [document_id] * len(texts), threshold))):
+        check = DuplicateCheck(minhash=sig.tobytes(), duplicate_of=duplicate_of, same_document=same_document)
+        if duplicate_of is None and i:
+            earlier = np.flatnonzero(similarity(sig, sigs[:i]) >= threshold)
+            if len(earlier):
+                # Point at what the earlier question points at, or at the earlier question itself
+                previous = checks[earlier[0]]
+                if previous.is_duplicate:
+                    check.duplicate_of, check.batch_position = previous.duplicate_of, previous.batch_position
+                else:
+                    check.batch_position = int(earlier[0])
+                check.same_document = True  # the earlier question is in this document (and kept)
+        checks.append(check)
+    return checks
+
+
+def check_bank(document_ids, texts):
+    """
+    Check new questions of any documents against the saved bank only (not
+    against each other), with one signature pass and one index lookup for
+    the whole batch. Used by bulk imports.
+
+    Returns:
+        list[DuplicateCheck], or None with QUESTION_DUPLICATES=off
+    """
+    if settings.QUESTION_DUPLICATES == 'off' or not texts:
+        return None
+    sigs = signatures(texts)
+    return [
+        DuplicateCheck(minhash=sig.tobytes(), duplicate_of=duplicate_of, same_document=same_document)
+        for sig, (duplicate_of, same_document)
+        in zip(sigs, _bank_matches(sigs, document_ids, settings.QUESTION_DUPLICATE_THRESHOLD))
+    ]
+
+
+def duplicate_targets(sigs, threshold):
+    """
+    Vectorized pass over a whole bank (rows in id order): for each row, the
+    position of the earliest row it is a near-duplicate of (through chains of
+    duplicates), or -1.
+    """
+    count = len(sigs)
+    keys = band_keys(sigs)
+    rows, firsts = [], []
+    for band in range(BANDS):
+        # Within each group of equal band keys, pair every row with the group's first (earliest) row
+        order = np.lexsort((np.arange(count), keys[:, band]))
+        sorted_keys = keys[order, band]
+        group_start = np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+        first = order[np.maximum.accumulate(np.where(group_start, np.arange(count), 0))]
+        pair = first != order
+        rows.append(order[pair])
+        firsts.append(first[pair])
+    rows, firsts = np.concatenate(rows), np.concatenate(firsts)
+    similar = (sigs[rows] == sigs[firsts]).mean(axis=1) >= threshold
+
+    targets = np.full(count, count, dtype=np.int64)
+    np.minimum.at(targets, rows[similar], firsts[similar])
+    targets[targets == count] = -1
+    while True:  # follow chains so every target is an original
+        chained = np.where(targets >= 0, targets[targets], -1)
+        step = np.where(chained >= 0, chained, targets)
+        if np.array_equal(step, targets):
+            return targets
+        targets = step
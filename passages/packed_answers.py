@@ -0,0 +1,118 @@
+"""
+Compact per-response answer storage.
+
+A QuizResponse can keep its answers in two binary columns instead of one
+UserAnswer row per question:
+
+    packed_answers  per answer, in the order they were submitted: the
+                    difference to the previous question id (zigzag varint,
+                    one byte when ids are close, as for one quiz's questions)
+                    followed by the selected choice letter (one byte)
+    correct_mask    bit i set when answer i was correct
+
+That is about two bytes per answer, against a UserAnswer row with four ids
+and three foreign-key index entries. New submissions are stored packed when
+QUIZ_PACK_ANSWERS is on, and `manage.py compact_user_answers` folds the
+UserAnswer rows of older responses into the packed columns.
+
+Packed answers are (question_id, choice_letter, is_correct): the selected
+QuizAnswer is identified by its letter. answer_records() reads a response's
+answers however they are stored (the QuizResponse admin shows them with it).
+Packed ids are not foreign keys: a question deleted later (e.g. by
+regenerating a changed passage section) stays in the packed history, so
+readers must allow for ids that no longer exist.
+"""
+
+from itertools import groupby
+
+from django.db import transaction
+
+from .models import QuizResponse, UserAnswer
+
+
+def pack_answers(records):
+    """
+    [(question_id, choice_letter, is_correct)] -> (packed_answers, correct_mask) bytes
+    """
+    packed = bytearray()
+    mask = previous = 0
+    for i, (question_id, choice_letter, is_correct) in enumerate(records):
+        delta = question_id - previous
+        previous = question_id
+        value = delta << 1 if delta >= 0 else (-delta << 1) - 1  # zigzag: small +/- deltas stay small
+        while value >= 0x80:
+            packed.append(value & 0x7F | 0x80)
+            value >>= 7
+        packed.append(value)
+        packed += (choice_letter or '?')[:1].encode('ascii')
+        if is_correct:
+            mask |= 1 << i
+    return bytes(packed), mask.to_bytes((len(records) + 7) // 8, 'little')
+
+
+def unpack_answers(packed_answers, correct_mask):
+    """Inverse of pack_answers: [(question_id, choice_letter, is_correct)]"""
+    data = bytes(packed_answers)  # memoryview on PostgreSQL
+    mask = int.from_bytes(bytes(correct_mask), 'little')
+    records = []
+    position = question_id = 0
+    while position < len(data):
+        value = shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        question_id += value >> 1 if not value & 1 else -((value + 1) >> 1)
+        records.append((question_id, chr(data[position]), bool(mask >> len(records) & 1)))
+        position += 1
+    return records
+
+
+def answer_records(response):
+    """A response's answers as (question_id, choice_letter, is_correct), packed or not"""
+    if response.packed_answers is not None:
+        return unpack_answers(response.packed_answers, response.correct_mask)
+    return list(
+        response.user_answers.order_by('id')
+        .values_list('question_id', 'selected_answer__choice_letter', 'is_correct')
+    )
+
+
+def packed_question_ids(responses):
+    """Ids of the questions answered in the packed columns of `responses` (a QuizResponse queryset)"""
+    question_ids = set()
+    rows = responses.filter(packed_answers__isnull=False).values_list('packed_answers', 'correct_mask')
+    for packed_answers, correct_mask in rows.iterator(chunk_size=2000):
+        question_ids.update(question_id for question_id, _, _ in unpack_answers(packed_answers, correct_mask))
+    return question_ids
+
+
+def compact_responses(responses, batch_size=500):
+    """
+    Fold the UserAnswer rows of `responses` (a QuizResponse queryset) into
+    their packed columns and delete the rows, one transaction per batch.
+
+    Returns:
+        (responses, answers): the number of responses packed and UserAnswer rows removed
+    """
+    ids = list(responses.filter(packed_answers__isnull=True).order_by('id').values_list('id', flat=True))
+    packed = removed = 0
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        with transaction.atomic():
+            rows = (
+                UserAnswer.objects.filter(response_id__in=batch).order_by('response_id', 'id')
+                .values_list('response_id', 'question_id', 'selected_answer__choice_letter', 'is_correct')
+            )
+            records = {response_id: [row[1:] for row in group] for response_id, group in groupby(rows, key=lambda row: row[0])}
+            updates = []
+            for response_id in batch:
+                packed_answers, correct_mask = pack_answers(records.get(response_id, []))
+                updates.append(QuizResponse(id=response_id, packed_answers=packed_answers, correct_mask=correct_mask))
+            QuizResponse.objects.bulk_update(updates, ['packed_answers', 'correct_mask'])
+            removed += UserAnswer.objects.filter(response_id__in=batch).delete()[0]
+        packed += len(batch)
+    return packed, removed
@@ -0,0 +1,102 @@
+"""
+Paged reading of long passages.
+
+When a document is parsed, UploadedDocument.paragraph_offsets stores where
+each paragraph (non-blank line) of parsed_text starts, followed by the text's
+length. The first paragraph always starts at 0, so leading blank lines belong
+to it, and each paragraph runs up to the start of the next one.
+
+Pages are whole paragraphs, grouped greedily up to PAGE_CHARS characters (a
+single longer paragraph becomes a page of its own). The page boundaries are
+derived from the offsets alone, with one binary search per page, and only
+the part of the compressed text up to the end of the page is inflated (see
+compression.py). The first page therefore costs the same whatever the
+passage length. Concatenating all pages gives parsed_text back exactly.
+
+Documents stored without offsets fall back to computing them from the full
+text.
+"""
+
+import re
+from bisect import bisect_right
+
+from .compression import CompressedText, stored_value
+from .models import UploadedDocument
+
+PAGE_CHARS = 2000  # about 350 words: one phone screen or two
+
+_paragraph_start = re.compile(r'^(?=[^\n]*\S)', re.MULTILINE)
+
+
+def paragraph_offsets(text):
+    """Start of every paragraph of `text`, then len(text); None for no text"""
+    if text is None:
+        return None
+    starts = [match.start() for match in _paragraph_start.finditer(text)]
+    starts[:1] = [0]
+    return starts + [len(text)]
+
+
+def page_starts(offsets):
+    """Index into `offsets` of the first paragraph of each page"""
+    starts = [0]
+    last = len(offsets) - 1
+    while starts[-1] < last:
+        first = starts[-1]
+        # Paragraphs first..end-1 fit when offsets[end] - offsets[first] <= PAGE_CHARS (always at least one)
+        end = max(bisect_right(offsets, offsets[first] + PAGE_CHARS) - 1, first + 1)
+        if end >= last:
+            break
+        starts.append(end)
+    return starts
+
+
+def page_span(offsets, page):
+    """(start, end) character range of 1-based `page`, or None past the last page"""
+    starts = page_starts(offsets)
+    if not 1 <= page <= len(starts):
+        return None
+    end = offsets[starts[page]] if page < len(starts) else offsets[-1]
+    return offsets[starts[page - 1]], end
+
+
+def page_count(offsets):
+    return len(page_starts(offsets))
+
+
+def text_page(text, offsets, page=1):
+    """
+    Page `page` of a text, str or CompressedText (inflated only up to the
+    end of the page when the offsets are known).
+
+    Returns:
+        (text, page_count): text is None when the page is out of range;
+        page_count is 0 when there is no text
+    """
+    if text is None:
+        return None, 0
+    if offsets is None:
+        text = text.text() if isinstance(text, CompressedText) else text
+        offsets = paragraph_offsets(text)
+    span = page_span(offsets, page)
+    if span is None:
+        return None, page_count(offsets)
+    if isinstance(text, CompressedText):
+        text = text.text(max_chars=span[1])
+    return text[span[0]:span[1]], page_count(offsets)
+
+
+def document_page(document, page=1):
+    """text_page() of a loaded UploadedDocument, without decompressing all of its text"""
+    return text_page(stored_value(document, 'parsed_text'), document.paragraph_offsets, page)
+
+
+def read_page(document_id, page=1):
+    """
+    text_page() of a stored document (one query)
+
+    Raises:
+        UploadedDocument.DoesNotExist
+    """
+    offsets, text = UploadedDocument.objects.filter(pk=document_id).values_list('paragraph_offsets', 'parsed_text').get()
+    return text_page(text, offsets, page)
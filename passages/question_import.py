@@ -0,0 +1,230 @@
+"""
+Bulk import of hand-written question banks.
+
+Input is CSV (with a header row) or NDJSON, one question per row/line, flat:
+
+    document_id, question_text, explanation, A, B, C, D, answer
+
+A-D are the choice texts (at least two; empty ones are skipped) and `answer`
+is the letter of the correct choice. Rows are validated as they are read and
+inserted in batches: on PostgreSQL with COPY (ids are reserved from the
+sequences first so answers can point at their questions), elsewhere with one
+bulk INSERT for the questions and one for their answers per batch. Invalid rows are reported by line number and skipped;
+valid rows are imported.
+"""
+
+import csv
+import io
+import json
+from dataclasses import dataclass, field
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import QuizAnswer, QuizQuestion, UploadedDocument
+from .near_duplicates import check_bank
+
+CHOICE_LETTERS = ('A', 'B', 'C', 'D')
+FORMATS = ('csv', 'ndjson')
+UNDECODABLE = '\ufffd'
+NOT_UTF8 = 'not valid UTF-8'
+
+
+@dataclass
+class ImportResult:
+    imported: int = 0
+    errors: list = field(default_factory=list)  # (line number, message)
+
+
+def format_for(name, content_type=''):
+    """'csv' or 'ndjson' from a file name or content type, None if unknown"""
+    name = (name or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    if name.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    return None
+
+
+def read_rows(text_stream, file_format):
+    """
+    Yield (line number, row dict or error message) from a text stream.
+    Rows holding U+FFFD (what import_file decodes invalid UTF-8 to) are errors.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            if any(UNDECODABLE in str(value) for value in row.values()):
+                yield reader.line_num, NOT_UTF8
+            else:
+                yield reader.line_num, row
+        return
+    for line_number, line in enumerate(text_stream, start=1):
+        if not line.strip():
+            continue
+        if UNDECODABLE in line:
+            yield line_number, NOT_UTF8
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, f'invalid JSON: {e.msg}'
+            continue
+        yield line_number, row if isinstance(row, dict) else 'expected a JSON object'
+
+
+def clean_row(row):
+    """(question dict, None) for a valid row, (None, error message) otherwise"""
+    def text(key):
+        value = row.get(key)
+        return '' if value is None else str(value).strip()
+
+    try:
+        document_id = int(text('document_id'))
+    except ValueError:
+        return None, 'document_id must be an integer'
+    question_text = text('question_text')
+    if not question_text:
+        return None, 'question_text is required'
+    choices = [(letter, text(letter)) for letter in CHOICE_LETTERS if text(letter)]
+    if len(choices) < 2:
+        return None, 'at least two of A, B, C, D are required'
+    answer = text('answer').upper()
+    if answer not in dict(choices):
+        return None, f'answer must be one of {", ".join(letter for letter, _ in choices)}'
+    return {
+        'document_id': document_id,
+        'question_text': question_text,
+        'explanation': text('explanation'),
+        'answers': [
+            {'choice_letter': letter, 'choice_text': choice, 'is_correct': letter == answer}
+            for letter, choice in choices
+        ],
+    }, None
+
+
+def _reserve_ids(cursor, model, count):
+    """Take `count` ids from the table's id sequence (PostgreSQL)"""
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+        [model._meta.db_table, count],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _copy_rows(cursor, model, field_names, rows):
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in field_names)
+    with cursor.copy(f'COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN') as copy:
+        for row in rows:
+            copy.write_row(row)
+
+
+def _copy_batch(batch):
+    """PostgreSQL + psycopg 3: reserve ids from the sequences, then COPY both tables"""
+    now = timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        question_ids = _reserve_ids(cursor, QuizQuestion, len(batch))
+        _copy_rows(cursor, QuizQuestion, ['id', 'document', 'question_text', 'explanation', 'created_at', 'duplicate_of', 'minhash'], (
+            (pk, q['document_id'], q['question_text'], q['explanation'], now, q.get('duplicate_of_id'), q.get('minhash'))
+            for pk, q in zip(question_ids, batch)
+        ))
+        answers = [(pk, answer) for pk, q in zip(question_ids, batch) for answer in q['answers']]
+        answer_ids = _reserve_ids(cursor, QuizAnswer, len(answers))
+        _copy_rows(cursor, QuizAnswer, ['id', 'question', 'choice_letter', 'choice_text', 'is_correct'], (
+            (answer_id, pk, answer['choice_letter'], answer['choice_text'], answer['is_correct'])
+            for answer_id, (pk, answer) in zip(answer_ids, answers)
+        ))
+
+
+def _can_copy():
+    if connection.vendor != 'postgresql':
+        return False
+    connection.ensure_connection()
+    return hasattr(connection.connection.cursor(), 'copy')  # psycopg 3 (psycopg2 has copy_expert)
+
+
+def _flag_duplicates(batch):
+    """
+    Add MinHash signatures and flag near-duplicates of questions already in the
+    bank (duplicates within one import are left to `manage.py dedupe_questions`).
+    """
+    checks = check_bank([q['document_id'] for q in batch], [q['question_text'] for q in batch])
+    for q, check in zip(batch, checks or []):
+        q['minhash'], q['duplicate_of_id'] = check.minhash, check.duplicate_of
+
+
+def _insert_batch(batch):
+    """Insert validated questions and their answers: COPY on PostgreSQL, two bulk INSERTs elsewhere"""
+    _flag_duplicates(batch)
+    if _can_copy():
+        _copy_batch(batch)
+        return
+    questions = [
+        QuizQuestion(document_id=q['document_id'], question_text=q['question_text'], explanation=q['explanation'],
+                     duplicate_of_id=q.get('duplicate_of_id'), minhash=q.get('minhash'))
+        for q in batch
+    ]
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            QuizQuestion.objects.bulk_create(questions)
+        else:
+            for question in questions:
+                question.save()
+        QuizAnswer.objects.bulk_create([
+            QuizAnswer(question_id=question.pk, **answer)
+            for question, q in zip(questions, batch) for answer in q['answers']
+        ])
+
+
+def import_questions(rows, batch_size=1000, dry_run=False):
+    """
+    Validate and import (line number, row) pairs from read_rows.
+
+    Returns:
+        ImportResult
+    """
+    result = ImportResult()
+    known_documents = set()
+    pending = []  # (line number, question) waiting for a document id check
+
+    def flush():
+        document_ids = {q['document_id'] for _, q in pending} - known_documents
+        if document_ids:
+            known_documents.update(UploadedDocument.objects.filter(id__in=document_ids).values_list('id', flat=True))
+        batch = []
+        for line_number, question in pending:
+            if question['document_id'] in known_documents:
+                batch.append(question)
+            else:
+                result.errors.append((line_number, f"document {question['document_id']} does not exist"))
+        if batch and not dry_run:
+            _insert_batch(batch)
+        result.imported += len(batch)
+        pending.clear()
+
+    for line_number, row in rows:
+        if isinstance(row, str):
+            result.errors.append((line_number, row))
+            continue
+        question, error = clean_row(row)
+        if error:
+            result.errors.append((line_number, error))
+            continue
+        pending.append((line_number, question))
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+    return result
+
+
+def import_file(binary_file, file_format, **options):
+    """
+    import_questions over a binary file object (UTF-8, BOM allowed). Bytes that
+    are not UTF-8 fail their row instead of the whole import.
+    """
+    text_stream = io.TextIOWrapper(binary_file, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        return import_questions(read_rows(text_stream, file_format), **options)
+    finally:
+        text_stream.detach()  # leave the caller's file open
@@ -0,0 +1,118 @@
+"""
+values()-based read serializers for the quiz load path.
+
+These build the same JSON structures as DocumentDetailSerializer,
+QuizQuestionSerializer and UploadedDocumentSerializer, but straight from
+QuerySet.values() rows instead of model instances and nested DRF field
+objects. They are used by the list/detail views when USE_FAST_JSON=True;
+key order and value formatting must stay identical to the DRF serializers
+(see FastRenderingTest).
+"""
+
+from django.http import Http404
+from rest_framework import serializers
+
+from .models import UploadedDocument, QuizQuestion, QuizAnswer
+from .compression import text_preview
+from .downloads import download_url
+from .paging import text_page
+from .reference_cache import grade_levels, skill_categories
+
+# Reused for formatting only; DRF fields are safe to use unbound for to_representation
+_datetime_field = serializers.DateTimeField()
+
+
+def _datetime(value):
+    return _datetime_field.to_representation(value)
+
+
+def _answers_by_question(answers):
+    grouped = {}
+    for row in answers.order_by('id').values_list('id', 'question_id', 'choice_letter', 'choice_text', 'is_correct'):
+        grouped.setdefault(row[1], []).append({
+            'id': row[0],
+            'choice_letter': row[2],
+            'choice_text': row[3],
+            'is_correct': row[4],
+        })
+    return grouped
+
+
+def question_list_data(questions):
+    """Same output as QuizQuestionSerializer(questions, many=True).data"""
+    questions = questions.order_by('id')
+    answers = _answers_by_question(QuizAnswer.objects.filter(question__in=questions.values('id')))
+    return [
+        {
+            'id': q_id,
+            'question_text': question_text,
+            'explanation': explanation,
+            'answers': answers.get(q_id, []),
+            'created_at': _datetime(created_at),
+        }
+        for q_id, question_text, explanation, created_at
+        in questions.values_list('id', 'question_text', 'explanation', 'created_at')
+    ]
+
+
+def _reference(reference_cache, pk):
+    if pk is None:
+        return None
+    obj = reference_cache.fetch(pk)
+    return {'id': pk, 'name': obj.name if obj is not None else None}
+
+
+def document_detail_data(pk):
+    """Same output as DocumentDetailSerializer(document).data (text of the first page only); raises Http404 if missing"""
+    row = UploadedDocument.objects.filter(pk=pk).values(
+        'id', 'title', 'parsed_text', 'paragraph_offsets', 'uploaded_at', 'grade_level_id', 'skill_category_id',
+    ).first()
+    if row is None:
+        raise Http404('No UploadedDocument matches the given query.')
+    first_page, page_count = text_page(row['parsed_text'], row['paragraph_offsets'])
+
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'parsed_text': first_page,
+        'page_count': page_count,
+        'uploaded_at': _datetime(row['uploaded_at']),
+        'questions': question_list_data(QuizQuestion.objects.filter(document_id=row['id'])),
+        'grade_level': _reference(grade_levels, row['grade_level_id']),
+        'skill_category': _reference(skill_categories, row['skill_category_id']),
+    }
+
+
+def _file_url(document_id, name, request):
+    return download_url(document_id, request) if name else None
+
+
+# Characters of parsed_text in document lists: enough for a preview, without inflating whole texts
+PREVIEW_CHARS = 500
+
+
+def document_list_data(documents, request=None):
+    """Same output as DocumentListSerializer(documents, many=True, context={'request': request}).data"""
+    rows = documents.values_list(
+        'id', 'grade_level_id', 'skill_category_id', 'title', 'file',
+        'uploaded_at', 'parsed_text', 'uploader_id',
+        'word_count', 'sentence_count', 'reading_minutes', 'readability_grade',
+    )
+    return [
+        {
+            'id': doc_id,
+            'grade_level': grade_level_id,
+            'skill_category': skill_category_id,
+            'parsed_text': text_preview(parsed_text, PREVIEW_CHARS),
+            'title': title,
+            'file': _file_url(doc_id, file_name, request),
+            'uploaded_at': _datetime(uploaded_at),
+            'word_count': word_count,
+            'sentence_count': sentence_count,
+            'reading_minutes': reading_minutes,
+            'readability_grade': readability_grade,
+            'uploader': uploader_id,
+        }
+        for (doc_id, grade_level_id, skill_category_id, title, file_name, uploaded_at, parsed_text, uploader_id,
+             word_count, sentence_count, reading_minutes, readability_grade) in rows
+    ]
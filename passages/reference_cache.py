@@ -0,0 +1,117 @@
+"""
+Process-local cache for small, almost-static reference tables.
+
+GradeLevel and SkillCategory are seeded by `setup_initial_data` and then
+hardly ever change, yet they are needed on every upload, document list and
+page load. CompressionDictionary rows are only ever added, and are needed to
+compress and decompress passage texts. Each process keeps a full copy of these tables in memory and
+reloads it (one query) when the table's version stamp changes.
+
+The version stamp lives in Django's cache framework and is bumped by the
+post_save/post_delete signals in passages/signals.py. With the default
+per-process LocMemCache only the writing process sees the bump right away,
+so other processes also reload after REFERENCE_CACHE_TTL seconds; configure
+a shared CACHES backend (Redis/Memcached) for immediate invalidation
+everywhere. Bulk updates bypass signals - call invalidate() after them.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import CompressionDictionary, GradeLevel, SkillCategory
+
+
+class ReferenceCache:
+    """In-memory copy of a reference table keyed by primary key"""
+
+    def __init__(self, model):
+        self.model = model
+        self.version_key = f'reference-cache:{model._meta.label_lower}:version'
+        self._rows = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._miss_reloaded = False  # a lookup miss already forced a reload of this copy
+        self._lock = threading.Lock()
+
+    def _is_stale(self, version):
+        ttl = getattr(settings, 'REFERENCE_CACHE_TTL', 300)
+        return (
+            self._rows is None
+            or version != self._version
+            or time.monotonic() - self._loaded_at > ttl
+        )
+
+    def _reload(self, version):
+        # Caller holds the lock. Readers keep using the old dict until the swap.
+        rows = {obj.pk: obj for obj in self.model.objects.order_by('pk')}
+        self._rows = rows
+        self._version = version
+        self._loaded_at = time.monotonic()
+        self._miss_reloaded = False
+        return rows
+
+    def _load(self):
+        version = cache.get(self.version_key, 0)
+        rows = self._rows
+        if rows is not None and not self._is_stale(version):
+            return rows
+        with self._lock:
+            if self._is_stale(version):
+                return self._reload(version)
+            return self._rows
+
+    def all(self):
+        """All rows in primary key order (shared instances - treat as read-only)"""
+        return list(self._load().values())
+
+    def get(self, pk):
+        """Row with this primary key, or None"""
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            return None
+        obj = self._load().get(pk)
+        if obj is None and not self._miss_reloaded:
+            # Possibly created by another process since our last load. Reload
+            # once, then let unknown ids miss until the TTL or a version bump.
+            with self._lock:
+                rows = self._rows
+                if not self._miss_reloaded:
+                    rows = self._reload(self._version)
+                    self._miss_reloaded = True
+            obj = rows.get(pk)
+        return obj
+
+    def fetch(self, pk):
+        """
+        Row with this primary key, from the cache or else the database: for
+        ids that must exist (foreign keys), which get() can miss while another
+        process's insert is not visible here yet. None if there is no such row.
+        """
+        obj = self.get(pk)
+        if obj is None and pk is not None:
+            obj = self.model.objects.filter(pk=pk).first()
+        return obj
+
+    def invalidate(self):
+        """Bump the version stamp so every process reloads on next access"""
+        try:
+            cache.incr(self.version_key)
+        except ValueError:  # key missing or evicted
+            cache.set(self.version_key, int(time.time()), timeout=None)
+        with self._lock:
+            self._version = None  # stale locally even if the cache write is lost
+
+grade_levels = ReferenceCache(GradeLevel)
+skill_categories = ReferenceCache(SkillCategory)
+compression_dictionaries = ReferenceCache(CompressionDictionary)
+
+# model -> cache, for signal handlers and generic fields
+REFERENCE_CACHES = {
+    GradeLevel: grade_levels,
+    SkillCategory: skill_categories,
+    CompressionDictionary: compression_dictionaries,
+}
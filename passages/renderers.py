@@ -0,0 +1,61 @@
+"""
+Fast JSON rendering for the read-heavy API endpoints.
+
+FastJSONRenderer is a drop-in replacement for DRF's JSONRenderer that uses
+orjson when it is installed. It is enabled with USE_FAST_JSON=True and
+produces the same bytes as the stock renderer for our payloads; anything
+orjson cannot encode identically falls back to the stock renderer.
+"""
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer backed by orjson (compact output only)."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # ASCII-only or indented output (?indent=, UNICODE_JSON=False) keeps the stock encoder
+        renderer_context = renderer_context or {}
+        if self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        encoder = self.encoder_class()
+        try:
+            # Datetimes/dataclasses go through DRF's encoder so their format matches
+            ret = orjson.dumps(
+                data,
+                default=encoder.default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except (TypeError, orjson.JSONEncodeError):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Match JSONRenderer, which escapes these for JavaScript compatibility
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class StreamingExportRenderer(JSONRenderer):
+    """
+    Content negotiation for the streaming export endpoints (?format=csv/ndjson
+    or the Accept header). The export itself is a StreamingHttpResponse and
+    bypasses rendering; only error payloads are rendered, as JSON.
+    """
+    charset = 'utf-8'
+
+
+class CSVRenderer(StreamingExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONRenderer(StreamingExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
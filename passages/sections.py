@@ -0,0 +1,92 @@
+"""
+Paragraph-level content hashing for uploaded passages.
+
+A passage's parsed_text is split into sections of whole paragraphs (lines),
+each identified by a hash of its paragraphs. Questions remember the hash of
+the section they were generated from (QuizQuestion.source_section), so when
+a document's file is replaced only the questions whose section changed are
+regenerated.
+
+Section boundaries are content-defined: a section ends after a paragraph
+whose hash falls on a boundary (about one in BOUNDARY_EVERY paragraphs), or
+when it would grow past MAX_SECTION_CHARS. Editing one paragraph therefore
+changes the hash of that paragraph's section only, instead of shifting every
+section that follows it.
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+
+# Matches gemini_utils.MAX_PROMPT_CHARS: one section fits in one prompt
+MAX_SECTION_CHARS = 3000
+MIN_SECTION_CHARS = 500
+BOUNDARY_EVERY = 8
+
+
+def paragraph_hash(text):
+    return hashlib.sha256(text.strip().encode('utf-8')).hexdigest()[:16]
+
+
+@dataclass
+class Section:
+    paragraphs: list = field(default_factory=list)
+    paragraph_hashes: list = field(default_factory=list)
+
+    @property
+    def text(self):
+        return '\n'.join(self.paragraphs)
+
+    @property
+    def hash(self):
+        return hashlib.sha256(''.join(self.paragraph_hashes).encode('ascii')).hexdigest()[:16]
+
+    def __len__(self):
+        return sum(len(p) + 1 for p in self.paragraphs)
+
+
+def split_sections(parsed_text):
+    """Split parsed text into content-defined sections (list of Section)"""
+    sections = []
+    current = Section()
+    for paragraph in (parsed_text or '').split('\n'):
+        if not paragraph.strip():
+            continue
+        p_hash = paragraph_hash(paragraph)
+        if current.paragraphs and len(current) + len(paragraph) > MAX_SECTION_CHARS:
+            sections.append(current)
+            current = Section()
+        current.paragraphs.append(paragraph)
+        current.paragraph_hashes.append(p_hash)
+        if len(current) >= MIN_SECTION_CHARS and int(p_hash, 16) % BOUNDARY_EVERY == 0:
+            sections.append(current)
+            current = Section()
+    if current.paragraphs:
+        sections.append(current)
+    return sections
+
+
+def plan_regeneration(old_hashes, new_sections, sourced_hashes):
+    """
+    Work out what a file replacement invalidates.
+
+    Args:
+        old_hashes: section hashes of the previous text, in order
+        new_sections: Sections of the new text
+        sourced_hashes: hashes that currently have questions generated from them
+
+    Returns:
+        (stale_hashes, sections_to_generate): section hashes whose questions
+        must be dropped, and the new Sections that replace them
+    """
+    new_hashes = {s.hash for s in new_sections}
+    stale = [h for h in old_hashes if h in sourced_hashes and h not in new_hashes]
+    to_generate = []
+    for h in stale:
+        # The section now at the stale section's position takes over its questions
+        position = min(old_hashes.index(h), len(new_sections) - 1)
+        if position < 0:
+            continue
+        replacement = new_sections[position]
+        if replacement.hash not in sourced_hashes and replacement not in to_generate:
+            to_generate.append(replacement)
+    return stale, to_generate
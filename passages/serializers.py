@@ -5,6 +5,11 @@ from .models import (
     UploadedDocument, GradeLevel, SkillCategory, 
     QuizQuestion, QuizAnswer, QuizResponse, UserAnswer
 )
+from .compression import stored_value, text_preview
+from .downloads import download_url
+from .paging import document_page
+from .read_serializers import PREVIEW_CHARS
+from .reference_cache import REFERENCE_CACHES
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -40,17 +45,61 @@ class SkillCategorySerializer(serializers.ModelSerializer):
         model = SkillCategory
         fields = '__all__'
 
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField for reference tables that validates against the reference cache"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = REFERENCE_CACHES[self.get_queryset().model].get(data)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class CachedReferenceField(serializers.Field):
+    """Read-only nested GradeLevel/SkillCategory served from the reference cache (no join or query)"""
+
+    def __init__(self, serializer_class, **kwargs):
+        self.serializer_class = serializer_class
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        # Read the raw FK id so the related row is never fetched
+        return getattr(instance, self.source_attrs[-1] + '_id')
+
+    def to_representation(self, pk):
+        model = self.serializer_class.Meta.model
+        obj = REFERENCE_CACHES[model].fetch(pk)
+        return self.serializer_class(obj).data if obj is not None else {'id': pk, 'name': None}
+
+
 class UploadedDocumentSerializer(serializers.ModelSerializer):
-    grade_level = serializers.PrimaryKeyRelatedField(
+    grade_level = CachedPrimaryKeyRelatedField(
         queryset=GradeLevel.objects.all(), required=False, allow_null=True
     )
-    skill_category = serializers.PrimaryKeyRelatedField(
+    skill_category = CachedPrimaryKeyRelatedField(
         queryset=SkillCategory.objects.all(), required=False, allow_null=True
     )
 
     class Meta:
         model = UploadedDocument
-        fields = '__all__'
+        exclude = ['section_hashes', 'content_hash', 'paragraph_offsets']  # internal bookkeeping (regeneration, dedup, paging)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Point at the download endpoint (which checks access), never at the storage itself
+        data['file'] = download_url(instance.pk, self.context.get('request')) if instance.file else None
+        return data
+
+
+class DocumentListSerializer(UploadedDocumentSerializer):
+    """Document list rows: parsed_text is cut to a preview (the full text is paged by detail/ and text/)"""
+    parsed_text = serializers.SerializerMethodField()
+
+    def get_parsed_text(self, obj):
+        return text_preview(stored_value(obj, 'parsed_text'), PREVIEW_CHARS)
 
 
 class QuizAnswerSerializer(serializers.ModelSerializer):
@@ -77,9 +126,24 @@ class UserAnswerSerializer(serializers.ModelSerializer):
 
 class DocumentDetailSerializer(serializers.ModelSerializer):
     questions = QuizQuestionSerializer(many=True, read_only=True)
-    grade_level = GradeLevelSerializer(read_only=True)
-    skill_category = SkillCategorySerializer(read_only=True)
+    grade_level = CachedReferenceField(GradeLevelSerializer)
+    skill_category = CachedReferenceField(SkillCategorySerializer)
+    # First page of the text only; the rest comes from /api/documents/<id>/text/?page=N
+    parsed_text = serializers.SerializerMethodField()
+    page_count = serializers.SerializerMethodField()
     
     class Meta:
         model = UploadedDocument
-        fields = ['id', 'title', 'parsed_text', 'uploaded_at', 'questions', 'grade_level', 'skill_category'] 
\ No newline at end of file
+        fields = ['id', 'title', 'parsed_text', 'page_count', 'uploaded_at', 'questions', 'grade_level', 'skill_category'] 
+
+    def first_page(self, obj):
+        """document_page(obj), computed once per instance for both fields"""
+        if not hasattr(obj, '_first_page'):
+            obj._first_page = document_page(obj)
+        return obj._first_page
+
+    def get_parsed_text(self, obj):
+        return self.first_page(obj)[0]
+
+    def get_page_count(self, obj):
+        return self.first_page(obj)[1]
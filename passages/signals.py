@@ -0,0 +1,57 @@
+"""
+Signal handlers for the passages app (connected in PassagesConfig.ready)
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .blobs import release_blob
+from .facets import adjust_facet_count, facet_key
+from .models import CompressionDictionary, GradeLevel, SkillCategory, UploadedDocument
+from .reference_cache import REFERENCE_CACHES
+
+
+# Reference data changed -> drop the cached copies. Invalidate again once the
+# transaction commits so no process keeps a copy loaded before the commit.
+@receiver([post_save, post_delete], sender=GradeLevel)
+@receiver([post_save, post_delete], sender=SkillCategory)
+@receiver([post_save, post_delete], sender=CompressionDictionary)
+def invalidate_reference_cache(sender, **kwargs):
+    reference_cache = REFERENCE_CACHES[sender]
+    reference_cache.invalidate()
+    transaction.on_commit(reference_cache.invalidate)
+
+
+# A document was deleted -> drop its reference to the stored file
+@receiver(post_delete, sender=UploadedDocument)
+def release_document_file(sender, instance, **kwargs):
+    release_blob(instance.file.name)
+
+
+# Keep DocumentFacetCount in step with the documents (see facets.py)
+@receiver(pre_save, sender=UploadedDocument)
+def remember_facets(sender, instance, update_fields=None, **kwargs):
+    instance._previous_facets = None
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not {'grade_level', 'skill_category'} & set(update_fields):
+        return
+    row = UploadedDocument.objects.filter(pk=instance.pk).values_list('grade_level_id', 'skill_category_id').first()
+    instance._previous_facets = facet_key(*row) if row else None
+
+
+@receiver(post_save, sender=UploadedDocument)
+def count_saved_document(sender, instance, created, **kwargs):
+    key = facet_key(instance.grade_level_id, instance.skill_category_id)
+    previous = getattr(instance, '_previous_facets', None)
+    if created:
+        adjust_facet_count(key, 1)
+    elif previous is not None and previous != key:
+        adjust_facet_count(previous, -1)
+        adjust_facet_count(key, 1)
+
+
+@receiver(post_delete, sender=UploadedDocument)
+def count_deleted_document(sender, instance, **kwargs):
+    adjust_facet_count(facet_key(instance.grade_level_id, instance.skill_category_id), -1)
@@ -0,0 +1,116 @@
+"""
+Single-flight coordination for question generation.
+
+Only one caller at a time generates questions for a given document. The
+in-progress marker is a GenerationLock row (unique per document), so it works
+across processes and servers. Other callers either join the in-flight
+generation (wait for it to finish and use its result) or wait their turn.
+
+Locks expire after GENERATION_LOCK_TTL seconds; a caller that finds an
+expired lock (its holder crashed) takes it over.
+"""
+
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .gemini_utils import QuestionGenerationError, generate_and_save_questions
+from .models import GenerationLock
+
+POLL_INTERVAL = 0.5
+
+
+class GenerationTimeout(QuestionGenerationError):
+    """Waited too long for another caller's generation to finish"""
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'GENERATION_LOCK_TTL', 300))
+
+
+def acquire(document, owner):
+    """Try to take the document's lock without waiting; True on success"""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            GenerationLock.objects.create(document=document, owner=owner, acquired_at=now, expires_at=now + _ttl())
+        return True
+    except IntegrityError:
+        # Held by someone else - take it over only if it is stale
+        taken = GenerationLock.objects.filter(document=document, expires_at__lt=now).update(
+            owner=owner, acquired_at=now, expires_at=now + _ttl()
+        )
+        return taken == 1
+
+
+def release(document, owner):
+    GenerationLock.objects.filter(document=document, owner=owner).delete()
+
+
+def is_locked(document):
+    return GenerationLock.objects.filter(document=document, expires_at__gte=timezone.now()).exists()
+
+
+def wait_until_unlocked(document, timeout=None):
+    """Block until nobody holds a live lock on the document"""
+    timeout = getattr(settings, 'GENERATION_WAIT_TIMEOUT', 120) if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    while is_locked(document):
+        if time.monotonic() >= deadline:
+            raise GenerationTimeout(f"Questions for document {document.pk} are still being generated")
+        time.sleep(POLL_INTERVAL)
+
+
+@contextmanager
+def generation_lock(document, timeout=None):
+    """Hold the document's lock for the duration of the block, waiting for other holders first"""
+    owner = uuid.uuid4().hex
+    timeout = getattr(settings, 'GENERATION_WAIT_TIMEOUT', 120) if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    while not acquire(document, owner):
+        if time.monotonic() >= deadline:
+            raise GenerationTimeout(f"Questions for document {document.pk} are still being generated")
+        time.sleep(POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        release(document, owner)
+
+
+def single_flight(document, generate, timeout=None):
+    """
+    Run generate() unless another caller is already generating for this document.
+
+    Returns generate()'s result for the caller that ran it, or None for callers
+    that joined an in-flight generation (they return once it has finished).
+    """
+    owner = uuid.uuid4().hex
+    if not acquire(document, owner):
+        wait_until_unlocked(document, timeout)
+        return None
+    try:
+        return generate()
+    finally:
+        release(document, owner)
+
+
+def ensure_questions(document, replace=False, timeout=None):
+    """
+    Make sure a document has generated questions, generating them at most once
+    even when called concurrently (double submits, retries, admin actions).
+
+    Returns:
+        int: the number of questions the document has afterwards
+    """
+    def generate():
+        if not replace and document.questions.exists():
+            return None  # a previous caller already finished
+        return generate_and_save_questions(document, replace=replace)
+
+    single_flight(document, generate, timeout)
+    return document.questions.count()
@@ -0,0 +1,261 @@
+"""
+Quiz submission scoring and storage, with an optional write-behind journal.
+
+Scoring needs two queries (the document's question count, and the submitted
+questions/answers fetched in bulk). Saving writes one QuizResponse and
+bulk-inserts its UserAnswer rows, or with QUIZ_PACK_ANSWERS on stores the
+answers packed on the QuizResponse itself (see packed_answers.py).
+
+With QUIZ_WRITE_BEHIND on, SubmitQuizView scores the submission and appends it
+to a local SQLite journal (QUIZ_JOURNAL_PATH, synchronous writes, so it
+survives a crash) instead of writing to the database. `manage.py
+flush_quiz_journal` bulk-inserts journalled submissions in batches. Every
+submission carries a submission_id that is unique on QuizResponse, so
+replaying a batch that was partly flushed before a crash skips what is
+already in the database.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import Http404
+from django.utils import timezone
+
+from .models import QuizAnswer, QuizQuestion, QuizResponse, UploadedDocument, UserAnswer
+from .packed_answers import pack_answers
+
+
+@dataclass
+class Submission:
+    document_id: int
+    user_name: str
+    score: int
+    total_questions: int
+    answers: list = field(default_factory=list)  # (question_id, selected_answer_id, is_correct)
+    choices: str = ''  # selected choice letters, in answer order (for packed storage)
+    submission_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    submitted_at: str = field(default_factory=lambda: timezone.now().isoformat())
+
+    def to_json(self):
+        return json.dumps(self.__dict__)
+
+    @classmethod
+    def from_json(cls, payload):
+        data = json.loads(payload)
+        data['answers'] = [tuple(answer) for answer in data['answers']]
+        return cls(**data)
+
+
+def _as_id(answer, key):
+    """An answer's id field as an int (JSON clients may send "12")"""
+    try:
+        return int(answer[key])
+    except (TypeError, ValueError, KeyError):
+        raise ValueError(f'{key} must be an integer')
+
+
+def score_submission(document_id, user_name, answers):
+    """
+    Score submitted answers ([{question_id, selected_answer_id}]).
+
+    Raises:
+        Http404: unknown document, question or answer
+        ValueError: the document has no questions, or an id is not an integer
+            (message shown to the client)
+    """
+    if not UploadedDocument.objects.filter(id=document_id).exists():
+        raise Http404("No UploadedDocument matches the given query.")
+    total_questions = QuizQuestion.objects.filter(document_id=document_id).count()
+    if not total_questions:
+        raise ValueError('No questions found for this document')
+
+    answers = [(_as_id(a, 'question_id'), _as_id(a, 'selected_answer_id')) for a in answers]
+    question_ids = {question_id for question_id, _ in answers}
+    answer_ids = {answer_id for _, answer_id in answers}
+    known_questions = set(QuizQuestion.objects.filter(id__in=question_ids).values_list('id', flat=True))
+    selected = {
+        answer_id: (is_correct, choice_letter)
+        for answer_id, is_correct, choice_letter in
+        QuizAnswer.objects.filter(id__in=answer_ids).values_list('id', 'is_correct', 'choice_letter')
+    }
+
+    rows = []
+    for question_id, selected_answer_id in answers:
+        if question_id not in known_questions:
+            raise Http404("No QuizQuestion matches the given query.")
+        if selected_answer_id not in selected:
+            raise Http404("No QuizAnswer matches the given query.")
+        rows.append((question_id, selected_answer_id, selected[selected_answer_id][0]))
+
+    return Submission(
+        document_id=int(document_id), user_name=user_name,
+        score=sum(1 for *_, is_correct in rows if is_correct), total_questions=total_questions, answers=rows,
+        choices=''.join(selected[answer_id][1] for _, answer_id, _ in rows),
+    )
+
+
+def _response_for(submission):
+    response = QuizResponse(
+        document_id=submission.document_id,
+        user_name=submission.user_name,
+        score=submission.score,
+        total_questions=submission.total_questions,
+        submission_id=uuid.UUID(submission.submission_id),
+        submitted_at=datetime.fromisoformat(submission.submitted_at),
+    )
+    if settings.QUIZ_PACK_ANSWERS:
+        response.packed_answers, response.correct_mask = pack_answers(_packed_records(submission))
+    return response
+
+
+def _packed_records(submission):
+    choices = submission.choices
+    if len(choices) != len(submission.answers):  # journalled before choices were recorded
+        letters = dict(QuizAnswer.objects.filter(id__in=[a for _, a, _ in submission.answers]).values_list('id', 'choice_letter'))
+        choices = [letters.get(answer_id, '?') for _, answer_id, _ in submission.answers]
+    return [(question_id, letter, is_correct) for (question_id, _, is_correct), letter in zip(submission.answers, choices)]
+
+
+def _answers_for(submission, response_id):
+    if settings.QUIZ_PACK_ANSWERS:
+        return []
+    return [
+        UserAnswer(response_id=response_id, question_id=question_id, selected_answer_id=answer_id, is_correct=is_correct)
+        for question_id, answer_id, is_correct in submission.answers
+    ]
+
+
+def save_submission(submission):
+    """Write one submission to the database now; returns the QuizResponse"""
+    with transaction.atomic():
+        response = _response_for(submission)
+        response.save()
+        UserAnswer.objects.bulk_create(_answers_for(submission, response.id))
+    return response
+
+
+def save_submissions(submissions):
+    """
+    Bulk-insert submissions, skipping any whose submission_id is already stored.
+
+    Returns:
+        int: the number of submissions inserted
+    """
+    by_id = {uuid.UUID(s.submission_id): s for s in submissions}
+    existing = set(QuizResponse.objects.filter(submission_id__in=by_id).values_list('submission_id', flat=True))
+    new = [s for key, s in by_id.items() if key not in existing]
+    if not new:
+        return 0
+    with transaction.atomic():
+        QuizResponse.objects.bulk_create([_response_for(s) for s in new])
+        if settings.QUIZ_PACK_ANSWERS:
+            return len(new)
+        response_ids = dict(
+            QuizResponse.objects.filter(submission_id__in=[uuid.UUID(s.submission_id) for s in new])
+            .values_list('submission_id', 'id')
+        )
+        UserAnswer.objects.bulk_create([
+            answer for s in new for answer in _answers_for(s, response_ids[uuid.UUID(s.submission_id)])
+        ])
+    return len(new)
+
+
+class QuizJournal:
+    """Durable local append-only buffer of submissions (a SQLite file)"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=FULL')  # an acknowledged submission is on disk
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS submissions ('
+                ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' submission_id TEXT NOT NULL UNIQUE,'
+                ' payload TEXT NOT NULL,'
+                ' appended_at REAL NOT NULL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS failed (submission_id TEXT PRIMARY KEY, payload TEXT NOT NULL, error TEXT)'
+            )
+            self._local.connection = connection
+        return connection
+
+    def append(self, submission):
+        self._connection().execute(
+            'INSERT OR IGNORE INTO submissions (submission_id, payload, appended_at) VALUES (?, ?, ?)',
+            (submission.submission_id, submission.to_json(), time.time()),
+        )
+
+    def pending(self, limit):
+        rows = self._connection().execute(
+            'SELECT seq, payload FROM submissions ORDER BY seq LIMIT ?', (limit,)
+        ).fetchall()
+        return [(seq, Submission.from_json(payload)) for seq, payload in rows]
+
+    def remove(self, seqs):
+        if seqs:
+            placeholders = ','.join('?' * len(seqs))
+            self._connection().execute(f'DELETE FROM submissions WHERE seq IN ({placeholders})', list(seqs))
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM submissions').fetchone()[0]
+
+    def flush(self, batch_size=500):
+        """
+        Move journalled submissions into the database, oldest first.
+        Rows are only removed from the journal after their batch committed.
+
+        Returns:
+            (flushed, inserted): journal rows processed and rows newly inserted
+        """
+        flushed = inserted = 0
+        while True:
+            batch = self.pending(batch_size)
+            if not batch:
+                return flushed, inserted
+            try:
+                inserted += save_submissions([submission for _, submission in batch])
+            except IntegrityError:
+                # A concurrent flusher, or a submission whose document/question was
+                # deleted meanwhile: go one by one and set the bad ones aside
+                inserted += self._flush_individually(batch)
+            self.remove([seq for seq, _ in batch])
+            flushed += len(batch)
+
+    def _flush_individually(self, batch):
+        inserted = 0
+        for _, submission in batch:
+            try:
+                inserted += save_submissions([submission])
+            except IntegrityError as e:
+                print(f"⚠️ Quiz submission {submission.submission_id} could not be saved: {e}")
+                self._connection().execute(
+                    'INSERT OR IGNORE INTO failed (submission_id, payload, error) VALUES (?, ?, ?)',
+                    (submission.submission_id, submission.to_json(), str(e)),
+                )
+        return inserted
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def quiz_journal():
+    global _journal
+    with _journal_lock:
+        if _journal is None or _journal.path != str(settings.QUIZ_JOURNAL_PATH):
+            _journal = QuizJournal(settings.QUIZ_JOURNAL_PATH)
+        return _journal
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from passages.gemini_utils import parse_questions
 
 sample_text = """
@@ -19,3 +19,1397 @@ questions = parse_questions(sample_text)
 for q in questions:
     print(q)
 
+
+
+class BenchmarkHelpersTest(TestCase):
+    """Sanity checks for the benchmark fixtures and regression comparison"""
+
+    def test_fixtures_parse(self):
+        from passages.benchmarks import make_gemini_output
+        parsed = parse_questions(make_gemini_output(10))
+        self.assertEqual(len(parsed), 10)
+        self.assertTrue(all(len(q["answers"]) == 4 for q in parsed))
+        self.assertEqual(len(parse_questions(make_gemini_output(10, one_line=True))), 10)
+
+    def test_find_regressions(self):
+        from passages.benchmarks import find_regressions
+        baseline = {"results": [{"name": "parse_questions", "size": 10, "min": 1.0}]}
+        current = {"results": [
+            {"name": "parse_questions", "size": 10, "min": 1.5},
+            {"name": "new_benchmark", "size": 10, "min": 9.0},
+        ]}
+        regressions = find_regressions(current, baseline, threshold=0.25)
+        self.assertEqual([r["name"] for r in regressions], ["parse_questions"])
+        self.assertEqual(find_regressions(current, baseline, threshold=0.6), [])
+
+
+class FastRenderingTest(TestCase):
+    """USE_FAST_JSON must produce byte-identical responses to the stock serializers"""
+
+    def setUp(self):
+        from passages.models import GradeLevel, UploadedDocument
+        from passages.benchmarks import make_gemini_output
+        from passages.gemini_utils import save_parsed_questions
+        grade = GradeLevel.objects.create(name='3rd Grade')
+        self.document = UploadedDocument.objects.create(
+            title='Caf\u00e9\u2028story', file='documents/story.docx',
+            parsed_text='Line one\nLine\u2029two "quoted" \U0001F600', grade_level=grade,
+        )
+        UploadedDocument.objects.create(title='No file or metadata', file='')
+        save_parsed_questions(self.document, parse_questions(make_gemini_output(5)))
+
+    def test_readers_and_renderer_match_stock_output(self):
+        from rest_framework.renderers import JSONRenderer
+        from rest_framework.test import APIRequestFactory
+        from passages.models import UploadedDocument, QuizQuestion
+        from passages.read_serializers import document_detail_data, document_list_data, question_list_data
+        from passages.renderers import FastJSONRenderer
+        from passages.serializers import DocumentDetailSerializer, DocumentListSerializer, QuizQuestionSerializer
+        from passages.views import DocumentDetailView
+
+        stock, fast = JSONRenderer(), FastJSONRenderer()
+        request = APIRequestFactory().get('/api/documents/')
+        documents = UploadedDocument.objects.order_by('-uploaded_at', '-id')
+        questions = QuizQuestion.objects.order_by('id')
+
+        self.assertEqual(
+            stock.render(DocumentDetailSerializer(DocumentDetailView.queryset.get(pk=self.document.pk)).data),
+            fast.render(document_detail_data(self.document.pk)),
+        )
+        self.assertEqual(
+            stock.render(QuizQuestionSerializer(questions, many=True).data),
+            fast.render(question_list_data(questions)),
+        )
+        self.assertEqual(
+            stock.render(DocumentListSerializer(documents, many=True, context={'request': request}).data),
+            fast.render(document_list_data(documents, request)),
+        )
+
+    def test_document_list_keys_match_serializer_fields(self):
+        from rest_framework.test import APIRequestFactory
+        from passages.models import UploadedDocument
+        from passages.read_serializers import document_list_data
+        from passages.serializers import DocumentListSerializer
+
+        request = APIRequestFactory().get('/api/documents/')
+        documents = UploadedDocument.objects.order_by('-uploaded_at', '-id')
+        expected = list(DocumentListSerializer(context={'request': request}).fields)
+
+        for row in document_list_data(documents, request):
+            self.assertEqual(list(row), expected)
+
+
+class CompressionAndCachingTest(TestCase):
+    """Negotiated compression and per-view Cache-Control headers"""
+
+    def test_accept_encoding_negotiation(self):
+        from passages import middleware
+        self.assertEqual(middleware.choose_encoding('gzip, deflate'), 'gzip')
+        self.assertIsNone(middleware.choose_encoding('identity'))
+        self.assertIsNone(middleware.choose_encoding('gzip;q=0'))
+        expected = 'br' if middleware.brotli is not None else 'gzip'
+        self.assertEqual(middleware.choose_encoding('gzip;q=0.5, br'), expected)
+
+    def test_large_payload_is_gzipped_small_one_is_not(self):
+        import gzip
+        from django.http import HttpResponse, StreamingHttpResponse
+        from django.test import RequestFactory
+        from passages.middleware import CompressionMiddleware
+
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        body = b'{"parsed_text": "' + b'the river story ' * 500 + b'"}'
+        middleware = CompressionMiddleware(lambda r: HttpResponse(body, content_type='application/json'))
+        response = middleware(request)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), body)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        small = CompressionMiddleware(lambda r: HttpResponse(b'{}', content_type='application/json'))(request)
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+        docx = CompressionMiddleware(lambda r: HttpResponse(
+            body, content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document'))(request)
+        self.assertFalse(docx.has_header('Content-Encoding'))
+
+        streamed = CompressionMiddleware(lambda r: StreamingHttpResponse(
+            iter([body, body]), content_type='application/json'))(request)
+        self.assertEqual(gzip.decompress(b''.join(streamed.streaming_content)), body * 2)
+
+    def test_cache_control_policies(self):
+        response = self.client.get('/api/grade-levels/', HTTP_ACCEPT='application/json')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertIn('Accept', response['Vary'])
+
+        response = self.client.get('/api/documents/', HTTP_ACCEPT='application/json')
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+        response = self.client.get('/api/documents/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class ReferenceCacheTest(TestCase):
+    """Reference data is served from the process-local cache and invalidated on write"""
+
+    def setUp(self):
+        from passages.models import GradeLevel, SkillCategory
+        self.grade = GradeLevel.objects.create(name='4th Grade')
+        self.skill = SkillCategory.objects.create(name='Inference')
+
+    def test_lists_and_validation_use_no_queries(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from passages.serializers import UploadedDocumentSerializer
+
+        self.client.get('/api/grade-levels/')  # warm the cache
+        self.client.get('/api/skill-categories/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/grade-levels/', HTTP_ACCEPT='application/json')
+            self.client.get('/api/skill-categories/%d/' % self.skill.pk, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), [{'id': self.grade.pk, 'name': '4th Grade'}])
+
+        data = {
+            'title': 'Passage',
+            'file': SimpleUploadedFile('passage.docx', b'data'),
+            'grade_level': self.grade.pk,
+            'skill_category': self.skill.pk,
+        }
+        with self.assertNumQueries(0):
+            serializer = UploadedDocumentSerializer(data=data)
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data['grade_level'], self.grade)
+
+        invalid = UploadedDocumentSerializer(data={**data, 'grade_level': 999})
+        self.assertFalse(invalid.is_valid())
+        self.assertIn('grade_level', invalid.errors)
+
+    def test_write_invalidates(self):
+        from passages.reference_cache import grade_levels
+        self.assertEqual(grade_levels.get(self.grade.pk).name, '4th Grade')
+        self.grade.name = 'Fourth Grade'
+        self.grade.save()
+        self.assertEqual(grade_levels.get(self.grade.pk).name, 'Fourth Grade')
+        self.grade.delete()
+        self.assertEqual(grade_levels.all(), [])
+
+    def test_unknown_id_reloads_once(self):
+        from passages.models import GradeLevel
+        from passages.reference_cache import grade_levels
+        grade_levels.get(self.grade.pk)
+        created = GradeLevel.objects.bulk_create([GradeLevel(name='5th Grade')])[0]  # no signals
+        with self.assertNumQueries(1):
+            self.assertEqual(grade_levels.get(created.pk).name, '5th Grade')
+            self.assertIsNone(grade_levels.get(999))
+            self.assertIsNone(grade_levels.get(999))
+
+    def test_detail_with_grade_from_another_process(self):
+        from passages.models import GradeLevel, UploadedDocument
+        from passages.reference_cache import grade_levels
+
+        grade_levels.get(999)  # the one reload on a miss is used up
+        grade = GradeLevel.objects.bulk_create([GradeLevel(name='6th Grade')])[0]  # no signals, like another process
+        document = UploadedDocument.objects.create(title='Passage', file='', parsed_text='Text.', grade_level=grade)
+        for use_fast_json in (True, False):
+            with self.settings(USE_FAST_JSON=use_fast_json):
+                detail = self.client.get(f'/api/documents/{document.id}/detail/').json()
+            self.assertEqual(detail['grade_level'], {'id': grade.id, 'name': '6th Grade'})
+
+
+class GenerateQuestionsCommandTest(TransactionTestCase):
+    """manage.py generate_questions selects documents, saves questions and resumes from its checkpoint"""
+
+    def setUp(self):
+        import os
+        import tempfile
+        from passages.models import UploadedDocument
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, 'checkpoint.json')
+        self.with_text = [
+            UploadedDocument.objects.create(title=f'Passage {i}', file='documents/p.docx', parsed_text='Once upon a time.')
+            for i in range(3)
+        ]
+        UploadedDocument.objects.create(title='Empty', file='documents/e.docx', parsed_text='')
+
+    def run_command(self, *args):
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from passages.benchmarks import make_gemini_output
+
+        with mock.patch('passages.gemini_utils.generate_questions', return_value=make_gemini_output(7)) as generate:
+            # One worker: SQLite's shared in-memory test database locks on concurrent writes
+            call_command('generate_questions', '--missing', '--workers', '1', '--checkpoint', self.checkpoint,
+                         *args, stdout=StringIO(), stderr=StringIO())
+        return generate.call_count
+
+    def test_generates_for_documents_without_questions_and_resumes(self):
+        from passages.management.commands.generate_questions import Checkpoint
+
+        # Pretend an earlier run finished the first document before being interrupted
+        selection = {'missing': True, 'uploaded_before': None, 'grade_level': None, 'ids': None, 'replace': False}
+        checkpoint = Checkpoint(self.checkpoint, selection)
+        checkpoint.record(self.with_text[0].pk)
+
+        self.assertEqual(self.run_command(), 2)
+        self.assertEqual(self.with_text[0].questions.count(), 0)
+        self.assertEqual(self.with_text[1].questions.count(), 7)
+
+        # Finished runs remove their checkpoint; a new run only picks up what is still missing
+        self.assertEqual(self.run_command(), 1)
+        self.assertEqual(self.with_text[0].questions.count(), 7)
+
+
+class IncrementalRegenerationTest(TestCase):
+    """Replacing a document's text only regenerates questions for changed sections"""
+
+    def paragraphs(self, count, edit=None):
+        lines = [f'Paragraph {i}: ' + 'the river runs past the quiet village ' * 8 for i in range(count)]
+        if edit is not None:
+            lines[edit] = lines[edit].replace('village', 'vilage', 1)  # a typo
+        return '\n'.join(lines)
+
+    def test_typo_only_touches_its_section(self):
+        from unittest import mock
+        from passages.benchmarks import make_gemini_output
+        from passages.gemini_utils import QuestionGenerationError, generate_and_save_questions, regenerate_changed_sections
+        from passages.models import UploadedDocument, UserAnswer, QuizResponse
+        from passages.sections import split_sections
+
+        original = self.paragraphs(60)
+        sections = split_sections(original)
+        self.assertGreater(len(sections), 2)
+
+        document = UploadedDocument.objects.create(title='Long passage', file='documents/long.docx', parsed_text=original)
+        with mock.patch('passages.gemini_utils.generate_questions', return_value=make_gemini_output(3)):
+            for section in sections:
+                generate_and_save_questions(document, section=section)
+        kept_question = document.questions.filter(source_section=sections[0].hash).first()
+        response = QuizResponse.objects.create(document=document, score=1, total_questions=1)
+        UserAnswer.objects.create(response=response, question=kept_question,
+                                  selected_answer=kept_question.answers.first(), is_correct=True)
+
+        # Edit one paragraph in the last section
+        edited_paragraph = original.split('\n').index(sections[-1].paragraphs[0])
+        document.parsed_text = self.paragraphs(60, edit=edited_paragraph)
+        document.save()
+        with mock.patch('passages.gemini_utils.generate_questions', return_value=make_gemini_output(3)) as generate:
+            deleted, generated = regenerate_changed_sections(document, original)
+
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual((deleted, generated), (3, 3))
+        self.assertEqual(document.questions.count(), 3 * len(sections))
+        self.assertTrue(UserAnswer.objects.filter(question=kept_question).exists())
+        self.assertEqual(document.section_hashes, [s.hash for s in split_sections(document.parsed_text)])
+
+        # A failed generation leaves the stale questions and section hashes alone
+        previous_text, previous_hashes = document.parsed_text, document.section_hashes
+        document.parsed_text = self.paragraphs(60, edit=0)
+        document.save()
+        with mock.patch('passages.gemini_utils.generate_questions', return_value='Sorry, no questions.'):
+            with self.assertRaises(QuestionGenerationError):
+                regenerate_changed_sections(document, previous_text)
+        document.refresh_from_db()
+        self.assertEqual(document.questions.count(), 3 * len(sections))
+        self.assertEqual(document.section_hashes, previous_hashes)
+
+    def test_default_prompt_covers_leading_sections(self):
+        from passages.gemini_utils import MAX_PROMPT_CHARS, prompt_text
+        from passages.sections import split_sections
+
+        sections = split_sections(self.paragraphs(60))[1:]  # sections of about 1000, 1300 and 2200 chars
+        self.assertEqual(prompt_text(sections), sections[0].text + '\n' + sections[1].text)
+        self.assertLessEqual(len(prompt_text(sections)), MAX_PROMPT_CHARS)
+
+
+class PromptBatchingTest(TestCase):
+    """Short documents share one prompt; unparseable parts fall back to single-document calls"""
+
+    def test_generate_batch_splits_response_per_document(self):
+        from unittest import mock
+        from passages.batching import build_batch_prompt, generate_batch
+        from passages.benchmarks import make_gemini_output
+        from passages.models import UploadedDocument
+
+        documents = [
+            UploadedDocument.objects.create(title=f'Short {i}', file='documents/s.docx', parsed_text=f'A short story number {i}.')
+            for i in range(3)
+        ]
+        response = '\n'.join([
+            f'### DOCUMENT {documents[0].pk}', make_gemini_output(7, seed=1),
+            f'**DOCUMENT {documents[1].pk}**', make_gemini_output(7, seed=2),
+            f'### DOCUMENT {documents[2].pk}', 'Sorry, I could not read this passage.',
+        ])
+        self.assertIn(f'=== DOCUMENT {documents[2].pk} ===', build_batch_prompt(documents))
+
+        with mock.patch('passages.batching.call_gemini', return_value=response) as call:
+            saved, leftovers = generate_batch(documents)
+
+        self.assertEqual(call.call_count, 1)
+        self.assertEqual(saved, {documents[0].pk: 7, documents[1].pk: 7})
+        self.assertEqual(leftovers, [documents[2]])
+        self.assertEqual(documents[1].questions.count(), 7)
+        self.assertEqual(documents[2].questions.count(), 0)
+
+        # A caller that was waiting behind that generation finds the questions there
+        with mock.patch('passages.batching.call_gemini') as call:
+            self.assertEqual(generate_batch(documents[:2]), ({documents[0].pk: 7, documents[1].pk: 7}, []))
+        call.assert_not_called()
+
+
+class StreamingGenerationTest(TestCase):
+    """Streamed Gemini output is parsed incrementally and pushed over server-sent events"""
+
+    def test_parser_emits_each_question_on_its_answer_line(self):
+        from passages.benchmarks import make_gemini_output
+        from passages.gemini_utils import QuestionParser
+
+        raw = make_gemini_output(3)
+        parser = QuestionParser(emit_on_answer=True)
+        first_answer_end = raw.index('\n', raw.index('Answer:'))
+        self.assertEqual(parser.feed(raw[:first_answer_end]), [])  # answer line not terminated yet
+        emitted = parser.feed(raw[first_answer_end:first_answer_end + 1])
+        self.assertEqual(len(emitted), 1)
+        self.assertEqual(emitted + parser.feed(raw[first_answer_end + 1:]) + parser.close(), parse_questions(raw))
+
+    def test_sse_endpoint_saves_and_pushes_questions(self):
+        import json
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from passages.benchmarks import make_gemini_output
+        from passages.models import UploadedDocument
+
+        document = UploadedDocument.objects.create(title='Streamed', file='documents/s.docx', parsed_text='A passage.')
+        raw = make_gemini_output(7)
+        self.assertEqual(self.client.get(f'/api/documents/{document.pk}/questions/stream/').status_code, 401)
+        self.client.force_login(User.objects.create_user('reader', password='pw'))
+        chunks = [raw[i:i + 25] for i in range(0, len(raw), 25)]
+
+        with mock.patch('passages.gemini_utils.stream_gemini', return_value=iter(chunks)):
+            response = self.client.get(f'/api/documents/{document.pk}/questions/stream/', HTTP_ACCEPT='text/event-stream')
+            body = b''.join(response.streaming_content).decode()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [block for block in body.split('\n\n') if block.startswith('event:')]
+        self.assertEqual([e.split('\n')[0] for e in events], ['event: question'] * 7 + ['event: done'])
+        self.assertEqual(json.loads(events[-1].split('data: ')[1]), {'count': 7, 'generated': True})
+        self.assertEqual(document.questions.count(), 7)
+
+        # A second client just receives the saved questions
+        response = self.client.get(f'/api/documents/{document.pk}/questions/stream/')
+        self.assertIn('"generated":false', b''.join(response.streaming_content).decode())
+
+
+class SingleFlightTest(TestCase):
+    """Only one caller generates questions for a document at a time"""
+
+    def setUp(self):
+        from passages.models import UploadedDocument
+        self.document = UploadedDocument.objects.create(title='Locked', file='documents/l.docx', parsed_text='A passage.')
+
+    def test_lock_is_exclusive_until_released_or_stale(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from passages.models import GenerationLock
+        from passages.single_flight import acquire, release
+
+        self.assertTrue(acquire(self.document, 'first'))
+        self.assertFalse(acquire(self.document, 'second'))
+        release(self.document, 'second')  # not the owner: no effect
+        self.assertFalse(acquire(self.document, 'second'))
+
+        GenerationLock.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(acquire(self.document, 'second'))
+        self.assertEqual(GenerationLock.objects.get().owner, 'second')
+        release(self.document, 'second')
+        self.assertFalse(GenerationLock.objects.exists())
+
+    def test_ensure_questions_generates_once_and_joins_in_flight_generation(self):
+        from unittest import mock
+        from passages.benchmarks import make_gemini_output
+        from passages.single_flight import GenerationTimeout, acquire, ensure_questions, release
+
+        with mock.patch('passages.gemini_utils.generate_questions', return_value=make_gemini_output(7)) as generate:
+            self.assertEqual(ensure_questions(self.document), 7)
+            self.assertEqual(ensure_questions(self.document), 7)  # e.g. a retried request
+        self.assertEqual(generate.call_count, 1)
+
+        acquire(self.document, 'someone-else')
+        with mock.patch('passages.gemini_utils.generate_questions') as generate:
+            with self.assertRaises(GenerationTimeout):
+                ensure_questions(self.document, replace=True, timeout=0)
+        generate.assert_not_called()
+        release(self.document, 'someone-else')
+
+
+class TextStatsTest(TestCase):
+    """Passage statistics are stored once and used for filtering and ordering"""
+
+    def test_counts_and_readability(self):
+        from passages.text_stats import count_text, text_stats
+
+        self.assertEqual(count_text('The cat sat on the mat. It was happy!\nA Title\nMake a table in 1999.'), (16, 4, 19))
+        stats = text_stats('The cat sat on the mat. It was happy!')
+        self.assertEqual((stats['word_count'], stats['sentence_count'], stats['reading_minutes']), (9, 2, 1))
+        self.assertAlmostEqual(stats['readability_grade'], round(0.39 * 9 / 2 + 11.8 * 10 / 9 - 15.59, 1))
+        self.assertIsNone(text_stats('')['readability_grade'])
+
+    def test_backfill_filters_and_ordering(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from passages.models import UploadedDocument
+
+        easy = UploadedDocument.objects.create(title='Easy', file='', parsed_text='The dog ran. ' * 50)
+        hard = UploadedDocument.objects.create(
+            title='Hard', file='', parsed_text='Photosynthesis fundamentally transforms electromagnetic radiation into chemical energy. ' * 100,
+        )
+        UploadedDocument.objects.create(title='No text', file='')
+        call_command('compute_text_stats', stdout=StringIO())
+        easy.refresh_from_db()
+        self.assertEqual((easy.word_count, easy.sentence_count, easy.reading_minutes), (150, 50, 1))
+
+        titles = lambda params: [d['title'] for d in self.client.get('/api/documents/', params).json()]
+        self.assertEqual(titles({'ordering': '-readability_grade'}), ['Hard', 'Easy', 'No text'])
+        self.assertEqual(titles({'max_grade': 6}), ['Easy'])
+        self.assertEqual(titles({'min_words': 500, 'max_reading_minutes': 5}), ['Hard'])
+        for params in ({'min_words': 'lots'}, {'min_words': 'nan'}, {'max_grade': 'inf'}, {'min_sentences': '2.5'},
+                       {'max_words': '9' * 30}):
+            self.assertEqual(self.client.get('/api/documents/', params).status_code, 400, params)
+        self.assertEqual(titles({'max_grade': '6.5'}), ['Easy'])
+        self.assertEqual(self.client.get(f'/api/documents/{hard.id}/', {'max_grade': 1}).status_code, 200)
+
+
+class FacetCountTest(TestCase):
+    """Grade level / skill category counts are kept by signals, not counted per request"""
+
+    def test_counts_follow_document_changes(self):
+        from io import StringIO
+        from django.contrib.auth.models import User
+        from django.core.management import call_command
+        from django.db.models import Count
+        from passages.models import DocumentFacetCount, GradeLevel, SkillCategory, UploadedDocument
+
+        grade3, grade4 = GradeLevel.objects.create(name='Grade 3'), GradeLevel.objects.create(name='Grade 4')
+        skill = SkillCategory.objects.create(name='Main idea')
+        teacher = User.objects.create_user('teacher', password='pw')
+        first = UploadedDocument.objects.create(title='A', file='', grade_level=grade3, skill_category=skill, uploader=teacher)
+        UploadedDocument.objects.create(title='B', file='', grade_level=grade3)
+        moved = UploadedDocument.objects.create(title='C', file='', grade_level=grade3, skill_category=skill)
+        moved.grade_level = grade4
+        moved.save()
+        moved.title = 'C2'
+        moved.save(update_fields=['title'])
+        UploadedDocument.objects.create(title='D', file='', grade_level=grade4).delete()
+
+        def cached():
+            return {(c.grade_level, c.skill_category): c.count for c in DocumentFacetCount.objects.filter(count__gt=0)}
+
+        grouped = {
+            (row['grade_level_id'] or 0, row['skill_category_id'] or 0): row['n']
+            for row in UploadedDocument.objects.values('grade_level_id', 'skill_category_id').annotate(n=Count('id'))
+        }
+        self.assertEqual(cached(), grouped)
+        self.assertEqual(cached(), {(grade3.id, skill.id): 1, (grade3.id, 0): 1, (grade4.id, skill.id): 1})
+
+        facets = self.client.get('/api/documents/facets/', {'skill_category': skill.id}).json()
+        self.assertEqual([(g['name'], g['count']) for g in facets['grade_level']], [('Grade 3', 1), ('Grade 4', 1)])
+        self.assertEqual([(s['name'], s['count']) for s in facets['skill_category']], [('Main idea', 2), (None, 1)])
+
+        with self.assertNumQueries(2):
+            body = self.client.get('/api/documents/', {'grade_level': grade3.id, 'facets': 'true'}).json()
+        self.assertEqual(sorted(d['title'] for d in body['results']), ['A', 'B'])
+        self.assertEqual([s['count'] for s in body['facets']['skill_category']], [1, 1])
+        self.assertEqual([d['title'] for d in self.client.get('/api/documents/', {'skill_category': 'none'}).json()], ['B'])
+
+        titles = lambda params: sorted(d['title'] for d in self.client.get('/api/documents/', params).json())
+        self.assertEqual(titles({'uploader': 'teacher'}), ['A'])
+        self.assertEqual(titles({'uploader': teacher.id}), ['A'])
+        self.assertEqual(titles({'uploaded_after': first.uploaded_at.isoformat()}), ['A', 'B', 'C2'])
+        self.assertEqual(titles({'uploaded_before': '2000-01-01'}), [])
+        self.assertEqual(self.client.get('/api/documents/', {'uploaded_after': 'yesterday'}).status_code, 400)
+
+        DocumentFacetCount.objects.all().delete()
+        call_command('rebuild_facet_counts', stdout=StringIO())
+        self.assertEqual(cached(), grouped)
+
+
+class PagedTextTest(TestCase):
+    """Long passages are served a page at a time, cut out by the database"""
+
+    def test_pages_cover_text_and_cost_the_same(self):
+        from unittest import mock
+        from passages import serializers
+        from passages.models import UploadedDocument
+        from passages.paging import PAGE_CHARS, page_starts, paragraph_offsets, text_page
+
+        paragraphs = [f'Paragraph {i} caf\u00e9 \U0001F600 ' + 'word ' * (i % 40) for i in range(400)]
+        text = '\n\n' + '\n\n'.join(paragraphs) + '\n'
+        offsets = paragraph_offsets(text)
+        self.assertEqual(len(offsets), len(paragraphs) + 1)
+        self.assertEqual((offsets[0], offsets[-1]), (0, len(text)))
+        pages = [text_page(text, offsets, page)[0] for page in range(1, len(page_starts(offsets)) + 1)]
+        self.assertEqual(''.join(pages), text)
+        self.assertTrue(all(len(page) <= PAGE_CHARS for page in pages))
+        self.assertEqual(text_page('', paragraph_offsets(''))[0], '')
+
+        long_doc = UploadedDocument.objects.create(title='Long', file='', parsed_text=text, paragraph_offsets=offsets)
+        legacy = UploadedDocument.objects.create(title='Legacy', file='', parsed_text=text)
+        with self.assertNumQueries(1):
+            last = self.client.get(f'/api/documents/{long_doc.id}/text/', {'page': len(pages)}).json()
+        self.assertEqual((last['text'], last['page_count'], last['next_page']), (pages[-1], len(pages), None))
+        self.assertEqual(self.client.get(f'/api/documents/{legacy.id}/text/', {'page': 2}).json()['text'], pages[1])
+        self.assertEqual(self.client.get(f'/api/documents/{long_doc.id}/text/', {'page': len(pages) + 1}).status_code, 404)
+        self.assertEqual(self.client.get(f'/api/documents/{long_doc.id}/text/', {'page': 'two'}).status_code, 400)
+
+        for use_fast_json in (True, False):
+            with self.settings(USE_FAST_JSON=use_fast_json):
+                detail = self.client.get(f'/api/documents/{long_doc.id}/detail/').json()
+            self.assertEqual((detail['parsed_text'], detail['page_count']), (pages[0], len(pages)))
+
+        with self.settings(USE_FAST_JSON=False), mock.patch.object(serializers, 'document_page', wraps=serializers.document_page) as paged:
+            self.client.get(f'/api/documents/{long_doc.id}/detail/')
+        self.assertEqual(paged.call_count, 1)
+
+    def test_text_only_changes_with_the_file(self):
+        from django.contrib.auth.models import User
+        from passages.models import UploadedDocument
+        from passages.paging import paragraph_offsets
+
+        text = 'First paragraph.\n\nSecond one.'
+        document = UploadedDocument.objects.create(title='Old', file='', parsed_text=text, paragraph_offsets=paragraph_offsets(text))
+        response = self.client.patch(f'/api/documents/{document.id}/', {'title': 'New', 'parsed_text': 'Edited.'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        document.refresh_from_db()
+        self.assertEqual((document.title, document.parsed_text), ('New', text))  # offsets and stats still match
+
+        self.client.force_login(User.objects.create_superuser('admin', password='pw'))
+        page = self.client.get(f'/admin/passages/uploadeddocument/{document.id}/change/')
+        self.assertNotContains(page, 'name="parsed_text"')
+        self.assertContains(page, 'Second one.')
+
+
+class CompressedTextTest(TestCase):
+    """parsed_text is stored compressed and only decompressed when read"""
+
+    def setUp(self):
+        from passages.reference_cache import compression_dictionaries
+        self.addCleanup(compression_dictionaries.invalidate)
+
+    def test_lazy_round_trip_and_dictionary_training(self):
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import CommandError, call_command
+        from passages import compression
+        from passages.models import CompressionDictionary, UploadedDocument
+
+        text = 'The fox ran across the field to find the old oak tree.\n' * 40
+        document = UploadedDocument.objects.create(title='Fox', file='', parsed_text=text)
+        UploadedDocument.objects.create(title='Empty', file='', parsed_text='')
+        stored = UploadedDocument.objects.values_list('parsed_text', flat=True).get(pk=document.pk)
+        self.assertIsInstance(stored, compression.CompressedText)
+        self.assertLess(len(stored), len(text) // 10)
+        self.assertEqual(compression.text_of(stored), text)
+        self.assertEqual(list(UploadedDocument.objects.exclude(parsed_text='').values_list('title', flat=True)), ['Fox'])
+
+        with mock.patch.object(compression, 'decompress', wraps=compression.decompress) as decompress, \
+                mock.patch.object(compression, 'compress', wraps=compression.compress) as compress:
+            loaded = UploadedDocument.objects.get(pk=document.pk)
+            loaded.title = 'Renamed'
+            loaded.save()
+            self.assertEqual((decompress.call_count, compress.call_count), (0, 0))
+            self.assertEqual(loaded.parsed_text, text)
+            self.assertEqual(decompress.call_count, 1)
+        self.assertEqual(UploadedDocument.objects.values_list('parsed_text', flat=True).get(pk=document.pk), stored)
+
+        short = 'The old oak tree stood in the field where the fox ran.'
+        plain = compression.compress(short)
+        out = StringIO()
+        call_command('compress_texts', '--train', stdout=out)
+        self.assertIn('Recompressed 1 document(s)', out.getvalue())
+        self.assertLess(len(compression.compress(short)), len(plain))
+        self.assertEqual(UploadedDocument.objects.get(pk=document.pk).parsed_text, text)
+
+        CompressionDictionary.objects.create(id=compression.MAX_DICTIONARIES, data=b'the ')
+        with self.assertRaises(CommandError):
+            call_command('compress_texts', '--train', stdout=StringIO())
+        self.assertFalse(CompressionDictionary.objects.filter(id__gt=compression.MAX_DICTIONARIES).exists())
+
+    def test_dictionary_from_another_process_and_list_preview(self):
+        from passages import compression
+        from passages.models import CompressionDictionary, UploadedDocument
+        from passages.read_serializers import PREVIEW_CHARS
+        from passages.reference_cache import compression_dictionaries
+
+        compression_dictionaries.get(999)  # the one reload on a miss is used up
+        dictionary = CompressionDictionary.objects.bulk_create([CompressionDictionary(data=b'the river ')])[0]  # no signals
+        text = 'The river ran past the mill. ' * 100
+        document = UploadedDocument.objects.create(title='River', file='')
+        UploadedDocument.objects.filter(pk=document.pk).update(parsed_text=compression.compress(text, (dictionary.pk, b'the river ')))
+        self.assertEqual(UploadedDocument.objects.get(pk=document.pk).parsed_text, text)
+
+        for use_fast_json in (True, False):
+            with self.settings(USE_FAST_JSON=use_fast_json):
+                listed = self.client.get('/api/documents/').json()
+            self.assertEqual(listed[0]['parsed_text'], text[:PREVIEW_CHARS])
+
+
+class SingleReadUploadTest(TestCase):
+    """Uploads are parsed and hashed before storage, never read back from it"""
+
+    def test_upload_is_parsed_without_reading_storage(self):
+        import hashlib
+        import tempfile
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.core.files.storage import FileSystemStorage
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+        from passages.benchmarks import make_docx_bytes, make_gemini_output
+        from passages.models import UploadedDocument
+
+        content = make_docx_bytes(5)
+        self.client.force_login(User.objects.create_user('uploader', password='pw'))
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                mock.patch.object(FileSystemStorage, 'open', side_effect=AssertionError('storage read back')), \
+                mock.patch('passages.gemini_utils.generate_questions', return_value=make_gemini_output(7)):
+            response = self.client.post('/api/documents/', {
+                'title': 'Single read',
+                'file': SimpleUploadedFile('passage.docx', content),
+            })
+
+        self.assertEqual(response.status_code, 201, response.content)
+        document = UploadedDocument.objects.get()
+        self.assertEqual(document.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertTrue(document.parsed_text)
+        self.assertNotIn('content_hash', response.json())
+        self.assertGreater(document.word_count, 0)  # text statistics come from the same parse
+        self.assertEqual(document.questions.count(), 7)  # generated before the upload returns
+        self.assertEqual(response.json()['reading_minutes'], document.reading_minutes)
+
+
+class ContentAddressedStorageTest(TestCase):
+    """Identical uploads share one stored file, deleted with the last document using it"""
+
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=self.media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def stored_files(self):
+        import os
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root.name)
+            for root, _, names in os.walk(self.media_root.name) for name in names
+        )
+
+    def test_repeat_uploads_reuse_the_blob(self):
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from passages.benchmarks import make_docx_bytes
+        from passages.models import StoredBlob, UploadedDocument
+
+        content = make_docx_bytes(3)
+        self.client.force_login(User.objects.create_user('uploader', password='pw'))
+        with mock.patch('passages.views.ensure_questions', return_value=0):
+            for title in ('First', 'Second'):
+                response = self.client.post('/api/documents/', {
+                    'title': title, 'file': SimpleUploadedFile('same.docx', content),
+                })
+                self.assertEqual(response.status_code, 201, response.content)
+
+        first, second = UploadedDocument.objects.order_by('id')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(first.file.name, f'documents/{first.content_hash[:2]}/{first.content_hash}.docx')
+        self.assertEqual(self.stored_files(), [first.file.name])
+        self.assertEqual(StoredBlob.objects.get().ref_count, 2)
+
+        first.delete()
+        self.assertEqual(StoredBlob.objects.get().ref_count, 1)
+        self.assertEqual(self.stored_files(), [second.file.name])
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+            self.assertEqual(self.stored_files(), [second.file.name])  # kept until the delete commits
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_dedupe_command_merges_existing_copies(self):
+        from io import StringIO
+        from django.core.files.base import ContentFile
+        from django.core.management import call_command
+        from passages.blobs import document_storage
+        from passages.models import StoredBlob, UploadedDocument
+
+        storage = document_storage()
+        names = [storage.save('documents/story.docx', ContentFile(b'same bytes')) for _ in range(3)]
+        names.append(storage.save('documents/other.docx', ContentFile(b'different')))
+        for name in names:
+            UploadedDocument.objects.create(title=name, file=name)
+
+        call_command('dedupe_documents', stdout=StringIO())
+
+        self.assertEqual(len(self.stored_files()), 2)
+        self.assertEqual(sorted(StoredBlob.objects.values_list('ref_count', flat=True)), [1, 3])
+        for document in UploadedDocument.objects.all():
+            self.assertEqual(document.file.name, StoredBlob.objects.get(content_hash=document.content_hash).name)
+            self.assertTrue(storage.exists(document.file.name))
+
+
+class DocumentDownloadTest(TestCase):
+    """The download endpoint supports ranges, conditional GET and offloading"""
+
+    def setUp(self):
+        import hashlib
+        import tempfile
+        from django.core.files.base import ContentFile
+        from django.test import override_settings
+        from passages.blobs import store_blob
+        from passages.models import UploadedDocument
+
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.content = bytes(range(256)) * 4
+        content_hash = hashlib.sha256(self.content).hexdigest()
+        upload = ContentFile(self.content, name='story.docx')
+        self.document = UploadedDocument.objects.create(
+            title='The Story', file=store_blob(upload, content_hash), content_hash=content_hash
+        )
+        self.url = f'/api/documents/{self.document.pk}/download/'
+
+    def test_full_range_and_conditional_requests(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['ETag'], f'"{self.document.content_hash}"')
+        self.assertIn('the-story.docx', response['Content-Disposition'])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+
+        # Stale If-Range: the whole file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-0', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{self.document.content_hash}"')
+        self.assertEqual(response.status_code, 304)
+
+    def test_offloaded_to_web_server_and_authorization(self):
+        from django.contrib.auth.models import User
+        from django.test import override_settings
+
+        with override_settings(MEDIA_ACCEL='nginx', MEDIA_ACCEL_PREFIX='/protected-media/'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.document.file.name}')
+        self.assertEqual(response.content, b'')
+
+        self.document.uploader = User.objects.create_user('owner', password='pw')
+        self.document.save()
+        with override_settings(DOCUMENT_DOWNLOADS_PUBLIC=False):
+            self.assertEqual(self.client.get(self.url).status_code, 401)
+            self.client.force_login(User.objects.create_user('reader', password='pw'))
+            self.assertEqual(self.client.get(self.url).status_code, 403)
+            self.client.force_login(self.document.uploader)
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_api_links_the_download_endpoint_only(self):
+        for use_fast_json in (True, False):
+            with self.settings(USE_FAST_JSON=use_fast_json):
+                listed = self.client.get('/api/documents/').json()
+            self.assertEqual(listed[0]['file'], f'http://testserver{self.url}')
+        self.assertEqual(self.client.get(f'/media/{self.document.file.name}').status_code, 404)
+
+    def test_last_modified_follows_the_stored_file(self):
+        from datetime import timedelta
+        from django.utils.http import http_date
+        from passages.models import StoredBlob
+
+        stored_at = self.document.uploaded_at + timedelta(days=3)  # e.g. the file was replaced later
+        StoredBlob.objects.filter(name=self.document.file.name).update(created_at=stored_at)
+        response = self.client.get(self.url)
+        self.assertEqual(response['Last-Modified'], http_date(int(stored_at.timestamp())))
+
+    def test_s3_redirect_is_signed(self):
+        from storages.backends.s3boto3 import S3Boto3Storage
+        from passages.downloads import _presigned_response
+
+        storage = S3Boto3Storage(
+            bucket_name='passages', access_key='key', secret_key='secret', region_name='us-east-1',
+            querystring_auth=False, custom_domain='cdn.example.com',
+        )
+        response = _presigned_response(storage, self.document)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(f'passages.s3.amazonaws.com/{self.document.file.name}?', response['Location'])
+        self.assertIn('Signature=', response['Location'])
+        self.assertIn('the-story.docx', response['Location'])
+
+
+class ResumableUploadTest(TestCase):
+    """Chunked uploads resume from the server's offset and finalize into a document"""
+
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        staging = tempfile.TemporaryDirectory()
+        self.addCleanup(staging.cleanup)
+        paths = override_settings(MEDIA_ROOT=staging.name + '/media', UPLOAD_STAGING_DIR=staging.name + '/staging')
+        paths.enable()
+        self.addCleanup(paths.disable)
+
+    def put_chunk(self, session_id, data, offset):
+        return self.client.put(f'/api/uploads/{session_id}/', data, content_type='application/offset+octet-stream',
+                               HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_chunks_resume_and_finalize(self):
+        import hashlib
+        from unittest import mock
+        from passages.benchmarks import make_docx_bytes
+        from passages.models import UploadedDocument
+
+        content = make_docx_bytes(20)
+        response = self.client.post('/api/uploads/', {
+            'filename': 'big.docx', 'size': len(content), 'sha256': hashlib.sha256(content).hexdigest(), 'title': 'Big',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        session_id = response.json()['id']
+
+        half = len(content) // 2
+        self.assertEqual(self.put_chunk(session_id, content[:half], 0).json()['offset'], half)
+        # A retried chunk at a stale offset is refused with the offset to resume from
+        conflict = self.put_chunk(session_id, content[:half], 0)
+        self.assertEqual((conflict.status_code, conflict.json()['offset']), (409, half))
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/finalize/').status_code, 409)
+
+        self.assertEqual(self.client.get(f'/api/uploads/{session_id}/').json()['offset'], half)
+        self.put_chunk(session_id, content[half:], half)
+        with mock.patch('passages.views.ensure_questions', return_value=0) as generate:
+            response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+            retried = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(retried.status_code, 200)
+        self.assertEqual(generate.call_count, 1)
+
+        document = UploadedDocument.objects.get()
+        self.assertEqual(document.title, 'Big')
+        self.assertEqual(document.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertTrue(document.parsed_text)
+        with document.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_hash_mismatch_is_rejected(self):
+        from passages.models import UploadedDocument
+
+        session_id = self.client.post('/api/uploads/', {
+            'filename': 'x.docx', 'size': 4, 'sha256': '0' * 64, 'title': 'X',
+        }, content_type='application/json').json()['id']
+        self.put_chunk(session_id, b'abcd', 0)
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadedDocument.objects.exists())
+
+    def test_racing_chunks_and_finalize_claims(self):
+        import io
+        from datetime import timedelta
+        from django.utils import timezone
+        from passages.models import UploadSession
+        from passages.uploads import UploadError, claim_session, commit_chunk, create_session, receive_chunk
+
+        session = create_session(None, 'race.docx', 4)
+        # Two clients send the chunk for offset 0; the bytes are written without a lock
+        first = receive_chunk(session, io.BytesIO(b'abcd'), 0, 4)
+        second = receive_chunk(session, io.BytesIO(b'wxyz'), 0, 4)
+        self.assertEqual(commit_chunk(UploadSession.objects.get(pk=session.pk), 0, *first), 4)
+        with self.assertRaises(UploadError) as raised:
+            commit_chunk(UploadSession.objects.get(pk=session.pk), 0, *second)
+        self.assertEqual(raised.exception.status, 409)
+
+        self.assertTrue(claim_session(session))
+        self.assertFalse(claim_session(UploadSession.objects.get(pk=session.pk)))
+        with self.assertRaises(UploadError):
+            receive_chunk(session, io.BytesIO(b''), 4, 0)  # no more chunks once finalizing
+        # A worker that died while finalizing doesn't block the upload for good
+        UploadSession.objects.filter(pk=session.pk).update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(claim_session(session))
+
+
+class ExtractionPoolTest(TestCase):
+    """Documents are parsed in worker processes that can fail without taking the caller down"""
+
+    def test_parses_rejects_and_recovers(self):
+        import io
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from passages.benchmarks import make_docx_bytes
+        from passages.extraction import ExtractionError, ExtractionPool, extract_docx_text, local_path
+
+        pool = ExtractionPool(workers=1, timeout=30, cpu_seconds=20, memory_bytes=0, tasks_per_child=2)
+        self.addCleanup(pool.shutdown)
+        content = make_docx_bytes(4)
+        expected = extract_docx_text(io.BytesIO(content))
+
+        # Workers are given a path, never the bytes
+        with local_path(SimpleUploadedFile('story.docx', content)) as path, \
+                local_path(SimpleUploadedFile('broken.docx', b'not a zip file')) as broken:
+            self.assertEqual(pool.extract(path), expected)
+            with self.assertRaises(ExtractionError):
+                pool.extract(broken)
+
+            # A worker that runs past the wall timeout is killed and the pool rebuilt
+            pool.timeout = 0
+            with self.assertRaises(ExtractionError):
+                pool.extract(path)
+            pool.timeout = 30
+            for _ in range(3):  # also past tasks_per_child
+                self.assertEqual(pool.extract(path), expected)
+
+    def test_unparseable_upload_is_a_400(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from passages.models import UploadedDocument
+
+        response = self.client.post('/api/documents/', {
+            'title': 'Broken', 'file': SimpleUploadedFile('broken.docx', b'not a zip file'),
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file', response.json())
+        self.assertFalse(UploadedDocument.objects.exists())
+
+
+class QuizSubmissionTest(TestCase):
+    """Submissions are scored with bulk lookups and can be journalled and flushed later"""
+
+    def setUp(self):
+        from unittest import mock
+        from passages.benchmarks import make_gemini_output
+        from passages.gemini_utils import generate_and_save_questions
+        from passages.models import UploadedDocument
+
+        self.document = UploadedDocument.objects.create(title='Quiz', file='documents/q.docx', parsed_text='Text.')
+        with mock.patch('passages.gemini_utils.generate_questions', return_value=make_gemini_output(3)):
+            generate_and_save_questions(self.document)
+        self.payload = {'document_id': self.document.id, 'user_name': 'Ada', 'answers': [
+            {'question_id': q.id, 'selected_answer_id': q.answers.get(is_correct=True).id if i else q.answers.filter(is_correct=False).first().id}
+            for i, q in enumerate(self.document.questions.order_by('id'))
+        ]}
+
+    def submit(self):
+        return self.client.post('/api/submit-quiz/', self.payload, content_type='application/json')
+
+    def test_direct_submission(self):
+        from passages.models import QuizResponse
+
+        with self.assertNumQueries(8):  # 4 lookups, then response + one bulk insert of answers in a savepoint
+            response = self.submit()
+        self.assertEqual(response.json()['score'], 2)
+        saved = QuizResponse.objects.get(id=response.json()['response_id'])
+        self.assertEqual(saved.user_answers.count(), 3)
+
+    def test_write_behind_journal_flushes_once(self):
+        import os
+        import tempfile
+        from django.test import override_settings
+        from passages.models import QuizResponse, UserAnswer
+        from passages.submissions import Submission, quiz_journal
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                override_settings(QUIZ_WRITE_BEHIND=True, QUIZ_JOURNAL_PATH=os.path.join(tmp, 'journal.sqlite3')):
+            response = self.submit()
+            self.assertEqual(response.json()['score'], 2)
+            self.assertIsNone(response.json()['response_id'])
+            self.assertFalse(QuizResponse.objects.exists())
+
+            journal = quiz_journal()
+            submitted = journal.pending(10)[0][1]
+            self.assertEqual(journal.flush(), (1, 1))
+            # Replay after a crash between insert and journal cleanup inserts nothing new
+            journal.append(Submission.from_json(submitted.to_json()))
+            self.assertEqual(journal.flush(), (1, 0))
+
+        saved = QuizResponse.objects.get()
+        self.assertEqual(str(saved.submission_id).replace('-', ''), submitted.submission_id)
+        self.assertEqual(saved.submitted_at.isoformat(), submitted.submitted_at)
+        self.assertEqual(UserAnswer.objects.filter(response=saved, is_correct=True).count(), 2)
+
+    def test_string_ids_are_accepted(self):
+        self.payload = {**self.payload, 'answers': [
+            {'question_id': str(a['question_id']), 'selected_answer_id': str(a['selected_answer_id'])}
+            for a in self.payload['answers']
+        ]}
+        self.assertEqual(self.submit().json()['score'], 2)
+
+        self.payload['answers'][0]['question_id'] = 'first'
+        response = self.submit()
+        self.assertEqual((response.status_code, response.json()['error']), (400, 'question_id must be an integer'))
+
+    def test_packed_submission(self):
+        from django.test import override_settings
+        from django.contrib.auth.models import User
+        from passages.models import QuizAnswer, QuizQuestion, QuizResponse, UserAnswer
+        from passages.packed_answers import answer_records, pack_answers, unpack_answers
+
+        with override_settings(QUIZ_PACK_ANSWERS=True), self.assertNumQueries(7):  # no answer INSERT
+            response = self.submit()
+        saved = QuizResponse.objects.get(id=response.json()['response_id'])
+        self.assertFalse(UserAnswer.objects.exists())
+        self.assertEqual(len(saved.packed_answers), 3 * 2)  # one-byte id delta + letter per answer
+        letters = dict(QuizAnswer.objects.values_list('id', 'choice_letter'))
+        self.assertEqual(answer_records(saved), [
+            (a['question_id'], letters[a['selected_answer_id']], i > 0) for i, a in enumerate(self.payload['answers'])
+        ])
+        self.assertEqual(sum(correct for _, _, correct in answer_records(saved)), saved.score)
+        self.client.force_login(User.objects.create_superuser('admin', password='pw'))
+        page = self.client.get(f'/admin/passages/quizresponse/{saved.id}/change/')
+        question_id, letter, _ = answer_records(saved)[1]
+        question = QuizQuestion.objects.get(id=question_id)
+        self.assertContains(page, f'<li>{question.question_text} &ndash; {letter} ✓</li>', html=True)
+        self.assertEqual(unpack_answers(*pack_answers([(900, 'B', True), (5, 'A', False), (70000, 'D', True)])),
+                         [(900, 'B', True), (5, 'A', False), (70000, 'D', True)])
+
+
+class IdempotencyKeyTest(TestCase):
+    """Retries with the same Idempotency-Key replay the first response"""
+
+    def test_submit_quiz_retries_create_one_response(self):
+        from unittest import mock
+        from passages.benchmarks import make_gemini_output
+        from passages.gemini_utils import generate_and_save_questions
+        from passages.models import QuizResponse, UploadedDocument
+
+        document = UploadedDocument.objects.create(title='Quiz', file='documents/q.docx', parsed_text='Text.')
+        with mock.patch('passages.gemini_utils.generate_questions', return_value=make_gemini_output(2)):
+            generate_and_save_questions(document)
+        question = document.questions.first()
+        payload = {'document_id': document.id, 'answers': [
+            {'question_id': question.id, 'selected_answer_id': question.answers.first().id},
+        ]}
+
+        def submit(data):
+            return self.client.post('/api/submit-quiz/', data, content_type='application/json',
+                                    HTTP_IDEMPOTENCY_KEY='attempt-1')
+
+        first, retry = submit(payload), submit(payload)
+        self.assertEqual(first.json(), retry.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(QuizResponse.objects.count(), 1)
+
+        self.assertEqual(submit({**payload, 'user_name': 'Someone else'}).status_code, 422)
+
+    def test_upload_retry_returns_the_first_document(self):
+        import tempfile
+        from unittest import mock
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+        from passages.benchmarks import make_docx_bytes
+        from passages.models import UploadedDocument
+
+        content = make_docx_bytes(2)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                mock.patch('passages.views.ensure_questions', return_value=0) as generate:
+            responses = [
+                self.client.post('/api/documents/', {
+                    'title': 'Retried', 'file': SimpleUploadedFile('r.docx', content),
+                }, HTTP_IDEMPOTENCY_KEY='upload-1')
+                for _ in range(2)
+            ]
+        self.assertEqual([r.status_code for r in responses], [201, 201])
+        self.assertEqual(responses[0].json()['id'], responses[1].json()['id'])
+        self.assertEqual(UploadedDocument.objects.count(), 1)
+        self.assertEqual(generate.call_count, 1)
+
+        # Same name and size, different bytes: not the same request
+        changed = content[:-1] + bytes([content[-1] ^ 1])
+        response = self.client.post('/api/documents/', {
+            'title': 'Retried', 'file': SimpleUploadedFile('r.docx', changed),
+        }, HTTP_IDEMPOTENCY_KEY='upload-1')
+        self.assertEqual(response.status_code, 422)
+
+    def test_retry_takes_over_after_the_lease(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from passages.idempotency import claim
+        from passages.models import IdempotencyKey
+
+        record, created = claim('attempt-1', 'quiz.submit:anonymous', 'f' * 64)
+        self.assertTrue(created)
+        self.assertEqual(claim('attempt-1', 'quiz.submit:anonymous', 'f' * 64), (record, False))  # still running: 409
+
+        # The first attempt's worker died without finishing
+        IdempotencyKey.objects.filter(pk=record.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(claim('attempt-1', 'quiz.submit:anonymous', 'e' * 64)[1], False)  # other payload: 422
+        taken, created = claim('attempt-1', 'quiz.submit:anonymous', 'f' * 64)
+        self.assertTrue(created)
+        self.assertEqual(taken.pk, record.pk)
+        self.assertFalse(claim('attempt-1', 'quiz.submit:anonymous', 'f' * 64)[1])
+
+
+class ResponseExportTest(TestCase):
+    """Quiz results stream out as CSV or NDJSON, filtered and scoped to the teacher"""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from passages.models import QuizAnswer, QuizQuestion, QuizResponse, UploadedDocument, UserAnswer
+
+        self.teacher = User.objects.create_user('teacher', password='pw')
+        mine = UploadedDocument.objects.create(title='Mine', file='documents/m.docx', uploader=self.teacher)
+        other = UploadedDocument.objects.create(title='Other', file='documents/o.docx')
+        for document in (mine, other):
+            question = QuizQuestion.objects.create(document=document, question_text='Why, "really"?')
+            answer = QuizAnswer.objects.create(question=question, choice_letter='A', choice_text='x', is_correct=True)
+            for name in ('Ada', 'Bo'):
+                response = QuizResponse.objects.create(document=document, user_name=name, score=1, total_questions=1)
+                UserAnswer.objects.create(response=response, question=question, selected_answer=answer, is_correct=True)
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_and_ndjson_exports(self):
+        import csv
+        import io
+        import json
+
+        self.assertEqual(self.client.get('/api/responses/export/').status_code, 403)
+        self.client.force_login(self.teacher)
+
+        response = self.client.get('/api/responses/export/')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(self.content(response))))
+        self.assertEqual([row['user_name'] for row in rows], ['Ada', 'Bo'])  # only this teacher's document
+        self.assertEqual(rows[0]['question_text'], 'Why, "really"?')
+
+        response = self.client.get('/api/responses/export/', {'format': 'ndjson', 'user_name': 'Bo', 'rows': 'responses'})
+        lines = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual((lines[0]['document_title'], lines[0]['score']), ('Mine', 1))
+
+        self.assertEqual(self.client.get('/api/responses/export/', {'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/responses/export/', {'document': 'abc'}).status_code, 400)
+
+    def test_compacted_answers_export_unchanged(self):
+        from datetime import timedelta
+        from io import StringIO
+        from django.core.management import call_command
+        from django.utils import timezone
+        from passages.models import QuizResponse, UserAnswer
+
+        self.client.force_login(self.teacher)
+        QuizResponse.objects.update(submitted_at=timezone.now() - timedelta(days=60))
+        before = self.content(self.client.get('/api/responses/export/'))
+        QuizResponse.objects.create(document_id=QuizResponse.objects.first().document_id, score=0, total_questions=1)
+
+        out = StringIO()
+        call_command('compact_user_answers', stdout=out)
+        self.assertIn('Packed 4 response(s), removed 4 UserAnswer row(s)', out.getvalue())
+        self.assertFalse(UserAnswer.objects.exists())
+        self.assertEqual(QuizResponse.objects.filter(packed_answers__isnull=True).count(), 1)  # the recent one
+        self.assertEqual(self.content(self.client.get('/api/responses/export/')), before)
+
+
+class NearDuplicateQuestionTest(TestCase):
+    """Near-identical questions are flagged (or dropped) at insert time and by dedupe_questions"""
+
+    def setUp(self):
+        from passages import near_duplicates
+        from passages.models import UploadedDocument
+
+        near_duplicates._index = None  # test databases reuse ids
+        self.first = UploadedDocument.objects.create(title='First', file='documents/1.docx')
+        self.second = UploadedDocument.objects.create(title='Second', file='documents/2.docx')
+
+    def parsed(self, *texts):
+        return [{'question_text': text, 'answers': [
+            {'choice_letter': 'A', 'choice_text': 'yes', 'is_correct': True},
+            {'choice_letter': 'B', 'choice_text': 'no', 'is_correct': False},
+        ]} for text in texts]
+
+    def test_flag_and_drop_on_save(self):
+        from django.test import override_settings
+        from passages.gemini_utils import save_parsed_questions
+
+        main_idea = 'What is the main idea of the passage about migrating frogs in spring?'
+        save_parsed_questions(self.first, self.parsed(main_idea, 'Why did the author mention the river?'))
+        original = self.first.questions.get(question_text=main_idea)
+
+        save_parsed_questions(self.second, self.parsed(
+            'What is the main idea of the passage about the migrating frogs in spring?',
+            'Which word best describes the old lighthouse keeper?',
+            'Which word best describes the old lighthouse keeper ?',
+        ))
+        flagged = dict(self.second.questions.order_by('id').values_list('question_text', 'duplicate_of'))
+        self.assertEqual(list(flagged.values())[0], original.id)  # across documents
+        self.assertIsNone(list(flagged.values())[1])
+        self.assertEqual(list(flagged.values())[2], self.second.questions.order_by('id')[1].id)  # within the batch
+
+        with override_settings(QUESTION_DUPLICATES='drop'):
+            save_parsed_questions(self.first, self.parsed('what is the main idea of the passage about migrating frogs in spring'))
+        self.assertEqual(self.first.questions.count(), 2)
+
+    def test_dedupe_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from passages.models import QuizQuestion, QuizResponse
+        from passages.packed_answers import pack_answers
+
+        texts = ['Who wrote the letter to the mayor about the park?', 'Who wrote the letter to the mayor about the parks?',
+                 'How many apples did Sam pick on Tuesday?', 'Who wrote a letter to the mayor about the park?',
+                 'Who wrote the letter to the mayor about the park ?']
+        questions = [QuizQuestion.objects.create(document=self.first if i in (0, 3, 4) else self.second, question_text=text)
+                     for i, text in enumerate(texts)]
+        packed_answers, correct_mask = pack_answers([(questions[4].id, 'A', True)])
+        QuizResponse.objects.create(document=self.first, score=1, total_questions=1,
+                                    packed_answers=packed_answers, correct_mask=correct_mask)
+        out = StringIO()
+        call_command('dedupe_questions', '--delete', stdout=out)
+        self.assertIn('3 near-duplicate(s) of 1 question(s) among 5', out.getvalue())
+        self.assertEqual(QuizQuestion.objects.get(id=questions[1].id).duplicate_of_id, questions[0].id)
+        self.assertFalse(QuizQuestion.objects.filter(id=questions[3].id).exists())  # same document, unanswered
+        self.assertTrue(QuizQuestion.objects.filter(id=questions[4].id).exists())  # answered in a packed response
+        self.assertFalse(QuizQuestion.objects.filter(minhash__isnull=True).exists())
+
+    def test_index_picks_up_late_commits(self):
+        from passages.models import QuizQuestion
+        from passages.near_duplicates import QuestionIndex, signatures
+
+        def add(text, signed=True):
+            return QuizQuestion.objects.create(document=self.first, question_text=text,
+                                               minhash=signatures([text])[0].tobytes() if signed else None)
+
+        index = QuestionIndex()
+        add('Why did the fox cross the river?')
+        late = add('Where did the heron build its nest?', signed=False)  # like a row whose transaction is still open
+        add('When did the first snow fall?')
+        index.refresh()
+        self.assertEqual(len(index.ids), 2)
+        QuizQuestion.objects.filter(id=late.id).update(minhash=signatures([late.question_text])[0].tobytes())
+        index.refresh()
+        self.assertEqual(sorted(index.ids.tolist()), sorted(QuizQuestion.objects.values_list('id', flat=True)))
+        self.assertEqual(index.gaps, [])
+        self.assertEqual(index.lookup(signatures([late.question_text]), 0.9)[0][0][0], late.id)
+
+
+class QuestionImportTest(TestCase):
+    """Question banks import in bulk with per-row errors"""
+
+    def test_csv_and_ndjson_import(self):
+        import json
+        from django.contrib.auth.models import User
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from passages.models import QuizAnswer, QuizQuestion, UploadedDocument
+
+        document = UploadedDocument.objects.create(title='Bank', file='documents/b.docx')
+        csv_bank = (
+            'document_id,question_text,explanation,A,B,C,D,answer\n'
+            f'{document.id},"What is 2+2, exactly?",Basic sums,3,4,5,,B\n'
+            f'{document.id},No answer given,,yes,no,,,\n'
+            f'999,Unknown document,,a,b,,,A\n'
+        )
+        staff = User.objects.create_user('editor', password='pw', is_staff=True)
+        upload = SimpleUploadedFile('bank.csv', csv_bank.encode('utf-8-sig'), content_type='text/csv')
+        self.assertEqual(self.client.post('/api/questions/import/', {'file': upload}).status_code, 403)
+
+        self.client.force_login(staff)
+        upload.seek(0)
+        result = self.client.post('/api/questions/import/', {'file': upload}).json()
+        self.assertEqual(result['imported'], 1)
+        self.assertEqual([e['line'] for e in result['errors']], [3, 4])
+        question = QuizQuestion.objects.get()
+        self.assertEqual((question.question_text, question.explanation), ('What is 2+2, exactly?', 'Basic sums'))
+        self.assertEqual(list(question.answers.order_by('choice_letter').values_list('choice_letter', 'is_correct')),
+                         [('A', False), ('B', True), ('C', False)])
+
+        lines = [json.dumps({'document_id': document.id, 'question_text': f'Q{i}', 'A': 'x', 'B': 'y', 'answer': 'a'})
+                 for i in range(5)] + ['{not json']
+        upload = SimpleUploadedFile('bank.ndjson', '\n'.join(lines).encode())
+        with self.assertNumQueries(8):  # session, user, document check, near-duplicate index refresh, then one INSERT each for questions and answers in a savepoint
+            result = self.client.post('/api/questions/import/', {'file': upload}).json()
+        self.assertEqual((result['imported'], result['error_count']), (5, 1))
+        self.assertEqual(QuizAnswer.objects.count(), 3 + 10)
+
+        latin1 = f'document_id,question_text,A,B,answer\n{document.id},Caf\xe9?,x,y,A\n{document.id},Tea?,x,y,B\n'.encode('latin-1')
+        result = self.client.post('/api/questions/import/', {'file': SimpleUploadedFile('bank.csv', latin1)}).json()
+        self.assertEqual((result['imported'], result['errors']), (1, [{'line': 2, 'error': 'not valid UTF-8'}]))
+
+        with self.settings(QUESTION_IMPORT_MAX_UPLOAD=10):
+            response = self.client.post('/api/questions/import/', {'file': SimpleUploadedFile('bank.csv', csv_bank.encode())})
+        self.assertEqual(response.status_code, 413)
+
+
+class AdminChangelistTest(TestCase):
+    """Admin changelists cost a fixed number of queries per page, however many rows there are"""
+
+    MAX_QUERIES = 8
+    CHANGELISTS = ['uploadeddocument', 'quizquestion', 'quizanswer', 'quizresponse', 'useranswer']
+    # Tables that grow with usage: besides the page being listed, only counted or read by WHERE
+    LARGE_TABLES = ['passages_uploadeddocument', 'passages_quizquestion', 'passages_quizanswer',
+                    'passages_quizresponse', 'passages_useranswer']
+
+    def add_quizzes(self, count):
+        from passages.models import GradeLevel, QuizAnswer, QuizQuestion, QuizResponse, UploadedDocument, UserAnswer
+
+        grade, _ = GradeLevel.objects.get_or_create(name='5th Grade')
+        for i in range(count):
+            document = UploadedDocument.objects.create(title=f'Passage {i}', file='', parsed_text='Text.', grade_level=grade)
+            response = QuizResponse.objects.create(document=document, user_name=f'Student {i}', score=1, total_questions=2)
+            for j in range(2):
+                question = QuizQuestion.objects.create(document=document, question_text=f'Question {j} about passage {i}?',
+                                                       duplicate_of=question if j else None)
+                answers = [QuizAnswer.objects.create(question=question, choice_letter=letter, choice_text=letter, is_correct=letter == 'A')
+                           for letter in 'ABCD']
+                UserAnswer.objects.create(response=response, question=question, selected_answer=answers[j], is_correct=j == 0)
+        return document
+
+    def query_counts(self, params=None):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        counts = {}
+        for model_name in self.CHANGELISTS:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f'/admin/passages/{model_name}/', params or {})
+            self.assertEqual(response.status_code, 200, model_name)
+            counts[model_name] = len(queries)
+            for query in queries:
+                sql = query['sql']
+                table = sql.split(' FROM ', 1)[-1].split()[0].strip('"')
+                if sql.startswith('SELECT') and table in self.LARGE_TABLES and table != f'passages_{model_name}':
+                    self.assertTrue('COUNT(' in sql or ' WHERE ' in sql, f'{model_name}: {sql}')
+        return counts
+
+    def test_queries_do_not_grow_with_rows(self):
+        from django.contrib.auth.models import User
+
+        self.client.force_login(User.objects.create_superuser('admin', password='pw'))
+        self.add_quizzes(2)
+        self.query_counts()  # warm per-process caches (content types, reference tables)
+        few = self.query_counts()
+        document = self.add_quizzes(10)
+        self.assertEqual(self.query_counts(), few)
+        self.assertTrue(all(count <= self.MAX_QUERIES for count in few.values()), few)
+
+        response = self.client.get('/admin/passages/quizquestion/', {'document__id__exact': document.id})
+        self.assertContains(response, 'class="admin-autocomplete"')
+        self.assertContains(response, f'<option value="{document.id}" selected>{document.title}</option>', html=True)
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertIsNone(response.context['cl'].full_result_count)
+
+        found = self.client.get('/admin/autocomplete/', {
+            'app_label': 'passages', 'model_name': 'useranswer', 'field_name': 'response', 'term': 'x',
+        })
+        self.assertEqual(found.status_code, 200)
+        found = self.client.get('/admin/autocomplete/', {
+            'app_label': 'passages', 'model_name': 'quizquestion', 'field_name': 'document', 'term': document.title,
+        }).json()
+        self.assertEqual([r['text'] for r in found['results']], [document.title])
+
@@ -0,0 +1,78 @@
+"""
+Passage text statistics, computed once when a document is parsed.
+
+    word_count         words (runs of letters/digits, apostrophes allowed)
+    sentence_count     runs of . ! ? (and line breaks after unterminated text), at least 1
+    reading_minutes    word_count / READING_WPM, rounded up
+    readability_grade  Flesch-Kincaid grade level:
+                       0.39 * words/sentence + 11.8 * syllables/word - 15.59
+
+Syllables are estimated per word as vowel groups, minus a silent final "e"
+(but not "-le"), at least one per word. Counting is done with whole-text
+regex passes, so a text costs a few C-level scans, and the formulas run on
+NumPy arrays for many documents at once (see `manage.py compute_text_stats`).
+"""
+
+import re
+
+import numpy as np
+
+READING_WPM = 200  # words per minute for reading_minutes
+
+STAT_FIELDS = ['word_count', 'sentence_count', 'reading_minutes', 'readability_grade']
+
+_word = re.compile(r"[^\W_]+(?:'[^\W_]+)*")
+# A run of . ! ? before whitespace, or the end of a line (paragraph) that has no such ending
+_sentence_end = re.compile(r"[.!?]+(?=\s|$)|[^\s.!?][ \t]*$", re.MULTILINE)
+_vowel_group = re.compile(r"[aeiouy]+")
+_silent_e = re.compile(r"\b\w*[aeiouy]\w*[^\W\daeiouyl]e\b")  # make, stone (not the, free, table)
+_vowelless_word = re.compile(r"(?<![\w'])[^\Waeiouy]+(?![\w'])")  # numbers, "nth": one syllable each
+
+
+def count_text(text):
+    """(words, sentences, syllables) of a text"""
+    text = (text or '').lower()
+    words = len(_word.findall(text))
+    if not words:
+        return 0, 0, 0
+    sentences = len(_sentence_end.findall(text))
+    syllables = len(_vowel_group.findall(text)) - len(_silent_e.findall(text)) + len(_vowelless_word.findall(text))
+    return words, max(sentences, 1), max(syllables, words)
+
+
+def stats_from_counts(words, sentences, syllables):
+    """
+    Vectorized: arrays of counts -> dict of STAT_FIELDS arrays
+    (readability_grade is NaN where there are no words)
+    """
+    words = np.asarray(words, dtype=np.float64)
+    sentences = np.maximum(np.asarray(sentences, dtype=np.float64), 1)
+    syllables = np.asarray(syllables, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grade = 0.39 * words / sentences + 11.8 * syllables / words - 15.59
+    return {
+        'word_count': words.astype(np.int64),
+        'sentence_count': np.where(words > 0, sentences, 0).astype(np.int64),
+        'reading_minutes': np.ceil(words / READING_WPM).astype(np.int64),
+        'readability_grade': np.where(words > 0, np.round(grade, 1), np.nan),
+    }
+
+
+def text_stats_many(texts):
+    """List of {field: value} dicts for `texts`; all None for a missing text"""
+    counts = np.array([count_text(text) for text in texts], dtype=np.int64).reshape(-1, 3)
+    stats = stats_from_counts(counts[:, 0], counts[:, 1], counts[:, 2])
+    return [
+        dict.fromkeys(STAT_FIELDS) if text is None else {
+            'word_count': int(stats['word_count'][i]),
+            'sentence_count': int(stats['sentence_count'][i]),
+            'reading_minutes': int(stats['reading_minutes'][i]),
+            'readability_grade': None if np.isnan(stats['readability_grade'][i]) else float(stats['readability_grade'][i]),
+        }
+        for i, text in enumerate(texts)
+    ]
+
+
+def text_stats(text):
+    """{field: value} for one parsed text, to save alongside it"""
+    return text_stats_many([text])[0]
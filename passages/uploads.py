@@ -0,0 +1,194 @@
+"""
+Resumable chunked uploads.
+
+Protocol (all under /api/uploads/):
+- POST      create a session: {filename, size, sha256?, title, grade_level?, skill_category?}
+- PUT <id>  append a chunk; the Upload-Offset header must equal the bytes
+            received so far (409 with the current offset otherwise)
+- GET <id>  current offset, so an interrupted client knows where to resume
+- POST <id>/finalize/  verify size and hash, then create the UploadedDocument
+- DELETE <id>  abandon the upload
+
+Chunk bodies are streamed to a temporary file rather than read into memory,
+and whatever part of an interrupted chunk arrived is kept. The session row is
+only locked for the bookkeeping after a chunk has arrived: check the offset,
+move the chunk into place as the part starting at that offset, and advance
+`received`. Two clients racing at the same offset both write their own file;
+the second one to finish gets a 409.
+
+Finalizing claims the session (status receiving -> finalizing, with a lease
+of UPLOAD_FINALIZE_TIMEOUT seconds in case the worker dies) and then
+assembles, checks and stores the file without holding any lock. The staged
+file is handed to the normal document creation flow (parse, store blob).
+"""
+
+import os
+import shutil
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.db.models import F, Q
+
+from .models import UploadSession
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """A chunk or session request that can't be accepted; carries the HTTP status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def staging_dir(session):
+    return os.path.join(settings.UPLOAD_STAGING_DIR, session.pk.hex)
+
+
+def part_path(session, offset):
+    return os.path.join(staging_dir(session), f'{offset:015d}.part')
+
+
+def staging_path(session):
+    """The assembled file, written by assemble_staging_file()"""
+    return os.path.join(staging_dir(session), 'assembled')
+
+
+def create_session(uploader, filename, size, sha256='', metadata=None):
+    if not filename.lower().endswith('.docx'):
+        raise UploadError('Only .docx files can be uploaded.')
+    if size <= 0 or size > settings.UPLOAD_MAX_SIZE:
+        raise UploadError(f'size must be between 1 and {settings.UPLOAD_MAX_SIZE} bytes.', status=413)
+    session = UploadSession.objects.create(
+        uploader=uploader, filename=os.path.basename(filename), size=size, sha256=sha256.lower(),
+        metadata=metadata or {},
+        expires_at=timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL),
+    )
+    os.makedirs(staging_dir(session), exist_ok=True)
+    return session
+
+
+def _check_chunk(session, offset, length):
+    if session.status != UploadSession.RECEIVING:
+        raise UploadError('Upload is already finalized.', status=409)
+    if offset != session.received:
+        raise UploadError('Offset does not match the bytes received.', status=409)
+    if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadError(f'Chunks are limited to {settings.UPLOAD_CHUNK_MAX_SIZE} bytes.', status=413)
+    if offset + length > session.size:
+        raise UploadError('Chunk goes past the declared file size.')
+
+
+def receive_chunk(session, stream, offset, length):
+    """
+    Stream up to `length` bytes of a chunk into a temporary file in the
+    session's staging directory. No lock is held; commit_chunk() decides
+    whether the chunk is kept.
+
+    Returns:
+        (path, written): the temporary file and the number of bytes that arrived
+    """
+    _check_chunk(session, offset, length)
+    os.makedirs(staging_dir(session), exist_ok=True)
+    path = os.path.join(staging_dir(session), f'{uuid.uuid4().hex}.tmp')
+    written = 0
+    with open(path, 'wb') as f:
+        while written < length and stream is not None:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data:
+                break  # client went away: keep what arrived
+            f.write(data)
+            written += len(data)
+    return path, written
+
+
+def commit_chunk(session, offset, path, written):
+    """
+    Keep a chunk written by receive_chunk() as the part at `offset`, if the
+    session is still waiting for that offset. The session row must be locked
+    by the caller.
+
+    Returns:
+        int: the new offset (bytes received)
+    """
+    try:
+        _check_chunk(session, offset, written)
+    except UploadError:
+        os.remove(path)
+        raise
+    if written:
+        # Replaces a part left behind by an earlier attempt that didn't commit
+        os.replace(path, part_path(session, offset))
+    else:
+        os.remove(path)
+    session.received = offset + written
+    session.expires_at = timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    session.save(update_fields=['received', 'expires_at'])
+    return session.received
+
+
+def claim_session(session):
+    """
+    Flip a complete session to finalizing, unless another request holds a
+    live claim. Returns True if this caller now owns the finalization.
+    """
+    now = timezone.now()
+    claimed = UploadSession.objects.filter(
+        Q(status=UploadSession.RECEIVING) | Q(status=UploadSession.FINALIZING, claimed_until__lt=now),
+        pk=session.pk, received=F('size'),
+    ).update(status=UploadSession.FINALIZING, claimed_until=now + timedelta(seconds=settings.UPLOAD_FINALIZE_TIMEOUT))
+    session.refresh_from_db()
+    return claimed == 1
+
+
+def release_session(session):
+    """Give up a finalize claim (e.g. the file failed validation)"""
+    UploadSession.objects.filter(pk=session.pk, status=UploadSession.FINALIZING).update(
+        status=UploadSession.RECEIVING, claimed_until=None,
+    )
+
+
+def finish_session(session, document):
+    """Record the document a claimed session was finalized into and drop the staged chunks"""
+    session.status = UploadSession.FINALIZED
+    session.document = document
+    session.claimed_until = None
+    session.save(update_fields=['status', 'document', 'claimed_until'])
+    discard_staging_file(session)
+
+
+def assemble_staging_file(session):
+    """
+    Concatenate the session's parts into staging_path(session).
+
+    Raises:
+        UploadError: the parts don't add up to the declared size
+    """
+    with open(staging_path(session), 'wb') as out:
+        for name in sorted(os.listdir(staging_dir(session))):
+            if not name.endswith('.part') or int(name[:-5]) != out.tell():
+                continue
+            with open(os.path.join(staging_dir(session), name), 'rb') as part:
+                shutil.copyfileobj(part, out)
+        size = out.tell()
+    if size != session.size:
+        raise UploadError('Staged chunks are missing; start a new upload', status=409)
+    return staging_path(session)
+
+
+def discard_staging_file(session):
+    shutil.rmtree(staging_dir(session), ignore_errors=True)
+
+
+def clear_expired_sessions():
+    """Delete sessions past their expiry and any staging files they left; returns how many"""
+    expired = UploadSession.objects.filter(expires_at__lt=timezone.now())
+    count = 0
+    for session in expired.iterator():
+        discard_staging_file(session)
+        session.delete()
+        count += 1
+    return count
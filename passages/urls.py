@@ -7,7 +7,9 @@ from rest_framework import routers
 from .views import (
     SubmitQuizView, UserRegistrationView, UserLoginView, UserLogoutView, UserProfileView,
     UploadedDocumentViewSet, QuizQuestionViewSet, QuizAnswerViewSet,
-    QuizResponseViewSet, GradeLevelViewSet, SkillCategoryViewSet, DocumentDetailView
+    QuizResponseViewSet, GradeLevelViewSet, SkillCategoryViewSet, DocumentDetailView, DocumentTextView,
+    stream_document_questions, download_document,
+    UploadSessionView, UploadSessionDetailView, UploadSessionFinalizeView,
 )
 
 # CSRF ping for frontend
@@ -34,6 +36,12 @@ urlpatterns = [
     # API endpoints
     path('api/', include(router.urls)),  # /api/documents/, /api/questions/, etc.
     path('api/documents/<int:pk>/detail/', DocumentDetailView.as_view(), name='document_detail'),
+    path('api/documents/<int:pk>/text/', DocumentTextView.as_view(), name='document_text'),
+    path('api/documents/<int:pk>/questions/stream/', stream_document_questions, name='document_questions_stream'),
+    path('api/documents/<int:pk>/download/', download_document, name='document_download'),
+    path('api/uploads/', UploadSessionView.as_view(), name='upload_session_create'),
+    path('api/uploads/<uuid:pk>/', UploadSessionDetailView.as_view(), name='upload_session'),
+    path('api/uploads/<uuid:pk>/finalize/', UploadSessionFinalizeView.as_view(), name='upload_session_finalize'),
     path('api/submit-quiz/', SubmitQuizView.as_view(), name='submit_quiz'),
     path('api/auth/register/', UserRegistrationView.as_view(), name='user_register'),
     path('api/auth/login/',    UserLoginView.as_view(),       name='user_login'),
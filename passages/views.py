@@ -4,29 +4,80 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control, never_cache
+from django.views.decorators.vary import vary_on_headers
 from django.middleware.csrf import get_token
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404, StreamingHttpResponse
+from django.views.decorators.http import require_GET, require_safe
+from django.conf import settings
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db import transaction
+from django.db.models import Prefetch
+from django.core.files import File
 from passages.models import (
     UploadedDocument, QuizQuestion, QuizAnswer,
-    QuizResponse, UserAnswer, GradeLevel, SkillCategory
+    QuizResponse, UserAnswer, GradeLevel, SkillCategory, UploadSession
 )
 from django import forms
-from docx import Document
 from .forms import UploadedDocumentForm
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action as drf_action
 from rest_framework.views import APIView
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from .serializers import (
-    UploadedDocumentSerializer, QuizQuestionSerializer, QuizAnswerSerializer,
+    UploadedDocumentSerializer, DocumentListSerializer, QuizQuestionSerializer, QuizAnswerSerializer,
     QuizResponseSerializer, DocumentDetailSerializer, GradeLevelSerializer, 
     SkillCategorySerializer, UserRegistrationSerializer, UserSerializer
 )
 import json
+import math
+import time
+import uuid
+from .renderers import CSVRenderer, NDJSONRenderer
+from .exports import csv_stream, export_rows, ndjson_stream
+from .facets import facet_counts
+from .question_import import FORMATS as IMPORT_FORMATS, format_for, import_file as import_question_file
+from .read_serializers import document_detail_data, document_list_data, question_list_data
+from .reference_cache import grade_levels, skill_categories
 from .authentication import CsrfExemptSessionAuthentication
 import os
-from passages.gemini_utils import generate_questions, parse_questions, save_parsed_questions
+from passages.gemini_utils import (
+    generate_questions, regenerate_changed_sections,
+    stream_and_save_questions, QuestionGenerationError,
+)
+from .blobs import release_blob, store_blob
+from .idempotency import idempotent
+from .submissions import quiz_journal, save_submission, score_submission
+from .paging import paragraph_offsets, read_page
+from .text_stats import text_stats
+from .downloads import can_download, serve_document_file
+from .extraction import ExtractionError, hash_file, read_upload
+from .uploads import (
+    UploadError, assemble_staging_file, claim_session, commit_chunk, create_session as create_upload_session,
+    discard_staging_file, finish_session, receive_chunk, release_session,
+)
+from .single_flight import (
+    acquire as acquire_generation_lock, release as release_generation_lock,
+    is_locked as is_generation_locked, ensure_questions, generation_lock,
+)
+
+
+# Cache-Control policies for API responses. Content negotiation means the
+# same URL can be JSON or the browsable API, hence Vary: Accept.
+# Reference data rarely changes -> cacheable by browsers and shared caches
+reference_data_cache = [
+    cache_control(public=True, max_age=settings.REFERENCE_DATA_MAX_AGE),
+    vary_on_headers('Accept'),
+]
+# Documents/questions change when edited -> clients revalidate with the ETag (304 if unchanged)
+revalidate_cache = [
+    cache_control(private=True, no_cache=True),
+    vary_on_headers('Accept'),
+]
 
 
 # Traditional Django views (for template-based pages)
@@ -37,27 +88,22 @@ def upload_document(request):
     if request.method == 'POST':
         form = UploadedDocumentForm(request.POST, request.FILES)
         if form.is_valid():
-            uploaded_doc = form.save()
-
-            doc = Document(uploaded_doc.file)
-            parsed_content = "\n".join([p.text for p in doc.paragraphs])
-            uploaded_doc.parsed_text = parsed_content
-
+            upload = form.cleaned_data['file']
             try:
-                print("Generating quiz questions with Gemini...")
-                questions_text = generate_questions(parsed_content[:3000])
-                print("Raw Gemini output:\n", questions_text)
-
-                parsed_questions = parse_questions(questions_text)
-                print("Parsed questions list:\n", parsed_questions)
-
-                save_parsed_questions(uploaded_doc, parsed_questions)
-                print("Quiz Questions saved to DB.")
-
-            except Exception as e:
-                print("Quiz generation failed:", str(e))
-
-            uploaded_doc.save()
+                parsed_content, content_hash = read_upload(upload)
+            except ExtractionError as e:
+                form.add_error('file', str(e))
+                return render(request, 'passages/upload_form.html', {'form': form})
+            uploaded_doc = form.save(commit=False)
+            uploaded_doc.parsed_text = parsed_content
+            uploaded_doc.content_hash = content_hash
+            for field, value in text_stats(parsed_content).items():
+                setattr(uploaded_doc, field, value)
+            uploaded_doc.paragraph_offsets = paragraph_offsets(parsed_content)
+            with transaction.atomic():
+                uploaded_doc.file = store_blob(upload, content_hash)
+                uploaded_doc.save()
+            generate_document_questions(uploaded_doc)
 
             return render(request, 'passages/upload_success.html', {
                 'document': uploaded_doc,
@@ -87,64 +133,460 @@ def generate_questions_for_document(request, document_id):
     return JsonResponse({'questions': questions})
 
 
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {JSONRenderer().render(data).decode()}\n\n"
+
+
+@require_GET
+def stream_document_questions(request, pk):
+    """
+    Server-sent events stream of a document's quiz questions.
+
+    Existing questions are sent straight away. Otherwise questions are generated
+    with a streamed Gemini response and each one is saved and pushed as soon as
+    its answer line arrives. If another request is already generating them,
+    this stream relays that generation's questions instead of starting another.
+    Events: `question` (QuizQuestionSerializer data), then `done`
+    ({count, generated}) or `error` ({error}). Requires a logged-in user.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    document = get_object_or_404(UploadedDocument, pk=pk)
+
+    def events():
+        yield ": connected\n\n"  # flush headers so the client knows the stream is open
+
+        sent = set()
+
+        def new_questions():
+            for question in document.questions.exclude(id__in=sent).order_by('id').prefetch_related('answers'):
+                sent.add(question.id)
+                yield sse_event('question', QuizQuestionSerializer(question).data)
+
+        owner = uuid.uuid4().hex
+        if not acquire_generation_lock(document, owner):
+            # Someone else is generating: relay their questions as they are saved
+            deadline = time.monotonic() + settings.GENERATION_WAIT_TIMEOUT
+            while is_generation_locked(document) and time.monotonic() < deadline:
+                yield from new_questions()
+                time.sleep(0.5)
+            yield from new_questions()
+            yield sse_event('done', {'count': len(sent), 'generated': False})
+            return
+
+        try:
+            yield from new_questions()
+            if sent:
+                yield sse_event('done', {'count': len(sent), 'generated': False})
+                return
+            try:
+                for question in stream_and_save_questions(document):
+                    sent.add(question.id)
+                    yield sse_event('question', QuizQuestionSerializer(question).data)
+            except QuestionGenerationError as e:
+                yield sse_event('error', {'error': str(e)})
+                return
+            yield sse_event('done', {'count': len(sent), 'generated': True})
+        finally:
+            release_generation_lock(document, owner)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx from buffering the stream
+    return response
+
+
+@require_safe
+def download_document(request, pk):
+    """
+    Download a document's file. Access is checked here; the transfer itself is
+    handed to S3 (presigned URL) or the web server (X-Accel-Redirect /
+    X-Sendfile), see downloads.py.
+    """
+    document = get_object_or_404(
+        UploadedDocument.objects.only('id', 'title', 'file', 'content_hash', 'uploaded_at', 'uploader_id'), pk=pk
+    )
+    if not document.file:
+        raise Http404("Document has no file")
+    if not can_download(request.user, document):
+        status_code = 403 if request.user.is_authenticated else 401
+        return JsonResponse({'error': 'You are not allowed to download this document.'}, status=status_code)
+    return serve_document_file(request, document)
+
+
+def read_upload_or_400(upload):
+    """read_upload, with unparseable files reported as a validation error on `file`"""
+    try:
+        return read_upload(upload)
+    except ExtractionError as e:
+        raise ValidationError({'file': [str(e)]})
+
+
+def save_uploaded_document(serializer, user):
+    """
+    Save a validated UploadedDocumentSerializer: parse and hash the upload
+    before it goes to storage (no read-back from S3), store it content-addressed
+    (see blobs.py) and create the document.
+    """
+    upload = serializer.validated_data['file']
+    parsed_text, content_hash = read_upload_or_400(upload)
+    extra = {'content_hash': content_hash}
+    if parsed_text is not None:
+        extra['parsed_text'] = parsed_text
+        extra.update(text_stats(parsed_text))
+        extra['paragraph_offsets'] = paragraph_offsets(parsed_text)
+    with transaction.atomic():
+        # Identical content is stored once and shared
+        extra['file'] = store_blob(upload, content_hash)
+        return serializer.save(uploader=user if user.is_authenticated else None, **extra)
+
+
+def generate_document_questions(document):
+    """
+    Generate quiz questions for a newly uploaded document (failures are logged,
+    not raised). Goes through the single-flight lock, so a client streaming the
+    document's questions/stream/ meanwhile relays this generation.
+    """
+    try:
+        saved = ensure_questions(document)
+        print(f"💾 {saved} questions saved for '{document.title}'")
+    except Exception as e:
+        print("Quiz generation failed:", str(e))
+
+
 # Django REST Framework API Views
+@method_decorator(revalidate_cache, name='list')
+@method_decorator(revalidate_cache, name='retrieve')
 class UploadedDocumentViewSet(viewsets.ModelViewSet):
     """API endpoint for uploaded documents"""
     authentication_classes = [CsrfExemptSessionAuthentication]
     queryset = UploadedDocument.objects.all().order_by('-uploaded_at')
     serializer_class = UploadedDocumentSerializer
+    # ?ordering=reading_minutes, ?ordering=-readability_grade, ...
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['uploaded_at', 'title', 'word_count', 'sentence_count', 'reading_minutes', 'readability_grade']
+    # ?min_words=300&max_reading_minutes=5&max_grade=6: ranges over the precomputed text statistics
+    range_filters = {
+        'words': ('word_count', int), 'sentences': ('sentence_count', int),
+        'reading_minutes': ('reading_minutes', int), 'grade': ('readability_grade', float),
+    }
 
-    def perform_create(self, serializer):
-        """Handle document upload and question generation"""
-        instance = serializer.save(uploader=self.request.user)
-        
-        # Parse .docx file
-        if instance.file.name.endswith('.docx'):
-            doc = Document(instance.file)
-            full_text = [para.text for para in doc.paragraphs]
-            instance.parsed_text = '\n'.join(full_text)
-            instance.save()
-
-        # Generate questions using AI
-        try:
-            parsed_text = instance.parsed_text[:3000]  # Limit to 3K chars
-            print("Generating quiz questions with Gemini...")
-            print("📄 Uploaded document:", instance.title)
-            print("📄 Parsed text snippet:", instance.parsed_text[:300] if instance.parsed_text else "NO TEXT")
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        params = self.request.query_params
+        for param, value in self.facet_selection().items():
+            if value is not None:
+                queryset = queryset.filter(**{f'{param}_id': value or None})
+        if params.get('uploader'):
+            uploader = params['uploader']
+            queryset = queryset.filter(uploader_id=int(uploader)) if uploader.isdigit() else queryset.filter(uploader__username=uploader)
+        for param, lookup in (('uploaded_after', 'uploaded_at__gte'), ('uploaded_before', 'uploaded_at__lt')):
+            if params.get(param):
+                value = parse_datetime(params[param]) or parse_date(params[param])
+                if value is None:
+                    raise ValidationError({param: 'Expected an ISO date or datetime'})
+                queryset = queryset.filter(**{lookup: value})
+        for name, (field, number) in self.range_filters.items():
+            for bound, lookup in (('min', 'gte'), ('max', 'lte')):
+                param = f'{bound}_{name}'
+                if params.get(param):
+                    try:
+                        value = number(params[param])
+                    except ValueError:
+                        raise ValidationError({param: 'Expected a whole number' if number is int else 'Expected a number'})
+                    # float() takes nan and inf, and int() any number of digits (the columns hold 32-bit values)
+                    if not math.isfinite(value) or abs(value) > 2 ** 31:
+                        raise ValidationError({param: 'Out of range'})
+                    queryset = queryset.filter(**{f'{field}__{lookup}': value})
+        return queryset
+
+    def facet_selection(self):
+        """Selected ?grade_level= / ?skill_category= ids (0 or 'none' = not set), None when not filtered"""
+        selection = {}
+        for param in ('grade_level', 'skill_category'):
+            value = self.request.query_params.get(param, '')
+            if value in ('', 'all'):
+                selection[param] = None
+            elif value == 'none' or value.isdigit():
+                selection[param] = int(value) if value.isdigit() else 0
+            else:
+                raise ValidationError({param: 'Expected an id or "none"'})
+        return selection
 
-            questions_text = generate_questions(parsed_text)
-            print("🤖 Raw Gemini output:\n", questions_text)
+    def get_serializer_class(self):
+        return DocumentListSerializer if self.action == 'list' else UploadedDocumentSerializer
 
-            parsed_questions = parse_questions(questions_text)
-            print("🔍 Parsed questions list:", parsed_questions)
+    def list(self, request, *args, **kwargs):
+        if not settings.USE_FAST_JSON:
+            response = super().list(request, *args, **kwargs)
+        else:
+            response = Response(document_list_data(self.filter_queryset(self.get_queryset()), request))
+        if request.query_params.get('facets', '').lower() in ('1', 'true', 'yes'):
+            response.data = {'results': response.data, 'facets': facet_counts(**self.facet_selection())}
+        return response
 
-            save_parsed_questions(instance, parsed_questions)
-            print("💾 Questions saved to DB.")
+    @drf_action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Document counts per grade level and skill category, narrowed by the other facet's selection"""
+        return Response(facet_counts(**self.facet_selection()))
 
+    @idempotent('documents.create')
+    def create(self, request, *args, **kwargs):
+        """Upload a document; retries with the same Idempotency-Key return the first result"""
+        return super().create(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        """Save the uploaded document and generate its questions"""
+        generate_document_questions(save_uploaded_document(serializer, self.request.user))
+
+    def perform_update(self, serializer):
+        """Re-parse a replaced file and regenerate only the questions whose section changed"""
+        previous_text = serializer.instance.parsed_text
+        upload = serializer.validated_data.get('file')
+        if upload is None:
+            serializer.save()
+            return
+
+        previous_file = serializer.instance.file.name
+        parsed_text, content_hash = read_upload_or_400(upload)
+        extra = {'content_hash': content_hash}
+        if parsed_text is not None:
+            extra['parsed_text'] = parsed_text
+            extra.update(text_stats(parsed_text))
+            extra['paragraph_offsets'] = paragraph_offsets(parsed_text)
+        with transaction.atomic():
+            extra['file'] = store_blob(upload, content_hash)
+            instance = serializer.save(**extra)
+            release_blob(previous_file)
+
+        try:
+            with generation_lock(instance):
+                deleted, generated = regenerate_changed_sections(instance, previous_text)
+            print(f"♻️ File replaced for '{instance.title}': {deleted} stale questions removed, {generated} regenerated")
         except Exception as e:
-            print("Quiz generation failed:", str(e))
+            print("Question regeneration failed:", str(e))
             import traceback
             traceback.print_exc()
 
 
+class UploadSessionView(APIView):
+    """Start a resumable chunked upload (protocol in uploads.py)"""
+    authentication_classes = [CsrfExemptSessionAuthentication]
+
+    def post(self, request):
+        data = request.data
+        try:
+            size = int(data.get('size', 0))
+        except (TypeError, ValueError):
+            return Response({'error': 'size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        metadata = {key: data[key] for key in ('title', 'grade_level', 'skill_category') if data.get(key) not in (None, '')}
+        serializer = UploadedDocumentSerializer(data=metadata, partial=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            session = create_upload_session(
+                request.user if request.user.is_authenticated else None,
+                data.get('filename', ''), size, data.get('sha256', ''), metadata,
+            )
+        except UploadError as e:
+            return Response({'error': str(e)}, status=e.status)
+        return Response(upload_session_data(session), status=status.HTTP_201_CREATED)
+
+
+def upload_session_data(session):
+    return {
+        'id': str(session.pk),
+        'offset': session.received,
+        'size': session.size,
+        'chunk_size': settings.UPLOAD_CHUNK_MAX_SIZE,
+        'expires_at': session.expires_at,
+        'document_id': session.document_id,
+    }
+
+
+class UploadSessionMixin:
+    authentication_classes = [CsrfExemptSessionAuthentication]
+
+    def get_session(self, request, pk, lock=False):
+        queryset = UploadSession.objects.select_for_update() if lock else UploadSession.objects
+        session = get_object_or_404(queryset, pk=pk)
+        if session.uploader_id and session.uploader_id != request.user.id:
+            raise Http404  # someone else's upload
+        return session
+
+
+@method_decorator(never_cache, name='get')
+class UploadSessionDetailView(UploadSessionMixin, APIView):
+    """Status (GET), next chunk (PUT with an Upload-Offset header) or abandon (DELETE) an upload"""
+
+    def get(self, request, pk):
+        return Response(upload_session_data(self.get_session(request, pk)))
+
+    def put(self, request, pk):
+        try:
+            offset = int(request.headers.get('Upload-Offset', request.query_params.get('offset', '')))
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            return Response({'error': 'Upload-Offset header is required'}, status=status.HTTP_400_BAD_REQUEST)
+        session = self.get_session(request, pk)
+        try:
+            # request.stream is read as it arrives, never buffered whole, and without holding the row lock
+            path, written = receive_chunk(session, request.stream, offset, length)
+            with transaction.atomic():
+                session = self.get_session(request, pk, lock=True)
+                commit_chunk(session, offset, path, written)
+        except UploadError as e:
+            return Response({'error': str(e), 'offset': session.received}, status=e.status)
+        return Response(upload_session_data(session))
+
+    def delete(self, request, pk):
+        session = self.get_session(request, pk)
+        discard_staging_file(session)
+        session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadSessionFinalizeView(UploadSessionMixin, APIView):
+    """Check the assembled file and create the document from it, like a normal upload"""
+
+    def post(self, request, pk):
+        session = self.get_session(request, pk)
+        if not claim_session(session):
+            if session.status == UploadSession.FINALIZED:
+                # A retried finalize: return the document made the first time
+                if session.document is None:
+                    raise Http404("The document was deleted")
+                return Response(UploadedDocumentSerializer(session.document, context={'request': request}).data)
+            if session.status == UploadSession.FINALIZING:
+                return Response({'error': 'Upload is being finalized'}, status=status.HTTP_409_CONFLICT)
+            return Response(
+                {'error': 'Upload is incomplete', 'offset': session.received, 'size': session.size},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        # The claim keeps other finalizes and chunks out; no lock is held while parsing and storing
+        try:
+            with open(assemble_staging_file(session), 'rb') as f:
+                upload = File(f, name=session.filename)
+                if session.sha256 and hash_file(upload) != session.sha256:
+                    release_session(session)
+                    return Response(
+                        {'error': 'Uploaded content does not match the declared sha256; start a new upload'},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+                serializer = UploadedDocumentSerializer(
+                    data={**session.metadata, 'file': upload}, context={'request': request},
+                )
+                serializer.is_valid(raise_exception=True)
+                document = save_uploaded_document(serializer, request.user)
+        except UploadError as e:
+            release_session(session)
+            return Response({'error': str(e)}, status=e.status)
+        except Exception:
+            release_session(session)
+            raise
+        finish_session(session, document)
+        generate_document_questions(document)
+        return Response(
+            UploadedDocumentSerializer(document, context={'request': request}).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
 class DocumentDetailView(APIView):
     """Get detailed document information with questions"""
+    queryset = UploadedDocument.objects.prefetch_related(
+        Prefetch('questions', queryset=QuizQuestion.objects.order_by('id').prefetch_related(
+            Prefetch('answers', queryset=QuizAnswer.objects.order_by('id'))
+        ))
+    )
+
+    @method_decorator(revalidate_cache)
     def get(self, request, pk):
-        document = get_object_or_404(UploadedDocument, pk=pk)
+        if settings.USE_FAST_JSON:
+            return Response(document_detail_data(pk))
+        document = get_object_or_404(self.queryset, pk=pk)
         serializer = DocumentDetailSerializer(document)
         return Response(serializer.data)
 
 
+class DocumentTextView(APIView):
+    """
+    One page of a document's text, ?page=N (from 1), in whole paragraphs of
+    up to paging.PAGE_CHARS characters: {id, page, page_count, text, next_page}
+    """
+
+    @method_decorator(revalidate_cache)
+    def get(self, request, pk):
+        page = request.query_params.get('page', '1')
+        if not page.isdigit() or int(page) < 1:
+            raise ValidationError({'page': 'Expected a page number from 1'})
+        page = int(page)
+        try:
+            text, page_count = read_page(pk, page)
+        except UploadedDocument.DoesNotExist:
+            raise Http404('No UploadedDocument matches the given query.')
+        if text is None:
+            raise Http404('No such page.')
+        return Response({
+            'id': pk,
+            'page': page,
+            'page_count': page_count,
+            'text': text,
+            'next_page': page + 1 if page < page_count else None,
+        })
+
+
+@method_decorator(revalidate_cache, name='list')
+@method_decorator(revalidate_cache, name='retrieve')
 class QuizQuestionViewSet(viewsets.ModelViewSet):
     """API endpoint for quiz questions"""
     queryset = QuizQuestion.objects.all()
     serializer_class = QuizQuestionSerializer
 
     def get_queryset(self):
+        queryset = QuizQuestion.objects.order_by('id').prefetch_related(
+            Prefetch('answers', queryset=QuizAnswer.objects.order_by('id'))
+        )
         document_id = self.request.query_params.get('document_id', None)
         if document_id:
-            return QuizQuestion.objects.filter(document_id=document_id)
-        return QuizQuestion.objects.all()
+            return queryset.filter(document_id=document_id)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if not settings.USE_FAST_JSON:
+            return super().list(request, *args, **kwargs)
+        return Response(question_list_data(self.filter_queryset(self.get_queryset())))
+
+    @drf_action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser])
+    def import_bank(self, request):
+        """
+        Import a question bank: multipart `file` (CSV or NDJSON, see
+        question_import.py), optional `format` and `dry_run`. Staff only.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Upload the question bank as `file`'}, status=status.HTTP_400_BAD_REQUEST)
+        if upload.size > settings.QUESTION_IMPORT_MAX_UPLOAD:
+            # The import runs inside the request; large banks belong to the management command
+            return Response(
+                {'error': f'Files over {settings.QUESTION_IMPORT_MAX_UPLOAD} bytes must be imported with manage.py import_questions'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        file_format = request.data.get('format') or format_for(upload.name, upload.content_type or '')
+        if file_format not in IMPORT_FORMATS:
+            return Response({'error': 'format must be csv or ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        result = import_question_file(upload.file, file_format, dry_run=dry_run)
+        return Response({
+            'imported': result.imported,
+            'dry_run': dry_run,
+            'error_count': len(result.errors),
+            'errors': [{'line': line, 'error': message} for line, message in result.errors[:100]],
+        })
 
 
 class QuizAnswerViewSet(viewsets.ModelViewSet):
@@ -158,9 +600,49 @@ class QuizResponseViewSet(viewsets.ModelViewSet):
     queryset = QuizResponse.objects.all()
     serializer_class = QuizResponseSerializer
 
+    @drf_action(detail=False, methods=['get'], url_path='export',
+                renderer_classes=[CSVRenderer, NDJSONRenderer], permission_classes=[IsAuthenticated])
+    def export(self, request):
+        """
+        Stream quiz results as CSV (default) or NDJSON (?format=ndjson or
+        Accept: application/x-ndjson), one row per answer, or per attempt with
+        ?rows=responses. Filters: document, user (id or username), user_name,
+        since/until (ISO date or datetime). Staff export everything; other
+        users export results for the documents they uploaded.
+        """
+        responses = QuizResponse.objects.all()
+        if not request.user.is_staff:
+            responses = responses.filter(document__uploader=request.user)
+
+        params = request.query_params
+        if params.get('document'):
+            if not params['document'].isdigit():
+                raise ValidationError({'document': 'Expected a document id'})
+            responses = responses.filter(document_id=int(params['document']))
+        if params.get('user'):
+            user = params['user']
+            responses = responses.filter(user_id=int(user)) if user.isdigit() else responses.filter(user__username=user)
+        if params.get('user_name'):
+            responses = responses.filter(user_name=params['user_name'])
+        for param, lookup in (('since', 'submitted_at__gte'), ('until', 'submitted_at__lt')):
+            if params.get(param):
+                value = parse_datetime(params[param]) or parse_date(params[param])
+                if value is None:
+                    raise ValidationError({param: 'Expected an ISO date or datetime'})
+                responses = responses.filter(**{lookup: value})
+
+        header, rows = export_rows(responses, per_answer=params.get('rows', 'answers') != 'responses')
+        renderer = request.accepted_renderer
+        stream = ndjson_stream(header, rows) if renderer.format == 'ndjson' else csv_stream(header, rows)
+        response = StreamingHttpResponse(stream, content_type=f'{renderer.media_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="quiz-results.{renderer.format}"'
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
 
 class SubmitQuizView(APIView):
     """Handle quiz submission and scoring"""
+    @idempotent('submit-quiz')
     def post(self, request):
         try:
             data = request.data
@@ -168,59 +650,22 @@ class SubmitQuizView(APIView):
             user_name = data.get('user_name', 'Anonymous')
             answers = data.get('answers', [])
 
-            document = get_object_or_404(UploadedDocument, id=document_id)
-            questions = QuizQuestion.objects.filter(document=document)
-
-            if not questions.exists():
-                return Response(
-                    {'error': 'No questions found for this document'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            # Unknown document/question/answer ids raise Http404 -> 400 below, as before
+            submission = score_submission(document_id, user_name, answers)
 
-            # Calculate score
-            score = 0
-            total_questions = questions.count()
-            user_answers = []
-
-            for answer_data in answers:
-                question_id = answer_data.get('question_id')
-                selected_answer_id = answer_data.get('selected_answer_id')
-
-                question = get_object_or_404(QuizQuestion, id=question_id)
-                selected_answer = get_object_or_404(QuizAnswer, id=selected_answer_id)
-
-                is_correct = selected_answer.is_correct
-                if is_correct:
-                    score += 1
-
-                user_answers.append({
-                    'question': question,
-                    'selected_answer': selected_answer,
-                    'is_correct': is_correct
-                })
-
-            # Create quiz response
-            quiz_response = QuizResponse.objects.create(
-                document=document,
-                user_name=user_name,
-                score=score,
-                total_questions=total_questions
-            )
-
-            # Create user answers
-            for user_answer_data in user_answers:
-                UserAnswer.objects.create(
-                    response=quiz_response,
-                    question=user_answer_data['question'],
-                    selected_answer=user_answer_data['selected_answer'],
-                    is_correct=user_answer_data['is_correct']
-                )
+            if settings.QUIZ_WRITE_BEHIND:
+                # Durable local journal now, database later (flush_quiz_journal)
+                quiz_journal().append(submission)
+                response_id = None
+            else:
+                response_id = save_submission(submission).id
 
             return Response({
-                'response_id': quiz_response.id,
-                'score': score,
-                'total_questions': total_questions,
-                'percentage': round((score / total_questions) * 100, 2)
+                'response_id': response_id,
+                'submission_id': submission.submission_id,
+                'score': submission.score,
+                'total_questions': submission.total_questions,
+                'percentage': round((submission.score / submission.total_questions) * 100, 2)
             })
 
         except Exception as e:
@@ -230,16 +675,37 @@ class SubmitQuizView(APIView):
             )
 
 
-class GradeLevelViewSet(viewsets.ModelViewSet):
+class ReferenceDataViewSetMixin:
+    """Serve list/retrieve from the process-local reference cache; writes go to the DB"""
+    reference_cache = None
+
+    def list(self, request, *args, **kwargs):
+        return Response(self.get_serializer(self.reference_cache.all(), many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.reference_cache.get(kwargs.get('pk'))
+        if instance is None:
+            raise Http404
+        self.check_object_permissions(request, instance)
+        return Response(self.get_serializer(instance).data)
+
+
+@method_decorator(reference_data_cache, name='list')
+@method_decorator(reference_data_cache, name='retrieve')
+class GradeLevelViewSet(ReferenceDataViewSetMixin, viewsets.ModelViewSet):
     """API endpoint for grade levels"""
     queryset = GradeLevel.objects.all()
     serializer_class = GradeLevelSerializer
+    reference_cache = grade_levels
 
 
-class SkillCategoryViewSet(viewsets.ModelViewSet):
+@method_decorator(reference_data_cache, name='list')
+@method_decorator(reference_data_cache, name='retrieve')
+class SkillCategoryViewSet(ReferenceDataViewSetMixin, viewsets.ModelViewSet):
     """API endpoint for skill categories"""
     queryset = SkillCategory.objects.all()
     serializer_class = SkillCategorySerializer
+    reference_cache = skill_categories
 
 
 # User Authentication API Views
@@ -379,6 +845,7 @@ class UserLogoutView(APIView):
 
 class UserProfileView(APIView):
     """Get current user profile"""
+    @method_decorator(never_cache)
     def get(self, request):
         """Get current user profile"""
         if request.user.is_authenticated: